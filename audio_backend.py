@@ -19,9 +19,7 @@
 import sys
 import numpy as np
 import copy # 再代入を想定したインスタンス変数（mutable: list, dict, bytearray, set）は deepcopy で渡す必要がある。
-import queue
 import collections
-import threading
 import os
 from datetime import datetime
 from socket import gethostname
@@ -33,6 +31,12 @@ import inspect
 
 from utils import to_dBFS, make_beep
 from vc_engine import AudioEfx
+from peak_pyramid import PeakFeed
+from audio_recorder import AudioRecorder
+from audio_ring import DriftRing
+from rolling_archive import RollingArchive
+from offline_worker import OfflineWorker
+from json_writer import JsonWriter
 
 # hi dpi 対応
 import ctypes
@@ -42,7 +46,6 @@ except:
     pass
 
 import sounddevice as sd
-import soundfile as sf
 
 from audio_device_check import device_test_spawn, device_test_strict
 
@@ -90,7 +93,7 @@ class SoundControl:
 
         # 音声サンプルを読み込む処理において、これよりも長い秒数は冒頭のみ処理
         self.sampler_max_sec = self.vc_config["sampler_max_sec"]
-        # ファイルに対するオフライン VC における最大秒数。これを超えるサンプルは冒頭のみロードされる
+        # ファイルに対するオフライン VC における最大秒数（旧仕様）。ドロップ変換は区間ごとに処理するので、現在は参照していない
         self.offline_max_sec = self.vc_config["offline_max_sec"]
         
         # 本当は以下の変数は VC の実行クラスに持たせるべき。ただし操作パネル側を同時に書き変える必要があるので、後で作業
@@ -101,20 +104,19 @@ class SoundControl:
         self.sample_amp: float = 1.0
         
         # self.record_every が一定以上の値で record_output_audio == True が入る。
-        # record_output_audio == True のとき、record_every 秒ごとに出力音声を切ってファイルに保存する。
+        # record_output_audio == True のとき、入出力音声を専用スレッドで逐次ファイルに追記し、record_every 秒ごとにファイルを切り替える。
         self.record_every = self.vc_config["record_every"]
         if self.record_every > 1e-5:
-            self.record_input_audio = True # TODO: 現在、Ctrl + C すると終了処理に最後のバッファの保存が含まれない
+            self.record_input_audio = True
             self.record_output_audio = True
         else:
             self.record_input_audio = False
             self.record_output_audio = False
+        self.recorder = None # AudioRecorder は sr_out とチャンネル数が決まってから作る
+        self.archive = None # 直近の音声を保持する RollingArchive も同様
         
         # 内部変数の初期化
 
-        self.all_input_buffer = [] # 入力音声をひたすら貯める。ただし self.record_input_audio = True の場合のみデータが入る
-        self.all_output_buffer = [] # 出力音声をひたすら貯める。ただし self.record_output_audio = True の場合のみデータが入る
-        
         self.input_dBFS = self.VC_threshold - 10 # これは適当な初期値を入れているだけ
         self.output_dBFS = self.VC_threshold - 10
 
@@ -123,12 +125,36 @@ class SoundControl:
         self.is_voice = self.keep_voiced + 1 # 現在のフレームが voiced であるかどうか。keep_voiced = 1 ならここに 2 が入る
         self.vc_now: bool = False # 実際に現在 VC が掛かっている状態か。画面のタリー表示に使う
         self.offline_conversion_now: bool = False # 現在オフライン変換が走っている状態か。
+        # ドロップされたファイルのオフライン VC は、専用の ONNX セッションを持つ低優先度のワーカーで、リアルタイム VC と並行して行う
+        self.offline_worker = OfflineWorker(
+            self,
+            self.vc_config,
+            intra_op_threads = self.vc_config.get("offline_threads", 2),
+            live_budget = self.vc_config.get("offline_live_budget", 0.8),
+            live_window_sec = self.vc_config.get("offline_live_window_sec", 1.0),
+            max_wait_sec = self.vc_config.get("offline_max_wait_sec", 2.0),
+        )
+        
+        # vc_config やポートフォリオの json は、GUI スレッドでは予約だけして、専用スレッドがまとめて書き出す
+        self.json_writer = JsonWriter(
+            interval_sec = self.vc_config.get("persist_interval_sec", 1.0),
+        )
         
         # ここから、別のインスタンスやプロセスと信号をやり取りするためのキューを定義
         self.queueA = collections.deque(maxlen = 2048) # A は backend 内の InputStream → (queue → OutputStream) で使用
-        self.wq_input = queue.Queue() # wq_input は InputStream -> plot_waveform
-        self.wq_output = queue.Queue() # wq_output は OutputStream -> plot_waveform
-        self.queueP = queue.Queue() # P は sample player -> InputStream のミックス用信号
+        # 波形プロット用は容量固定の PeakFeed。GUI が止まっても溜まり続けず、プロットが見えていない間は書き込まない
+        self.wq_input = PeakFeed(base_factor = 32) # wq_input は InputStream -> plot_waveform
+        self.wq_output = PeakFeed(base_factor = 32) # wq_output は OutputStream -> plot_waveform
+        # sample player の音は、input_callback が呼ばれるたびに frames サンプルずつ直接引いてミックスする。
+        # sample player 専用の OutputStream とキューを挟まないので、2 つのデバイスのクロックのずれで溜まったり欠けたりしない。
+        # sample_source は frames を受け取って (frames, n_ch_in_use[0]) を返す（再生していなければ None）関数で、
+        # SampleManagerPanel が登録する
+        self.sample_source = None
+        # sample player の音を、VC を通さずに出力デバイスにも混ぜる（モニター）か。入力と出力の callback はクロックが
+        # 異なりうるので、読み出しの速さを補正するリング（DriftRing）で受け渡す。リングは scan の後に作る。
+        # サンプラーの試聴用の変換済みの音（SamplePreview）も、同じリングで出力側に渡す
+        self.sample_monitor: bool = self.vc_config.get("sampler_monitor", False)
+        self.sample_monitor_ring = None
 
         # 現在の VC の変換先スタイル。ここでは問答無用でゼロ初期化し、 SampleManagerPanel の初期化時に書き換える。
         self.current_target_style = np.zeros((1, 128), dtype = np.float32) # ここが vc_engine から読まれる
@@ -187,6 +213,7 @@ class SoundControl:
         else:
             pass # TODO 万が一、どちらも None だったときの処理をまだ考えていない
         self.need_remake_stream = False # 
+        self.sample_monitor_ring = self.make_sample_monitor_ring()
         
         # dummy input として、長さが frames である正弦波を作る。開始フェーズは self.head_i で決まる
         self.data_sine = make_beep(
@@ -209,6 +236,36 @@ class SoundControl:
         
         self.timestamp_at_start = datetime.now().strftime('%Y-%m-%d_%H-%M-%S') # アプリ起動時刻
 
+        # 録音用の writer スレッド。callback はリングにコピーするだけで、エンコードとファイル書き込みはこちらで行う
+        if self.record_input_audio or self.record_output_audio:
+            tracks = {}
+            if self.record_input_audio:
+                tracks["i"] = self.n_ch_in_use[2] # 入力は VC の入口（output_callback 側）で取るので出力と同じ ch 数
+            if self.record_output_audio:
+                tracks["o"] = self.n_ch_in_use[2]
+            self.recorder = AudioRecorder(
+                sr = self.sr_out,
+                tracks = tracks,
+                timestamp = self.timestamp_at_start,
+                directory = self.vc_config.get("record_dir", "."),
+                rotate_sec = self.record_every,
+                rotate_mb = self.vc_config.get("record_rotate_mb", 0.0),
+                file_format = self.vc_config.get("record_format", "OGG"),
+            )
+
+        # 直近 archive_minutes 分の入出力音声とブロックごとの状態を、メモリマップトファイルのリングに保持し続ける。
+        # 「直前の音声を保存」はここから切り出すので、record_every による常時録音が不要になる
+        archive_minutes = self.vc_config.get("archive_minutes", 3.0)
+        if archive_minutes > 0:
+            self.archive = RollingArchive(
+                directory = self.vc_config.get("archive_dir", "./archive"),
+                sr = self.sr_out,
+                n_ch_in = self.n_ch_in_use[0],
+                n_ch_out = self.n_ch_in_use[2],
+                blocksize = self.blocksize,
+                minutes = archive_minutes,
+            )
+
         # スキャン＆選択したデバイスで stream を初期化する
         
         self.input_stream = sd.InputStream(
@@ -254,27 +311,21 @@ class SoundControl:
         if status:
             self.logger.info(status)
 
-        # data_p は無音 + sample player
-        data_p = np.zeros((frames, self.n_ch_in_use[0])) # self.n_ch_in_use[0] が入力 ch 数
-        
-        # こちらは、sample player から信号が来ている場合にミックスする。どんな場合でも高々 1 block
-        if self.queueP.empty() is False:
-            side_wav = self.queueP.get() # ここは wait が必要。でないとこちらの反応が速すぎてサンプルが落ちる
-            if frames == side_wav.shape[0]:
-                for i in list(range(self.n_ch_in_use[0])):
-                    data_p[:, i] = side_wav[: , i] # n_ch_in_use[0] = 2 だったら i = 0, 1 の 2 チャンネル分
-            else:
-                self.logger.warning(f"({inspect.currentframe().f_code.co_name}) Sample player blocksize{side_wav.shape[0]} does not match the one of the audio backend {frames}")
+        # data_p は sample player の音 (frames, self.n_ch_in_use[0])。再生していなければ None。
+        # このブロックの長さ（frames）だけ、sample player の再生ヘッドが進む
+        data_p = self.sample_source(frames) if self.sample_source is not None else None
 
         # どうやら mic input は断続的（indata の block が常には存在しない）らしい。
         # なので inputStream と outputStream を分離する設計の場合、indata を突っ込むだけだと音声が途切れる。
+        # mic preamp はここに掛かる
+        data_send = indata.copy()*10**(self.mic_amp/20)
+        if data_p is not None:
+            data_send = data_send + data_p*self.sample_amp
+            if self.sample_monitor:
+                self.sample_monitor_ring.push(data_p*self.sample_amp) # モニター用。出力側の callback で混ぜる
         if self.generate_sine or self.beep:
-            data_send = (self.data_sine[:frames, :] + indata.copy()*10**(self.mic_amp/20)) + data_p*self.sample_amp
-            data_send = np.clip(data_send, -1, 1)
+            data_send = np.clip(self.data_sine[:frames, :] + data_send, -1, 1)
             self.data_sine = np.roll(self.data_sine, -frames, axis = 0)
-        else:
-            # mic preamp はここに掛かる
-            data_send = indata.copy()*10**(self.mic_amp/20) + data_p*self.sample_amp
 
         # VC 用の level 計算は mix 後に行うよう仕様変更した
         self.input_dBFS = to_dBFS(data_send)
@@ -289,7 +340,9 @@ class SoundControl:
         
         # 音声ブロックに加え、音量レベルが閾値以上かどうかを、キューに乗せて流す
         self.queueA.append((data_send, copy.deepcopy(self.is_voice))) # # queueA は backend -> AudioEfx
-        self.wq_input.put(data_send) # wq_input は backend -> plot_waveform
+        self.wq_input.push(data_send) # wq_input は backend -> plot_waveform
+        if self.archive is not None:
+            self.archive.append_input(data_send) # ミックス後の入力を、直近の音声として保持
 
         self.head_i += frames # 入力がどこまで処理されたかのヘッド位置を進める
 
@@ -348,42 +401,35 @@ class SoundControl:
                 # しかし sample player 側も措置が必要で、そちらのロジックが未完成なので現在 sample player が落ちる
                 outdata[:] = np.zeros((frames, self.n_ch_in_use[2]), dtype = 'float32')
 
+            # sample player のモニターと、試聴用の変換済みの音。入力側の callback がリングに積んだ音を、
+            # クロックのずれを補正しながら足す（どちらも無ければリングは空で、何もしない）
+            if not self.mute:
+                self.sample_monitor_ring.mix_into(outdata)
+
             # wq_output は output waveform plot
-            self.wq_output.put(outdata[:, list(range(self.n_ch_in_use[2]))] * (1 - int(self.mute))) 
+            if self.wq_output.active: # プロットが見えていないときは、コピーを作ること自体を省く
+                self.wq_output.push(outdata[:, list(range(self.n_ch_in_use[2]))] * (1 - int(self.mute))) 
 
             # 入力音声を録音する機能 → 出力との比較でタイミングを揃えたいので、入力音声だが output_callback 側に実装した
             # ただし遅延量の厳密な測定には、input_callback 側に置いた方が便利なので、将来的に切り替え可能にしたい。
+            # リングへのコピーだけを行い、ファイルへの書き込みは AudioRecorder のスレッドに任せる
             if self.record_input_audio:
-                self.all_input_buffer.append(audio_data.copy()) # 起動時から（もしくは捨てて以降）の入力音声のバッファに追加
-                # バッファの長さが self.record_every を超えるごとに、ファイルに保存
-                if len(self.all_input_buffer) >= self.record_every * self.sr_out // self.blocksize:
-                    filename = f'i_{self.timestamp_at_start}_{self.head_o:011}.ogg'
-                    threading.Thread(
-                        target = sf.write, 
-                        args = (
-                            filename, 
-                            np.concatenate(self.all_input_buffer), 
-                            int(self.sr_out),
-                        )
-                    ).start()
-                    self.all_input_buffer = []
+                self.recorder.push("i", audio_data)
 
             # 出力音声を録音する機能
             if self.record_output_audio:
-                self.all_output_buffer.append(outdata.copy()) 
-                if len(self.all_output_buffer) >= self.record_every * self.sr_out // self.blocksize:
-                    filename = f'o_{self.timestamp_at_start}_{self.head_o:011}.ogg'
-                    threading.Thread(
-                        target = sf.write, 
-                        args = (
-                            filename, 
-                            np.concatenate(self.all_output_buffer), 
-                            int(self.sr_out),
-                        )
-                    ).start()
-                    self.all_output_buffer = []
+                self.recorder.push("o", outdata)
 
             self.output_dBFS = to_dBFS(outdata)
+            if self.archive is not None:
+                efx = self.efx_control
+                self.archive.append_output(
+                    outdata, 
+                    (
+                        self.head_o, self.input_dBFS, self.output_dBFS, is_voice, self.vc_now,
+                        efx.vc_lap, efx.CE_lap, efx.harmof0_lap, efx.SE_lap, efx.f0n_lap, efx.decode_lap,
+                    ), # RollingArchive.meta_fields の順
+                )
             self.head_o += frames
             
         elif self.head_i <= 0:
@@ -607,6 +653,7 @@ class SoundControl:
         )
 
         self.terminate()
+        self.sample_monitor_ring = self.make_sample_monitor_ring() # チャンネル数や blocksize が変わりうる
 
         # いったん input と output の両ストリームを作り直している。
         # 本当は変更がある方だけ作り直すべきだが、信号が切れてもいいなら両方リセットして新規に作るほうが楽だろう。
@@ -641,6 +688,15 @@ class SoundControl:
         # なお出力デバイスの場合、音は聞こえないがプログラムは停止しない。
 
 
+    # sample player のモニター用のリング。入力側の callback が 1 回飛んでも空にならないよう、3 ブロック分を目標に溜める
+    def make_sample_monitor_ring(self):
+        return DriftRing(
+            capacity = max(int(self.sr_out), 8 * self.blocksize), 
+            n_channel = self.n_ch_in_use[2], 
+            target = 3 * self.blocksize,
+        )
+
+
     def terminate(
         self,
     ) -> None:
@@ -648,3 +704,15 @@ class SoundControl:
         self.output_stream.stop()
         self.input_stream.close() 
         self.output_stream.close() 
+
+
+    # アプリ終了時の処理。ストリームとオフライン変換を止めた後、録音中のファイルに残りを書き出して閉じる
+    # （terminate はデバイス変更時にも呼ばれるので、録音はそちらでは止めない）。最後に未保存の json を書き出す
+    def shutdown(
+        self,
+    ) -> None:
+        self.terminate()
+        self.offline_worker.shutdown()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.json_writer.shutdown()
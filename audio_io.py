@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import os
+import math
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+import librosa
+from pydub import AudioSegment
+from pydub.utils import mediainfo
+
+
+# 音声ファイルの読み込みをまとめたモジュール。サンプラー（sample_loader）とオフライン変換（offline_converter）が共通で使う。
+#   - soundfile（libsndfile）で開けるファイルは SoundFileSource で、必要な区間だけシークしてブロック単位で読む
+#   - それ以外（m4a、opus、古い libsndfile での mp3 など）は pydub（ffmpeg）でデコードする。max_sec を与えれば
+#     ffmpeg にその秒数で止めさせるので、冒頭だけを使う場合にファイル全体をデコードしない
+#   - ダウンミックスは読み出し時にブロックごと、リサンプルは前後に余白を付けたブロックごとに行う（read_resampled）。
+#     ファイル全体を元のサンプリング周波数でメモリに置くことはない（pydub の場合を除く）
+#   - load_audio は 1 回のデコードで複数のサンプリング周波数の音声を作る。DecodePool はそれをスレッドプールで並列に回す。
+#     fill_resampled は書き込み先を与える版で、メモリマップに直接書けば長いファイルでもメモリに全体を置かない
+#   - StreamedSample はサンプラーの再生用。メモリマップから、先読みしながらブロックごとに読み出す
+
+
+class SoundFileSource:
+    """
+    soundfile で開けるファイル。必要な区間だけシークして読む。max_sec を与えると、それ以降はファイル外として扱う
+    """
+    def __init__(self, path: str, max_sec: float = None):
+        self.file = sf.SoundFile(path, mode = 'r')
+        self.sr = int(self.file.samplerate)
+        self.n_samples = int(self.file.frames)
+        if max_sec is not None:
+            self.n_samples = min(self.n_samples, int(max_sec * self.sr))
+
+
+    # [start, stop) をモノラルで返す。ファイル外は 0 で埋める
+    def read(self, start: int, stop: int):
+        out = np.zeros(stop - start, dtype = np.float32)
+        a, b = max(start, 0), min(stop, self.n_samples)
+        if b > a:
+            self.file.seek(a)
+            out[a - start:b - start] = self.file.read(b - a, dtype = 'float32', always_2d = True).mean(axis = 1)
+        return out
+
+
+    def close(self):
+        self.file.close()
+
+
+class ArraySource:
+    """
+    soundfile が扱えない形式は pydub でデコードしてメモリに置く。max_sec を与えると、ffmpeg はその秒数でデコードを止める。
+    インターフェースは SoundFileSource と同じ
+    """
+    def __init__(self, path: str, max_sec: float = None):
+        audio = AudioSegment.from_file(path, duration = max_sec)
+        audio = audio.set_channels(1) if audio.channels > 1 else audio
+        audio = audio.set_sample_width(2) # 16 bit
+        self.sr = int(audio.frame_rate)
+        self.data = np.array(audio.get_array_of_samples(), dtype = np.float32) / 32768.0
+        if max_sec is not None:
+            self.data = self.data[:int(max_sec * self.sr)]
+        self.n_samples = self.data.shape[0]
+
+
+    def read(self, start: int, stop: int):
+        out = np.zeros(stop - start, dtype = np.float32)
+        a, b = max(start, 0), min(stop, self.n_samples)
+        if b > a:
+            out[a - start:b - start] = self.data[a:b]
+        return out
+
+
+    def close(self):
+        pass
+
+
+def open_audio_source(path: str, max_sec: float = None):
+    try:
+        return SoundFileSource(path, max_sec = max_sec)
+    except Exception:
+        return ArraySource(path, max_sec = max_sec)
+
+
+# ファイル全体の長さ（秒）。デコードはしない
+def audio_duration(path: str) -> float:
+    try:
+        return sf.info(path).duration
+    except Exception:
+        return float(mediainfo(path)["duration"])
+
+
+# ソースを sr に変換したときの [start, stop) をモノラルで返す。前後に余白を付けて読んでリサンプルし、切り出す
+def read_resampled(source, sr: int, start: int, stop: int):
+    if source.sr == sr:
+        return source.read(start, stop)
+    ratio = source.sr / sr
+    margin = source.sr // 10 # リサンプルフィルタの端の影響を避けるための余白
+    r0 = int(math.floor(start * ratio)) - margin
+    r1 = int(math.ceil(stop * ratio)) + margin
+    y = librosa.resample(
+        source.read(r0, r1), orig_sr = source.sr, target_sr = sr, res_type = "polyphase",
+    )
+    offset = int(round(start - r0 / ratio))
+    out = np.zeros(stop - start, dtype = np.float32)
+    seg = y[offset:offset + out.shape[0]]
+    out[:seg.shape[0]] = seg
+    return out
+
+
+# ソースを sr に変換したときのサンプル数。max_sec を与えれば、その秒数で切る
+def resampled_length(source, sr: int, max_sec: float = None) -> int:
+    n_samples = source.n_samples if max_sec is None else min(source.n_samples, int(max_sec * source.sr))
+    return int(math.ceil(n_samples * sr / source.sr))
+
+
+# out（1 次元、メモリマップでもよい）の長さ分だけ、ソースを sr に変換して block_sec 秒ずつ書き込む。
+# cancel がセットされたら途中でやめて False を返す
+def fill_resampled(source, sr: int, out, block_sec: float = 10.0, cancel = None) -> bool:
+    block = int(block_sec * sr)
+    for start in range(0, out.shape[0], block):
+        if cancel is not None and cancel.is_set():
+            return False
+        stop = min(start + block, out.shape[0])
+        out[start:stop] = read_resampled(source, int(sr), start, stop)
+    return True
+
+
+# ファイルの冒頭 max_sec 秒を、sr_list の各サンプリング周波数のモノラル音声 (1, time) にして返す。
+# デコードは 1 回だけで、block_sec 秒ずつ読んではそれぞれの周波数にリサンプルする
+def load_audio(
+    path: str, 
+    sr_list, 
+    max_sec: float = None, 
+    block_sec: float = 10.0,
+):
+    source = open_audio_source(path, max_sec = max_sec)
+    try:
+        outputs = []
+        for sr in sr_list:
+            out = np.zeros((1, resampled_length(source, sr)), dtype = np.float32)
+            fill_resampled(source, sr, out[0], block_sec = block_sec)
+            outputs.append(out)
+        return outputs
+    finally:
+        source.close()
+
+
+class StreamedSample:
+    """
+    再生用のサンプル (time, channel)。サンプルのキャッシュのメモリマップのまま持ち、再生位置から readahead_sec 秒先までの
+    ページを別スレッドで先読みしておく（オーディオのコールバックがディスクの読み込みを待たないように）。
+    出力のチャンネル数への変換（モノラル→ステレオ、ステレオ→ ch0）も、全体を複製せずに読み出すブロックごとに行う。
+    メモリ上の配列を与えた場合は先読みしない
+    """
+    def __init__(
+        self, 
+        data, # (time, channel)
+        n_ch: int, # 出力のチャンネル数（shape に使う。実際の変換は read に渡す out のチャンネル数に合わせる）
+        sr: int, 
+        readahead_sec: float = 2.0,
+    ):
+        self.data = data
+        self.n_ch = n_ch
+        self.readahead = max(int(readahead_sec * sr), 1)
+        self.position = 0 # 最後に読まれた位置
+        self.prefetch_from = 0 # [prefetch_from, prefetched) は先読み済み
+        self.prefetched = 0
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        if isinstance(data, np.memmap):
+            self.thread = threading.Thread(target = self._run, daemon = True)
+            self.thread.start()
+            self.wake.set()
+
+
+    def __len__(self):
+        return self.data.shape[0]
+
+
+    @property
+    def shape(self):
+        return (self.data.shape[0], self.n_ch)
+
+
+    # out (frames, n_ch) に [start, start + frames) を書く。終端より先は 0 で埋める
+    def read(self, start: int, out):
+        seg = self.data[start:start + out.shape[0]]
+        m = seg.shape[0]
+        if seg.shape[1] == out.shape[1] or seg.shape[1] == 1:
+            out[:m] = seg # モノラルは全チャンネルに広げる
+        else:
+            out[:m] = seg[:, :out.shape[1]] # チャンネルが多ければ先頭から使う
+        out[m:] = 0
+        self.position = start
+        if self.thread is not None and (start < self.prefetch_from or start + self.readahead // 2 > self.prefetched):
+            self.wake.set()
+
+
+    # 各ページの先頭の 1 サンプルだけを読んで、OS のページキャッシュに載せる
+    def _run(self):
+        step = max(4096 // (self.data.dtype.itemsize * self.data.shape[1]), 1) # 1 ページあたりのサンプル数
+        while not self.stop_event.is_set():
+            self.wake.wait()
+            self.wake.clear()
+            position = self.position
+            if position < self.prefetch_from or position > self.prefetched:
+                self.prefetch_from = self.prefetched = position # シークされた
+            end = min(position + self.readahead, self.data.shape[0])
+            while self.prefetched < end and not self.stop_event.is_set():
+                stop = min(self.prefetched + 256 * step, end)
+                float(self.data[self.prefetched:stop:step].sum())
+                self.prefetched = stop
+
+
+    def close(self):
+        self.stop_event.set()
+        self.wake.set()
+
+
+class DecodePool:
+    """
+    load_audio をスレッドプールで並列に回す。libsndfile、ffmpeg（別プロセス）、リサンプルの大半は GIL を離すので、
+    複数のファイルを同時に開く場合（サンプラーの復元など）はデコードが並列に進む
+    """
+    def __init__(
+        self, 
+        max_workers: int = None, 
+        initializer = None, # 各スレッドの開始時に呼ぶ関数（優先度を下げるなど）
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.executor = ThreadPoolExecutor(
+            max_workers = max_workers if max_workers is not None else min(4, os.cpu_count() or 1),
+            thread_name_prefix = "decode",
+            initializer = initializer,
+        )
+
+
+    # load_audio の結果を返す Future
+    def submit(self, path: str, sr_list, max_sec: float = None):
+        return self.executor.submit(load_audio, path, sr_list, max_sec = max_sec)
+
+
+    # 任意の関数をプールで回す（キャッシュの確認なども含めてまとめて並列化したい場合）
+    def map(self, fn, items):
+        return list(self.executor.map(fn, items))
+
+
+    def shutdown(self):
+        self.executor.shutdown(wait = False, cancel_futures = True)
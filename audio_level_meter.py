@@ -17,6 +17,7 @@
 # ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
 
 import wx
+from gui_scheduler import start_update_timer, PRIORITY_MONITOR
 
 
 
@@ -54,9 +55,8 @@ class InputLevelMeterPanel(wx.Panel):
         # 画像をパネル内に貼り付ける
         self.Bind(wx.EVT_PAINT, self.on_paint)
         
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(37) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, 37, priority = PRIORITY_MONITOR)
 
 
     def update(self, event):
@@ -201,9 +201,8 @@ class InputLevelTextPanel(wx.Panel):
         # 背景色のセット
         self.SetBackgroundColour(self.b_color[int(self.sc.vc_now)]) 
 
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(50) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, 50, priority = PRIORITY_MONITOR)
 
 
     def update(self, event):
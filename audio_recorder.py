@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import os
+import threading
+import logging
+import inspect
+
+import soundfile as sf
+
+from audio_ring import AudioRing
+
+
+# 録音は audio callback から切り離す。callback 側は固定長のリングバッファにコピーするだけで、
+# エンコードとファイル書き込みは専用のスレッドが開いたままの SoundFile に追記していく。
+# 以前は record_every 秒ごとに callback 内で np.concatenate してスレッドを立て、sf.write で 1 ファイルを丸ごと書いていた。
+
+
+class RecorderTrack:
+    """
+    録音対象 1 系統（入力 or 出力）。リングと、現在書き込み中のファイルを持つ。ファイル操作は writer スレッドのみが行う。
+    """
+    def __init__(
+        self,
+        prefix: str, # ファイル名の先頭。"i" や "o"
+        n_channel: int,
+        ring_samples: int,
+    ):
+        self.prefix = prefix
+        self.n_channel = n_channel
+        self.ring = AudioRing(ring_samples, n_channel)
+        self.file = None
+        self.path = None
+        self.samples_total = 0 # 録音開始からファイルに書いた総サンプル数（ファイル名に使う）
+        self.samples_in_file = 0
+        self.reported_drop = 0
+
+
+class AudioRecorder:
+    def __init__(
+        self,
+        sr: int,
+        tracks: dict, # {"i": 入力 ch 数, "o": 出力 ch 数}
+        timestamp: str, # ファイル名に入れる起動時刻
+        directory: str = ".",
+        rotate_sec: float = 60.0, # この秒数を書いたら次のファイルに切り替える。0 以下なら時間では切らない
+        rotate_mb: float = 0.0, # ファイルサイズ（MB）がこれを超えたら切り替える。0 以下なら無効
+        file_format: str = "OGG", # soundfile の format。拡張子にも使う
+        subtype: str = None, # None なら soundfile の既定（OGG なら VORBIS）
+        ring_sec: float = 8.0, # writer が止まっても、この秒数までは callback 側で取りこぼさない
+        poll_sec: float = 0.1, # writer スレッドがリングを見に行く間隔
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.sr = int(sr)
+        self.timestamp = timestamp
+        self.directory = directory
+        self.rotate_samples = int(rotate_sec * self.sr) if rotate_sec > 0 else 0
+        self.rotate_bytes = int(rotate_mb * 1024 * 1024) if rotate_mb > 0 else 0
+        self.file_format = file_format
+        self.subtype = subtype
+        self.poll_sec = poll_sec
+
+        ring_samples = int(ring_sec * self.sr)
+        self.tracks = {
+            name: RecorderTrack(name, n_channel, ring_samples) for name, n_channel in tracks.items()
+        }
+
+        os.makedirs(self.directory, exist_ok = True)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+        self.logger.debug(f"Recording {list(self.tracks)} to '{self.directory}' ({self.file_format}, rotate every {rotate_sec} s / {rotate_mb} MB).")
+
+
+    # audio callback から呼ぶ。コピー 1 回だけで戻る
+    def push(self, name, x):
+        self.tracks[name].ring.push(x)
+
+
+    # 終了処理。リングに残った分を書き出してファイルを閉じる。何度呼んでもよい
+    def close(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        for track in self.tracks.values():
+            self._drain(track) # スレッド停止後に届いた最後のブロックも拾う
+            self._close_file(track)
+        self.logger.debug("Closed.")
+
+
+    def _run(self):
+        while not self.stop_event.wait(self.poll_sec):
+            for track in self.tracks.values():
+                try:
+                    self._drain(track)
+                except Exception:
+                    self.logger.exception(f"({inspect.currentframe().f_code.co_name}) Failed to write track '{track.prefix}'")
+                    self._close_file(track)
+
+
+    def _drain(self, track):
+        data = track.ring.pop_all()
+        pos = 0
+        while pos < data.shape[0]:
+            if track.file is None:
+                self._open_file(track)
+            n = data.shape[0] - pos
+            if self.rotate_samples > 0:
+                n = min(n, self.rotate_samples - track.samples_in_file) # ちょうど rotate_sec で切れるように分割
+            track.file.write(data[pos:pos + n])
+            track.samples_in_file += n
+            track.samples_total += n
+            pos += n
+            if self._need_rotate(track):
+                self._close_file(track)
+
+        if track.ring.dropped != track.reported_drop:
+            self.logger.warning(f"Track '{track.prefix}': {track.ring.dropped - track.reported_drop} samples were dropped (writer too slow).")
+            track.reported_drop = track.ring.dropped
+
+
+    def _need_rotate(self, track) -> bool:
+        if self.rotate_samples > 0 and track.samples_in_file >= self.rotate_samples:
+            return True
+        if self.rotate_bytes > 0 and os.path.getsize(track.path) >= self.rotate_bytes:
+            return True
+        return False
+
+
+    def _open_file(self, track):
+        # 従来のファイル名の形式 {prefix}_{起動時刻}_{サンプル位置}.ogg を保つ。位置はファイル先頭のサンプル番号
+        track.path = os.path.join(
+            self.directory, 
+            f'{track.prefix}_{self.timestamp}_{track.samples_total:011}.{self.file_format.lower()}',
+        )
+        track.file = sf.SoundFile(
+            track.path, mode = 'w', 
+            samplerate = self.sr, channels = track.n_channel, 
+            format = self.file_format, subtype = self.subtype,
+        )
+        track.samples_in_file = 0
+
+
+    def _close_file(self, track):
+        if track.file is not None:
+            try:
+                track.file.close()
+            except Exception:
+                self.logger.exception(f"({inspect.currentframe().f_code.co_name}) Failed to close '{track.path}'")
+            track.file = None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import numpy as np
+
+
+# スレッド間で音声をサンプル単位で受け渡すリングバッファ。
+#   - AudioRing は書き手 1 つ、読み手 1 つのロックなしのリング。録音（audio_recorder）で callback から書き出しスレッドへ渡すのに使う
+#   - DriftRing はクロックの異なる 2 つの audio callback の間の受け渡し用で、読み出しの速さを補正する。
+#     audio backend がサンプラーの音を出力側のモニターに混ぜるのに使う
+
+
+class AudioRing:
+    """
+    書き手 1 つ、読み手 1 つのサンプル単位のリングバッファ。ロックは使わない。
+    書き手はデータをコピーしてから write_count を進め、読み手はデータを読んでから read_count を進めるので、
+    それぞれのカウンタを書き換えるのは片方のスレッドだけになる（int の代入は GIL 下でアトミック）。
+    """
+    def __init__(
+        self,
+        capacity: int, # 保持できるサンプル数（時間方向）
+        n_channel: int,
+    ):
+        self.buf = np.zeros((capacity, n_channel), dtype = np.float32)
+        self.capacity = capacity
+        self.n_channel = n_channel
+        self.write_count = 0
+        self.read_count = 0
+        self.dropped = 0 # 空きが足りずに捨てたサンプル数。書き手だけが更新する
+
+
+    # audio callback から呼ぶ。空きがなければブロックごと捨てて False を返す（callback を待たせない）
+    def push(self, x) -> bool:
+        n = x.shape[0]
+        if self.capacity - (self.write_count - self.read_count) < n:
+            self.dropped += n
+            return False
+
+        c = min(x.shape[1], self.n_channel) # デバイス変更でチャンネル数が変わっても、足りない ch は無音で埋める
+        start = self.write_count % self.capacity
+        first = min(n, self.capacity - start)
+        self.buf[start:start + first, :c] = x[:first, :c]
+        self.buf[:n - first, :c] = x[first:, :c]
+        if c < self.n_channel:
+            self.buf[start:start + first, c:] = 0
+            self.buf[:n - first, c:] = 0
+        self.write_count += n # データを書き終えてから公開する
+        return True
+
+
+    # 読み手側。溜まっているサンプルをすべてコピーして返す (time, ch)
+    def pop_all(self):
+        n = self.write_count - self.read_count
+        start = self.read_count % self.capacity
+        first = min(n, self.capacity - start)
+        out = np.concatenate([self.buf[start:start + first], self.buf[:n - first]], axis = 0)
+        self.read_count += n
+        return out
+
+
+class DriftRing(AudioRing):
+    """
+    クロックの異なる 2 つの callback の間で音声を受け渡すリング（入力ストリーム → 出力ストリーム）。
+    読み手は、溜まっているサンプル数が target に近づくように読み出しの速さを 1 ± max_ratio の範囲でゆっくり変え、
+    端数の位置から線形補間で読む。デバイスのクロックがずれても、リングが溢れたり空になり続けたりしない。
+    空になったら target まで溜まるのを待ってから読み出しを再開する。
+    """
+    def __init__(
+        self,
+        capacity: int,
+        n_channel: int,
+        target: int, # 目標とする溜まり量（サンプル数）。callback の揺らぎを吸収できるだけ必要
+        max_ratio: float = 0.005, # 読み出しの速さを変える上限（0.005 なら ±0.5 %）
+        gain: float = 0.01, # 溜まり量の偏差（target に対する割合）を、読み出しの速さの変化に換算する係数
+        smoothing: float = 0.05, # 読み出しの速さを、1 回の読み出しごとにどれだけ目標値に寄せるか
+    ):
+        super().__init__(capacity, n_channel)
+        self.target = max(int(target), 1)
+        self.max_ratio = max_ratio
+        self.gain = gain
+        self.smoothing = smoothing
+        self.ratio = 1.0 # 現在の読み出しの速さ（書き手のサンプル数 / 読み手のサンプル数）
+        self.frac = 0.0 # 読み出し位置の端数
+        self.primed = False # target まで溜まったか
+        self.underruns = 0 # 読み手だけが更新する
+
+
+    # 書き手側。モノラルは全チャンネルに広げる
+    def push(self, x) -> bool:
+        if x.shape[1] == 1 and self.n_channel > 1:
+            x = np.broadcast_to(x, (x.shape[0], self.n_channel))
+        return super().push(x)
+
+
+    # 読み手側。out (frames, ch) に frames サンプル分を足し込む。溜まっていなければ何もせず False を返す
+    def mix_into(self, out) -> bool:
+        frames = out.shape[0]
+        fill = self.write_count - self.read_count
+        if not self.primed:
+            if fill < self.target + frames:
+                return False
+            self.primed = True
+
+        error = (fill - self.target) / self.target
+        want = 1.0 + min(max(error * self.gain, -self.max_ratio), self.max_ratio)
+        self.ratio += self.smoothing * (want - self.ratio)
+
+        pos = self.frac + self.ratio * np.arange(frames)
+        i0 = pos.astype(np.int64)
+        if i0[-1] + 2 > fill:
+            self.underruns += 1
+            self.primed = False # 書き手が止まった（再生終了など）か、遅れている。溜め直す
+            return False
+        w = (pos - i0)[:, None].astype(np.float32)
+        idx = (self.read_count + i0) % self.capacity
+        c = min(out.shape[1], self.n_channel)
+        out[:, :c] += (1 - w) * self.buf[idx, :c] + w * self.buf[(idx + 1) % self.capacity, :c]
+
+        advance = self.frac + self.ratio * frames
+        n = int(advance)
+        self.frac = advance - n
+        self.read_count += n # データを読み終えてから空きを公開する
+        return True
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+# GUI を起動せずに、フォルダやワイルドカードで指定した音声ファイルをまとめてオフライン VC する。
+# 各ワーカープロセスが自前の ONNX セッション（OfflineEngine）を持ち、ファイル単位で並列に処理する。
+# 進捗はジョブ状態ファイルに逐次書き出すので、中断しても同じコマンドで続きから再開できる。
+#
+# 例:
+#   python batch_convert.py ./inputs "./more/*.flac" --style ./styles/target.csv --out ./converted --workers 3
+#   python batch_convert.py ./inputs --style style:2 --out ./converted  # スタイルマネージャのスロット 2
+#   python batch_convert.py ./inputs --style sample:0 --out ./converted # サンプルマネージャのスロット 0
+#   python batch_convert.py ./inputs --style auto --out ./converted     # 入力自身からスタイルを推定
+#   python batch_convert.py ./short_clips --style style:2 --out ./converted --batch 8 --compare
+#   python batch_convert.py ./inputs --style style:all --out ./converted # スタイルマネージャの全スロットでそれぞれ変換
+#   python batch_convert.py ./inputs --style style:0,sample:1,./styles/target.csv --out ./converted
+#   python batch_convert.py ./inputs --style lib:whisper,lib:42 --out ./converted # スタイルライブラリの名前か行番号
+#
+# --batch 2 以上では、短いファイルをまとめて長さの近いもの同士でバッチにし、1 回の ONNX 呼び出しで変換する
+# （BatchedOfflineConverter）。--group-sec より長いファイルは従来通り 1 ファイルずつ区間ごとに変換する。
+# --compare を付けると、最初のグループをファイル単位の経路でも変換し、両者の速度を比べて表示する
+#
+# --style に複数のスタイルをカンマ区切りで並べるか、style:all / sample:all を指定すると、各ファイルを全スタイルで変換し、
+# <out>/<スタイル名>/ 以下にそれぞれ書き出す。HarmoF0 と ContentVec は 1 ファイルにつき 1 回だけ走り、
+# f0n とデコーダはスタイルの数だけバッチにして通す。--compare ではスタイルごとに 1 回ずつ変換する場合と比べる
+
+import os
+import sys
+import glob
+import hashlib
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import logging
+
+import numpy as np
+import soundfile as sf
+
+from config_manager import load_make_app_config, load_make_vc_config
+from style_library import StyleLibrary, read_style_csv, LIBRARY_DIR
+from utils import sanitize_filename
+
+
+AUDIO_EXTENSIONS = ('.wav', '.ogg', '.mp3', '.m4a', '.flac', '.opus')
+DIM_STYLE = 128
+
+
+# スタイル csv を読む。StyleSlotPanel.load_csv_to_slot と同じく、1 行でも複数行でも合計 128 個の数値があればよい
+def load_style_csv(file_path):
+    return read_style_csv(file_path, DIM_STYLE)
+
+
+# --style の指定を (1, 128) の array にする。"auto" の場合は None（入力からの自動推定）
+def resolve_style(spec, app_config):
+    if spec == "auto":
+        return None
+    if spec.startswith("lib:"):
+        # スタイルライブラリの行番号か名前
+        key = spec.split(":", 1)[1]
+        library = StyleLibrary(app_config.get("style_library_dir", LIBRARY_DIR), dim = DIM_STYLE, readonly = True)
+        return library.get(int(key) if key.isdigit() else key)
+    if spec.startswith("style:") or spec.startswith("sample:"):
+        kind, index = spec.split(":", 1)
+        path = app_config["style_portfolio_path"] if kind == "style" else app_config["sample_portfolio_path"]
+        with open(path, "r") as f:
+            entry = json.load(f)[int(index)]
+        if kind == "style":
+            # StyleManagerPanel と同じく、ファイルからロードしたスタイルを優先する
+            emb = entry["emb_file"] if entry["emb_file"] is not None else entry["emb_expand"]
+        else:
+            emb = entry.get("embedding")
+        if emb is None:
+            raise ValueError(f"Slot {index} of '{path}' has no style.")
+        return np.array(emb, dtype = np.float32).reshape(1, DIM_STYLE)
+    return load_style_csv(spec)
+
+
+# 使われている（ファイルからロードしたか、手入力した）スタイルのスロット、ないし埋め込みが計算済みのサンプルのスロット
+def portfolio_slots(kind, app_config):
+    path = app_config["style_portfolio_path"] if kind == "style" else app_config["sample_portfolio_path"]
+    with open(path, "r") as f:
+        portfolio = json.load(f)
+    if kind == "style":
+        return [i for i, entry in enumerate(portfolio) if entry["emb_file"] is not None or entry.get("emb_handmade") is not None]
+    return [i for i, entry in enumerate(portfolio) if entry.get("embedding") is not None]
+
+
+# --style の指定（カンマ区切りで複数可）を [(出力フォルダ名, (1, 128) の array ないし None)] にする
+def resolve_styles(specs, app_config):
+    styles = []
+    for spec in specs.split(","):
+        spec = spec.strip()
+        if spec in ("style:all", "sample:all"):
+            kind = spec.split(":")[0]
+            styles += [(f"{kind}{i}", resolve_style(f"{kind}:{i}", app_config)) for i in portfolio_slots(kind, app_config)]
+        elif spec.startswith("style:") or spec.startswith("sample:"):
+            styles.append((spec.replace(":", ""), resolve_style(spec, app_config)))
+        elif spec.startswith("lib:"):
+            styles.append((sanitize_filename(spec.split(":", 1)[1]), resolve_style(spec, app_config)))
+        else:
+            styles.append((spec if spec == "auto" else os.path.splitext(os.path.basename(spec))[0], resolve_style(spec, app_config)))
+    return styles
+
+
+# 入力指定（ファイル、フォルダ、ワイルドカード）を展開し、(入力パス, 出力パス) のリストにする。
+# フォルダ指定の場合はフォルダ内の相対パスを出力先でも保つ
+def collect_jobs(inputs, out_dir):
+    jobs = []
+    for spec in inputs:
+        if os.path.isdir(spec):
+            for root, _, files in os.walk(spec):
+                for name in sorted(files):
+                    if name.lower().endswith(AUDIO_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        rel = os.path.relpath(path, spec)
+                        jobs.append((path, os.path.join(out_dir, os.path.splitext(rel)[0] + ".wav")))
+        else:
+            for path in sorted(glob.glob(spec)):
+                if path.lower().endswith(AUDIO_EXTENSIONS):
+                    jobs.append((path, os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + ".wav")))
+    # 同じ入力が複数回指定された場合は 1 回だけ
+    seen = set()
+    return [job for job in jobs if not (job[0] in seen or seen.add(job[0]))]
+
+
+# 入力を、バッチ変換するグループ（合計 group_sec 秒まで）と、1 ファイルずつ区間ごとに変換する長いファイルに分ける。
+# 長さが分からない形式（soundfile で開けないもの）は長いファイルとして扱う
+def group_jobs(jobs, group_sec):
+    groups, singles = [], []
+    current, current_sec = [], 0.0
+    for in_path, out_path in jobs:
+        try:
+            duration = sf.info(in_path).duration
+        except Exception:
+            duration = None
+        if duration is None or duration > group_sec:
+            singles.append((in_path, out_path))
+            continue
+        if current_sec + duration > group_sec and len(current) > 0:
+            groups.append(current)
+            current, current_sec = [], 0.0
+        current.append((in_path, out_path))
+        current_sec += duration
+    if len(current) > 0:
+        groups.append(current)
+    return groups, singles
+
+
+# ジョブ状態ファイル。{入力パス: {"output": ..., "audio_sec": ..., "wall_sec": ...}} を完了したものだけ持つ。
+# 複数スタイルで変換した場合、"output" は出力パスのリスト
+def load_state(path):
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent = 4)
+    os.replace(tmp_path, path) # 書き込み途中で中断しても壊れたファイルが残らないように
+
+
+def outputs_exist(output):
+    return all(os.path.exists(path) for path in (output if isinstance(output, list) else [output]))
+
+
+# 変換結果を決めるもの（スタイル、変換設定、チェックポイント、区間の設定）のハッシュ。
+# 状態ファイルに入力ごとに記録し、これが変わったファイルは「変換済み」として飛ばさない
+def conversion_key(vc_config, style, style_vects):
+    h = hashlib.sha1()
+    for vect in (style, style_vects):
+        h.update(b"none" if vect is None else np.ascontiguousarray(vect, dtype = np.float32).tobytes())
+    settings = {
+        name: vc_config.get(name) 
+        for name in (
+            "auto_encode", "pitch_shift", "absolute_pitch", "estimate_energy", 
+            "offline_chunk_sec", "offline_context_sec", "offline_fade_sec",
+        )
+    }
+    settings["model"] = vc_config.get("model")
+    h.update(json.dumps(settings, sort_keys = True).encode("utf-8"))
+    return h.hexdigest()
+
+
+# 状態ファイル上で、同じ変換内容で同じ出力先に変換済みで、かつ出力が残っているか
+def already_converted(state, in_path, out_path, key):
+    entry = state.get(in_path)
+    if entry is None or entry.get("key") != key or entry["output"] != out_path:
+        return False
+    return outputs_exist(out_path)
+
+
+#### ワーカープロセス側
+
+_converter = None
+_batched_converter = None
+_style = None
+_style_vects = None
+
+
+def _init_worker(vc_config, intra_op_threads, style, style_vects, chunk_sec, context_sec, fade_sec, batch_size, bucket_sec):
+    global _converter, _batched_converter, _style, _style_vects
+    # ONNX Runtime は子プロセスで初めて読み込む
+    from offline_converter import OfflineEngine, ChunkedOfflineConverter, BatchedOfflineConverter
+    from feature_cache import make_feature_cache
+    engine = OfflineEngine(
+        vc_config, intra_op_threads = intra_op_threads, target_style = style, feature_cache = make_feature_cache(vc_config),
+    )
+    _converter = ChunkedOfflineConverter(engine, chunk_sec = chunk_sec, context_sec = context_sec, fade_sec = fade_sec)
+    _batched_converter = BatchedOfflineConverter(
+        engine, chunk_sec = chunk_sec, context_sec = context_sec, fade_sec = fade_sec,
+        batch_size = batch_size, bucket_sec = bucket_sec,
+    )
+    _style = style
+    _style_vects = style_vects
+
+
+def _convert_one(in_path, out_path):
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok = True)
+    # 変換中のファイルは別名で書き、完了後に置き換える。中断時に不完全な出力が「完了」に見えないように
+    part_path = os.path.splitext(out_path)[0] + ".part.wav"
+    stats = _converter.convert_file(in_path, part_path, style_vect = _style)
+    os.replace(part_path, out_path)
+    return stats
+
+
+def _convert_group(pairs):
+    part_pairs = []
+    for in_path, out_path in pairs:
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok = True)
+        part_pairs.append((in_path, os.path.splitext(out_path)[0] + ".part.wav"))
+    file_stats, stats = _batched_converter.convert_files(part_pairs, style_vect = _style)
+    for (_, out_path), (_, part_path) in zip(pairs, part_pairs):
+        os.replace(part_path, out_path)
+    return file_stats, stats
+
+
+# 1 ファイルを全スタイルで変換する。out_paths はスタイルの順
+def _convert_styles(in_path, out_paths):
+    part_paths = []
+    for out_path in out_paths:
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok = True)
+        part_paths.append(os.path.splitext(out_path)[0] + ".part.wav")
+    stats = _converter.convert_file_styles(in_path, part_paths, _style_vects)
+    for out_path, part_path in zip(out_paths, part_paths):
+        os.replace(part_path, out_path)
+    return stats
+
+
+# 1 ファイルを、スタイルごとに 1 回ずつ変換する場合と、全スタイルをまとめて変換する場合とで比べる
+def _compare_styles(in_path):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        time0 = time.perf_counter()
+        for k in range(_style_vects.shape[0]):
+            stats = _converter.convert_file(in_path, os.path.join(tmp_dir, f"single_{k}.wav"), style_vect = _style_vects[k:k+1])
+        single_sec = time.perf_counter() - time0
+        multi = _converter.convert_file_styles(
+            in_path, [os.path.join(tmp_dir, f"multi_{k}.wav") for k in range(_style_vects.shape[0])], _style_vects,
+        )
+    return {"audio_sec": stats["audio_sec"] * _style_vects.shape[0], "single_sec": single_sec, "multi_sec": multi["wall_sec"]}
+
+
+# 同じグループを、ファイル単位の経路とバッチの経路の両方で一時フォルダに変換し、それぞれの統計を返す
+def _compare_group(pairs):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        time0 = time.perf_counter()
+        audio_sec = 0.0
+        for k, (in_path, _) in enumerate(pairs):
+            audio_sec += _converter.convert_file(in_path, os.path.join(tmp_dir, f"single_{k}.wav"), style_vect = _style)["audio_sec"]
+        single_sec = time.perf_counter() - time0
+        _, batched = _batched_converter.convert_files(
+            [(in_path, os.path.join(tmp_dir, f"batched_{k}.wav")) for k, (in_path, _) in enumerate(pairs)],
+            style_vect = _style,
+        )
+    return {"audio_sec": audio_sec, "single_speed": audio_sec / max(single_sec, 1e-9), "batched": batched}
+
+
+####
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Convert audio files offline with a fixed target style.")
+    parser.add_argument("inputs", nargs = "+", help = "audio files, folders or wildcard patterns")
+    parser.add_argument(
+        "--style", required = True, 
+        help = "style csv path, 'style:<slot>', 'sample:<slot>', 'style:all', 'sample:all', 'lib:<row or name>' or 'auto' (comma-separated for several styles)",
+    )
+    parser.add_argument("--out", required = True, help = "output folder")
+    parser.add_argument("--workers", type = int, default = 2, help = "number of worker processes")
+    parser.add_argument("--threads", type = int, default = 0, help = "ONNX intra-op threads per worker (0: cpu_count / workers)")
+    parser.add_argument("--vc-config", default = "./configs/vc_config.json")
+    parser.add_argument("--app-config", default = "./configs/app_config.json")
+    parser.add_argument("--state", default = None, help = "job state file (default: <out>/batch_state.json)")
+    parser.add_argument("--restart", action = "store_true", help = "ignore the job state and convert everything again")
+    parser.add_argument("--pitch-shift", type = float, default = None, help = "override pitch_shift of the vc config (semitones)")
+    parser.add_argument("--batch", type = int, default = 1, help = "windows per ONNX call for short files (1: one file at a time)")
+    parser.add_argument("--bucket-sec", type = float, default = 1.0, help = "max length difference of windows in one batch")
+    parser.add_argument("--group-sec", type = float, default = 300.0, help = "seconds of audio held in memory per batched group")
+    parser.add_argument("--no-feature-cache", action = "store_true", help = "do not read or write the feature cache")
+    parser.add_argument("--compare", action = "store_true", help = "also convert the first group one file at a time and compare speeds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.WARNING, format = '%(asctime)s [%(levelname)s] %(name)s - %(message)s')
+
+    vc_config = load_make_vc_config(args.vc_config, save = False)
+    app_config = load_make_app_config(args.app_config, save = False)
+    if args.pitch_shift is not None:
+        vc_config["pitch_shift"] = args.pitch_shift
+    if args.no_feature_cache:
+        vc_config["feature_cache_mb"] = 0
+    styles = resolve_styles(args.style, app_config)
+    if len(styles) == 0:
+        parser.error(f"No style was found for '{args.style}'.")
+    multi_style = len(styles) > 1
+    if multi_style:
+        if any(vect is None for _, vect in styles):
+            parser.error("'auto' cannot be combined with other styles.")
+        if args.batch > 1:
+            parser.error("--batch cannot be combined with several styles.")
+        style = None
+        style_vects = np.concatenate([vect for _, vect in styles], axis = 0)
+    else:
+        style = styles[0][1]
+        style_vects = None
+        if style is None:
+            vc_config["auto_encode"] = True
+
+    os.makedirs(args.out, exist_ok = True)
+    state_path = args.state if args.state is not None else os.path.join(args.out, "batch_state.json")
+    state = {} if args.restart else load_state(state_path)
+
+    jobs = collect_jobs(args.inputs, args.out)
+    if multi_style:
+        # <out>/<スタイル名>/ 以下に、入力フォルダ内の相対パスを保って書き出す
+        jobs = [(i, [os.path.join(args.out, label, os.path.relpath(o, args.out)) for label, _ in styles]) for i, o in jobs]
+    # 状態ファイル上で同じスタイルと設定で同じ出力先に完了済み、かつ出力が残っているものは飛ばす
+    key = conversion_key(vc_config, style, style_vects)
+    pending = [(i, o) for i, o in jobs if not already_converted(state, i, o, key)]
+    print(f"{len(jobs)} files found, {len(jobs) - len(pending)} already converted, {len(pending)} to go.")
+    if len(pending) == 0:
+        return
+
+    if args.batch > 1:
+        groups, singles = group_jobs(pending, args.group_sec)
+    else:
+        groups, singles = [], pending
+    n_workers = max(1, min(args.workers, len(groups) + len(singles)))
+    threads = args.threads if args.threads > 0 else max(1, (os.cpu_count() or 1) // n_workers)
+
+    time0 = time.perf_counter()
+    audio_sec_total = 0.0
+    n_done = 0
+    failed = []
+    batch_totals = {"valid_frames": 0, "padded_frames": 0, "n_batches": 0, "n_windows": 0, "infer_sec": 0.0}
+    comparison = None
+    # CUDA を使う場合に備えて fork ではなく spawn で子プロセスを作る
+    with ProcessPoolExecutor(
+        max_workers = n_workers,
+        mp_context = multiprocessing.get_context("spawn"),
+        initializer = _init_worker,
+        initargs = (
+            vc_config, threads, style, style_vects,
+            vc_config.get("offline_chunk_sec", 10.0),
+            vc_config.get("offline_context_sec", 1.0),
+            vc_config.get("offline_fade_sec", 0.1),
+            args.batch, args.bucket_sec,
+        ),
+    ) as pool:
+        # 長いファイルから先に投げる（グループはどれも group_sec 以下なので、後から詰めやすい）
+        convert_single = _convert_styles if multi_style else _convert_one
+        futures = {pool.submit(convert_single, i, o): [(i, o)] for i, o in singles}
+        futures.update({pool.submit(_convert_group, group): group for group in groups})
+        for future in as_completed(futures):
+            pairs = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                for in_path, _ in pairs:
+                    n_done += 1
+                    failed.append(in_path)
+                    print(f"[{n_done}/{len(pending)}] FAILED {in_path}: {e}", file = sys.stderr)
+                continue
+            if isinstance(result, tuple):
+                file_stats, stats = result
+                for key in batch_totals:
+                    batch_totals[key] += stats[key]
+            else:
+                file_stats, stats = [result], result
+            for (in_path, out_path), file_stat in zip(pairs, file_stats):
+                n_done += 1
+                audio_sec_total += file_stat["audio_sec"]
+                state[in_path] = {"output": out_path, "key": key, "audio_sec": file_stat["audio_sec"], "wall_sec": stats["wall_sec"]}
+            save_state(state_path, state)
+            elapsed = time.perf_counter() - time0
+            if multi_style:
+                print(
+                    f"[{n_done}/{len(pending)}] {pairs[0][0]} -> {len(styles)} styles "
+                    f"({stats['audio_sec']:.1f} s audio, x{stats['speed']:.2f} output s / wall s)"
+                )
+            elif len(pairs) == 1:
+                print(
+                    f"[{n_done}/{len(pending)}] {pairs[0][0]} -> {pairs[0][1]} "
+                    f"({stats['audio_sec']:.1f} s audio, x{stats['speed']:.2f} | total x{audio_sec_total / elapsed:.2f})"
+                )
+            else:
+                print(
+                    f"[{n_done}/{len(pending)}] {len(pairs)} files in {stats['n_batches']} batches "
+                    f"({stats['audio_sec']:.1f} s audio, x{stats['speed']:.2f}, {stats['rows_per_batch']:.1f} windows/batch, "
+                    f"{100 * stats['utilization']:.0f}% non-padding | total x{audio_sec_total / elapsed:.2f})"
+                )
+
+        # 他のジョブが終わってから、最初のグループだけを 1 つのワーカーで両方の経路に通して比べる
+        if args.compare and len(groups) > 0:
+            comparison = pool.submit(_compare_group, groups[0]).result()
+        elif args.compare and multi_style:
+            comparison = pool.submit(_compare_styles, pending[0][0]).result()
+
+    wall_sec = time.perf_counter() - time0
+    print(
+        f"Converted {len(pending) - len(failed)} files ({audio_sec_total:.1f} s of audio) in {wall_sec:.1f} s "
+        f"with {n_workers} workers x {threads} threads: {audio_sec_total / max(wall_sec, 1e-9):.2f} audio s / wall s."
+    )
+    if batch_totals["n_batches"] > 0:
+        print(
+            f"Batched: {batch_totals['n_windows']} windows in {batch_totals['n_batches']} batches "
+            f"({batch_totals['n_windows'] / batch_totals['n_batches']:.1f} windows/batch, "
+            f"{100 * batch_totals['valid_frames'] / max(batch_totals['padded_frames'], 1):.1f}% non-padding frames, "
+            f"{batch_totals['infer_sec']:.1f} s in ONNX calls)."
+        )
+    if comparison is not None and multi_style:
+        print(
+            f"Comparison on '{pending[0][0]}' with {len(styles)} styles (1 worker x {threads} threads): "
+            f"one style at a time {comparison['single_sec']:.1f} s, all styles at once {comparison['multi_sec']:.1f} s "
+            f"({comparison['single_sec'] / max(comparison['multi_sec'], 1e-9):.2f} times)."
+        )
+    elif comparison is not None:
+        batched = comparison["batched"]
+        print(
+            f"Comparison on the first group ({comparison['audio_sec']:.1f} s of audio, 1 worker x {threads} threads): "
+            f"one file at a time x{comparison['single_speed']:.2f}, batched x{batched['speed']:.2f} "
+            f"({batched['speed'] / max(comparison['single_speed'], 1e-9):.2f} times)."
+        )
+    if failed:
+        print(f"{len(failed)} files failed. Run the same command again to retry them.", file = sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -69,11 +69,18 @@ def load_make_app_config(
         # スタイルマネージャが管理するスタイル一覧の保存先パス
         root_dict["style_portfolio_path"] = "./styles/style_portfolio.json"
 
+        # スロットとは別に、多数のスタイルを貯めておくライブラリのフォルダ（style_library.py）
+        root_dict["style_library_dir"] = "./styles/library"
+
         # ContentVec の抽出結果をリアルタイムするタブを作るか？基本的にテスト用
         root_dict["display_content"] = False
 
         # 起動時のアクティブタブの番号（0 は monitor）
-        root_dict["initial_active_tab"] = 0 
+        root_dict["initial_active_tab"] = 0
+
+        # GUI の更新処理を駆動するフレームクロックの周期（ms）と、1 周期あたりに使ってよい処理時間（ms）
+        root_dict["gui_tick_ms"] = 16
+        root_dict["gui_frame_budget_ms"] = 8.0
 
 
         # 設定をファイルとして保存。現在、保存先ファイル名はハードコーディングされている
@@ -202,6 +209,10 @@ def load_make_vc_config(
         root_dict["spec_rt_i"] = 1
         # 出力信号をスペクトログラム変換するか？# ["always", "with VC", "none"] = [0, 1, 2]
         root_dict["spec_rt_o"] = 1
+        # 表示用スペクトログラムを何で計算するか。# ["HarmoF0", "NumPy"] = [0, 1]
+        # NumPy の軽量解析器は F0 を出さないため、入力側は VC が実測ピッチ・音量や auto encode を使わない場合のみ有効
+        root_dict["spec_source_i"] = 0
+        root_dict["spec_source_o"] = 1
 
         # 以下は ContentVec を適用するときの、後端の折り返し量。この量は buffer size に依存しないが、計算時間に影響を及ぼす
         # 0.0 で折り返しなし。負値は無効。上限は 1（元の信号より長く折り返せない） 
@@ -263,15 +274,76 @@ def load_make_vc_config(
         
         # Sampler の音声サンプルをロードする処理における最大秒数。これを超えるサンプルは冒頭のみロードされる
         root_dict["sampler_max_sec"] = 16.0
-
-        # ファイルに対するオフライン VC における最大秒数。これを超えるサンプルは冒頭のみロードされる
+        # Sampler でデコード・リサンプルした音声を .npy でキャッシュするフォルダと容量（MB）。0 で無効。
+        # キーはファイルの内容のハッシュと変換先のサンプリング周波数なので、同じファイルを開き直すときはデコードしない
+        root_dict["sampler_cache_dir"] = "./sampler_cache"
+        root_dict["sampler_cache_mb"] = 512.0
+        # Sampler のスロットのスタイル埋め込み（とプロット用の HarmoF0 出力）のキャッシュ容量（MB）。0 で無効。
+        # portfolio と同じフォルダに置き、ファイルの内容と HarmoF0・スタイルエンコーダのハッシュが一致する限り再計算しない
+        root_dict["sampler_style_cache_mb"] = 256.0
+        # Sampler の複数スロットを同時にロードするとき（起動時の復元、複数ファイルのドロップ）は、長さの差が
+        # sampler_bucket_sec 秒以内の音声を最大 sampler_batch_size 個ずつまとめて、1 回のモデル呼び出しで埋め込みを計算する
+        root_dict["sampler_batch_size"] = 8
+        root_dict["sampler_bucket_sec"] = 0.5
+        # sampler_max_sec より長いファイルのスタイルは、sampler_style_max_sec 秒までを sampler_style_window_sec 秒の窓に分けて求め、
+        # 有声フレームの割合が sampler_style_min_voiced 未満の窓を除いて集約する（"mean" か、有声区間のエネルギーで重み付けする "energy"）
+        root_dict["sampler_style_max_sec"] = 600.0
+        root_dict["sampler_style_window_sec"] = 4.0
+        root_dict["sampler_style_min_voiced"] = 0.3
+        root_dict["sampler_style_weighting"] = "energy"
+        # Sampler の複数スロットを同時にロードするとき、デコードとリサンプルを並列に行うスレッド数
+        root_dict["sampler_decode_workers"] = 2
+        # Sampler の再生用の音声は、サンプルのキャッシュ（sampler_cache_dir）に書いてメモリマップから再生するので、
+        # sampler_max_sec を超えて sampler_play_max_sec 秒まで読む（スタイルのプロット用は sampler_max_sec まで）。
+        # 再生中は、再生位置から sampler_readahead_sec 秒先までを別スレッドで先読みする
+        root_dict["sampler_play_max_sec"] = 600.0
+        root_dict["sampler_readahead_sec"] = 2.0
+        # Sampler の音は VC の入力にミックスされる。sampler_monitor を true にすると、VC を通さない音も出力デバイスに混ぜる
+        root_dict["sampler_monitor"] = False
+        # Sampler のサンプルを、現在のスタイルと変換設定で裏でオフライン変換してキャッシュし、次からの再生ではリアルタイムの
+        # 推論の代わりにそれを流す（試聴用）。キーはサンプル、スタイル、pitch_shift, absolute_pitch, estimate_energy のハッシュ。
+        # キャッシュのフォルダと容量（MB）。0 で無効
+        root_dict["sampler_preview_dir"] = "./sampler_preview"
+        root_dict["sampler_preview_mb"] = 512.0
+
+        # vc_config やポートフォリオの json を保存するとき、同じファイルに書き出す最小間隔（秒）。
+        # 間に来た変更はまとめて 1 回で書き出す。書き出しは別スレッドで、終了時には残りを必ず書き出す
+        root_dict["persist_interval_sec"] = 1.0
+
+        # ファイルに対するオフライン VC における最大秒数。現在のドラッグ＆ドロップ変換は区間ごとに処理するので使っていない
         root_dict["offline_max_sec"] = 30.0
+        # ファイルに対するオフライン VC は、この秒数ずつ前後に文脈を付けて変換し、境界をクロスフェードで繋ぐ
+        root_dict["offline_chunk_sec"] = 10.0
+        root_dict["offline_context_sec"] = 1.0
+        root_dict["offline_fade_sec"] = 0.1
+        # オフライン VC はリアルタイム VC と並行して、専用の ONNX セッションで行う。そのセッションのスレッド数
+        root_dict["offline_threads"] = 2
+        # リアルタイム VC の処理時間の p99 がブロック長のこの割合を超えている間、オフライン VC は次のモデル呼び出しに進まずに待つ
+        root_dict["offline_live_budget"] = 0.8
+        # 待つかどうかは各モデル呼び出しの前に、直近 offline_live_window_sec 秒の履歴だけで判断する（リアルタイム側が
+        # 止まっていれば待たない）。1 回に待つのは最大 offline_max_wait_sec 秒で、それを過ぎたら次の呼び出しを進める
+        root_dict["offline_live_window_sec"] = 1.0
+        root_dict["offline_max_wait_sec"] = 2.0
+        # オフライン VC で、ソース音声から求めた HarmoF0 と ContentVec の出力をキャッシュするフォルダと容量（MB）。0 で無効。
+        # 同じファイルを別のスタイルやピッチで変換し直すときは、f0n とデコーダだけが走る
+        root_dict["feature_cache_dir"] = "./feature_cache"
+        root_dict["feature_cache_mb"] = 1024.0
         
         #### log
         
-        # 0 より大きな数であれば、起動時からの音声を秒数ごとにカレントディレクトリに録音
-        # TODO: 保存先フォルダの設定
+        # 0 より大きな数であれば、起動時からの音声を録音し、この秒数ごとにファイルを切り替える
         root_dict["record_every"] = 0.0 # 単位は秒
+        root_dict["record_dir"] = "." # 録音ファイルの保存先フォルダ
+        root_dict["record_rotate_mb"] = 0.0 # 0 より大きければ、ファイルサイズ（MB）でもファイルを切り替える
+        root_dict["record_format"] = "OGG" # soundfile が書ける形式（"OGG", "FLAC", "WAV" など）
+
+        # 直近の入出力音声を保持するリングの長さ（分）。0 で無効。メモリマップトファイルとして archive_dir に置かれる
+        root_dict["archive_minutes"] = 3.0
+        root_dict["archive_dir"] = "./archive"
+        # メニューの「直前の音声を保存」で書き出す秒数と、保存先、形式（"WAV" か "FLAC"）
+        root_dict["snapshot_sec"] = 60.0
+        root_dict["snapshot_dir"] = "./snapshots"
+        root_dict["snapshot_format"] = "WAV"
 
         #### style
         
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import os
+import time
+import shutil
+import hashlib
+import threading
+import logging
+import inspect
+
+import numpy as np
+
+
+# オフライン VC で、ソース音声だけで決まる特徴量（HarmoF0 の F0・エネルギー・スペクトログラムと、ContentVec の出力）を
+# ディスクにキャッシュする。同じ音声を別のスタイルやピッチシフトで変換し直すときは、f0n と デコーダだけを走らせればよい。
+#
+# キーは「16 kHz の入力波形 + sr_proc + HarmoF0 と ContentVec のチェックポイントのハッシュ」の SHA-256。
+# エントリはキー名のフォルダで、特徴量ごとに float16 の .npy を置き、読み出しはメモリマップで行う。
+# 参照されたエントリはフォルダの mtime を更新し、合計サイズが max_mb を超えたら mtime の古い順に消す（LRU）。
+# 複数プロセス（batch_convert のワーカー）で同じフォルダを共有してよい。書き込みは一時フォルダに書いてから rename する。
+#
+# 同じ仕組みを、サンプラーでデコード・リサンプルした音声のキャッシュにも使う（names と dtype を変えて作る）。
+# こちらのキーは「音声ファイルの内容のハッシュ + 変換先のサンプリング周波数など」で、make_file_key で作る。
+
+FEATURE_NAMES = ("real_F0", "real_N", "content", "spec")
+
+
+_digest_memo = {} # (絶対パス, サイズ, mtime) → ハッシュ。チェックポイントは大きいので、プロセス内で 1 回だけ読む
+_digest_lock = threading.Lock()
+
+
+# ファイル内容の SHA-256
+def file_digest(path: str) -> str:
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        if memo_key not in _digest_memo:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            _digest_memo[memo_key] = h.hexdigest()
+        return _digest_memo[memo_key]
+
+
+class FeatureCache:
+    def __init__(
+        self,
+        directory: str,
+        max_mb: float = 1024.0, # キャッシュの合計サイズの上限
+        names = FEATURE_NAMES, # エントリが持つ配列の名前
+        dtype = np.float16, # 配列を保存する型。{名前: 型} で配列ごとに変えてもよい
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok = True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.names = tuple(names)
+        self.dtype = dtype
+        self.lock = threading.Lock()
+        self.n_hit = 0
+        self.n_miss = 0
+        # 合計サイズはこのプロセスの書き込み分だけ足していく。上限を超えたら実際に数え直して消す
+        self.total_bytes = sum(size for _, size, _ in self.scan())
+
+
+    # ソース音声と、その特徴量を出したモデルからキーを作る
+    def make_key(self, tensor_i16, model_paths, sr: int) -> str:
+        x = np.ascontiguousarray(tensor_i16)
+        h = hashlib.sha256()
+        h.update(f"{sr}|{x.dtype.str}|{x.shape}".encode())
+        for path in model_paths:
+            h.update(file_digest(path).encode())
+        h.update(x.tobytes())
+        return h.hexdigest()
+
+
+    # 音声ファイルそのものと、そこから配列を作るときのモデルおよびパラメータ（サンプリング周波数など）からキーを作る
+    def make_file_key(self, path: str, model_paths = (), **params) -> str:
+        h = hashlib.sha256()
+        h.update(file_digest(path).encode())
+        for model_path in model_paths:
+            h.update(file_digest(model_path).encode())
+        for name in sorted(params):
+            h.update(f"|{name}={params[name]}".encode())
+        return h.hexdigest()
+
+
+    # ヒットすれば {名前: memmap} を返す。無ければ None
+    def get(self, key: str):
+        path = os.path.join(self.directory, key)
+        try:
+            features = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode = "r") for name in self.names}
+            os.utime(path) # LRU のために最終参照時刻を更新
+        except (OSError, ValueError):
+            with self.lock:
+                self.n_miss += 1
+            return None
+        with self.lock:
+            self.n_hit += 1
+        return features
+
+
+    def put(self, key: str, features: dict):
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return
+        tmp_path = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+        try:
+            os.makedirs(tmp_path, exist_ok = True)
+            for name in self.names:
+                np.save(os.path.join(tmp_path, name + ".npy"), np.asarray(features[name], dtype = self.dtype_of(name)))
+            size = sum(os.path.getsize(os.path.join(tmp_path, name + ".npy")) for name in self.names)
+            os.rename(tmp_path, path) # 同じキーを別のプロセスが先に書いていたら失敗するので、こちらを捨てる
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors = True)
+            return
+        with self.lock:
+            self.total_bytes += size
+            over = self.total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+
+    # 大きな配列用。一時フォルダの .npy をメモリマップで開いて fill に直接書かせてから登録し、メモリに全体を置かない。
+    # shapes は {名前: 形}、fill は {名前: 書き込み用の memmap} を受け取って中身を書き、やめる場合は False を返す関数。
+    # 登録できればそのエントリを get して返し、できなければ None を返す
+    def put_streamed(self, key: str, shapes: dict, fill):
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return self.get(key)
+        tmp_path = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+        try:
+            os.makedirs(tmp_path, exist_ok = True)
+            arrays = {
+                name: np.lib.format.open_memmap(
+                    os.path.join(tmp_path, name + ".npy"), mode = "w+", dtype = self.dtype_of(name), shape = tuple(shapes[name]),
+                ) for name in self.names
+            }
+            completed = fill(arrays) is not False
+            for array in arrays.values():
+                array.flush()
+            del arrays # rename の前にメモリマップを閉じる（Windows では開いたままだと rename できない）
+            if not completed:
+                shutil.rmtree(tmp_path, ignore_errors = True)
+                return None
+            size = sum(os.path.getsize(os.path.join(tmp_path, name + ".npy")) for name in self.names)
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors = True)
+            return self.get(key) if os.path.isdir(path) else None # 別のプロセスが先に書いていればそちらを使う
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors = True)
+            raise
+        with self.lock:
+            self.total_bytes += size
+            over = self.total_bytes > self.max_bytes
+        entry = self.get(key) # 開いたメモリマップは、直後の evict でこのエントリが消されても読める
+        if over:
+            self.evict()
+        return entry
+
+
+    def dtype_of(self, name: str):
+        return self.dtype.get(name, np.float32) if isinstance(self.dtype, dict) else self.dtype
+
+
+    # [(mtime, サイズ, パス)]。書き込み途中の一時フォルダは数えない
+    def scan(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if ".tmp" in name or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue # 他のプロセスが消している最中
+        return entries
+
+
+    # 古いエントリから消して、上限の 9 割まで減らす（上限ちょうどで止めると、書き込みのたびに走るので）
+    def evict(self):
+        entries = sorted(self.scan())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        n_removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            shutil.rmtree(path, ignore_errors = True) # 他のプロセスが読み込み中で消せない場合（Windows）は次回に回る
+            if not os.path.exists(path):
+                total -= size
+                n_removed += 1
+        # 異常終了で残った古い一時フォルダも片付ける
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if ".tmp" in name and time.time() - os.path.getmtime(path) > 3600:
+                    shutil.rmtree(path, ignore_errors = True)
+            except OSError:
+                continue
+        with self.lock:
+            self.total_bytes = total
+        self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Removed {n_removed} entries, {total / 1024**2:.1f} MB left.")
+
+
+# vc_config に従ってキャッシュを作る。feature_cache_mb が 0 以下なら None（キャッシュしない）
+def make_feature_cache(vc_config):
+    max_mb = vc_config.get("feature_cache_mb", 1024.0)
+    if max_mb <= 0:
+        return None
+    return FeatureCache(vc_config.get("feature_cache_dir", "./feature_cache"), max_mb = max_mb)
+
+
+# サンプラーでデコード・リサンプルした音声のキャッシュ。sampler_cache_mb が 0 以下なら None（キャッシュしない）
+def make_sample_cache(vc_config):
+    max_mb = vc_config.get("sampler_cache_mb", 512.0)
+    if max_mb <= 0:
+        return None
+    return FeatureCache(vc_config.get("sampler_cache_dir", "./sampler_cache"), max_mb = max_mb, names = ("audio",), dtype = np.float32)
+
+
+# サンプラーのスロットの、スタイル埋め込みとプロット用の HarmoF0 出力のキャッシュ。portfolio と同じ場所に置く
+# （"./styles/sample_portfolio.json" なら "./styles/sample_portfolio_cache"）。sampler_style_cache_mb が 0 以下なら None
+def make_style_cache(portfolio_path: str, vc_config):
+    max_mb = vc_config.get("sampler_style_cache_mb", 256.0)
+    if max_mb <= 0:
+        return None
+    return FeatureCache(
+        os.path.splitext(portfolio_path)[0] + "_cache",
+        max_mb = max_mb,
+        names = ("real_F0", "activation", "spectrogram", "style", "window_styles", "window_info"),
+        dtype = {"spectrogram": np.float16}, # スペクトログラムは表示にしか使わない。それ以外は float32
+    )
+
+
+# サンプラーの試聴用に、サンプルをオフライン変換した結果のキャッシュ。sampler_preview_mb が 0 以下なら None
+def make_preview_cache(vc_config):
+    max_mb = vc_config.get("sampler_preview_mb", 512.0)
+    if max_mb <= 0:
+        return None
+    return FeatureCache(vc_config.get("sampler_preview_dir", "./sampler_preview"), max_mb = max_mb, names = ("audio",), dtype = np.float32)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import time
+import logging
+
+import wx
+
+
+# 各ウィジェットが wx.Timer を個別に持つと、タブの表示有無にかかわらず全員が独立に起床して GUI スレッドを奪い合う。
+# GuiScheduler は主窓に 1 つだけ置き、単一の wx.Timer（フレームクロック）から各ウィジェットの update を呼び分ける。
+#   - 周期（ms）はウィジェットごとに従来の値を保つ。各 tick で期限の来たタスクだけを実行する
+#   - 1 tick あたりの処理時間に予算を設け、超えた分のタスクは次の tick に回す（優先度順）
+#   - 後回しにされたタスクは遅れた周期数だけ優先度が繰り上がるので、低優先度のタスクも飢餓にならない
+#   - 画面に出ていない（非表示タブ、最小化）ウィジェットは呼ばない。ただしスタイルの決定など、
+#     表示と無関係な仕事を update に持つウィジェットは always = True で登録して常に実行する
+#   - 実行時間は累積しており、直近 1 秒あたりの GUI 処理時間（ms/s）として参照できる
+
+# 優先度は小さいほど先に実行される
+PRIORITY_CONTROL = 0 # ステータスバーや VC の状態表示、バックエンドにスタイルを渡す処理
+PRIORITY_MONITOR = 1 # レベルメーターやラベル類
+PRIORITY_PLOT = 2 # 波形、スペクトログラムなどの描画
+PRIORITY_BACKGROUND = 3 # 見た目の整合処理など、多少遅れても困らないもの
+
+
+class ScheduledTask:
+    """
+    GuiScheduler に登録された 1 つの周期処理。Start / Stop / IsRunning を持つので、wx.Timer の代わりに self.timer に入れて使える。
+    """
+    def __init__(
+        self,
+        scheduler,
+        window,
+        handler,
+        period_ms: int,
+        priority: int = PRIORITY_MONITOR,
+        always: bool = False, # True なら、ウィジェットが画面に出ていなくても実行する
+        on_visibility = None, # 表示状態が切り替わったときに bool を渡して呼ぶ callable
+        name: str = None,
+    ):
+        self.scheduler = scheduler
+        self.window = window
+        self.handler = handler
+        self.period_ns = int(period_ms * 1e+6)
+        self.priority = priority
+        self.always = always
+        self.on_visibility = on_visibility
+        self.name = name if name is not None else window.__class__.__name__
+
+        self.running = False
+        self.next_due = 0
+        self.visible = None # 未確定。最初の判定で必ず on_visibility が呼ばれる
+        self.cpu_ns = 0 # 累積の実行時間
+        self.n_run = 0
+        self.n_skip = 0 # 非表示のため呼ばなかった回数
+
+
+    def Start(self, period_ms: int = None):
+        if period_ms is not None:
+            self.period_ns = int(period_ms * 1e+6)
+        self.next_due = time.perf_counter_ns() + self.period_ns
+        self.running = True
+        return True
+
+
+    def Stop(self):
+        self.running = False
+
+
+    def IsRunning(self):
+        return self.running
+
+
+    def set_visible(self, visible: bool):
+        if visible != self.visible:
+            self.visible = visible
+            if self.on_visibility is not None:
+                self.on_visibility(visible)
+
+
+class GuiScheduler:
+    def __init__(
+        self,
+        owner, # 主窓。tick 用の wx.Timer をここにバインドする
+        tick_ms: int = 16, # フレームクロックの周期
+        budget_ms: float = 8.0, # 1 tick で使ってよい処理時間。これを超えたら残りは次の tick に回す
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.owner = owner
+        self.tick_ms = tick_ms
+        self.budget_ns = int(budget_ms * 1e+6)
+        self.tasks = []
+
+        # 直近 1 秒の集計
+        self.cpu_ms_per_sec = 0.0 # 1 秒あたりに GUI の update 処理が消費した時間
+        self.deferred_per_sec = 0 # 予算超過で次の tick に回した回数
+        self.skipped_per_sec = 0 # 非表示のため呼ばなかった回数
+        self.report_start = time.perf_counter_ns()
+        self.report_cpu_ns = 0
+        self.report_deferred = 0
+        self.report_skipped = 0
+
+        self.timer = wx.Timer(owner)
+        owner.Bind(wx.EVT_TIMER, self.on_tick, self.timer)
+        self.timer.Start(self.tick_ms)
+
+        self.logger.debug(f"Initialized (tick {self.tick_ms} ms, budget {budget_ms} ms).")
+
+
+    def register(
+        self,
+        window,
+        handler,
+        period_ms: int,
+        priority: int = PRIORITY_MONITOR,
+        always: bool = False,
+        on_visibility = None,
+        name: str = None,
+        start: bool = True,
+    ):
+        task = ScheduledTask(
+            self, window, handler, period_ms, 
+            priority = priority, always = always, on_visibility = on_visibility, name = name,
+        )
+        self.tasks.append(task)
+        if start:
+            task.Start()
+        return task
+
+
+    def unregister(self, task):
+        task.Stop()
+        if task in self.tasks:
+            self.tasks.remove(task)
+
+
+    def Stop(self):
+        self.timer.Stop()
+
+
+    def is_visible(self, window):
+        return window.IsShownOnScreen() and not window.GetTopLevelParent().IsIconized()
+
+
+    def on_tick(self, event):
+        now = time.perf_counter_ns()
+
+        # 破棄されたウィジェット（wx の削除済みオブジェクトは偽になる）は登録から外す
+        if not all(task.window for task in self.tasks):
+            self.tasks = [task for task in self.tasks if task.window]
+
+        due = [task for task in self.tasks if task.running and now >= task.next_due]
+        # 期限を過ぎた周期数だけ優先度を繰り上げる。同順位なら期限の古いものから
+        due.sort(key = lambda task: (task.priority - (now - task.next_due) // task.period_ns, task.next_due))
+
+        spent = 0
+        for i, task in enumerate(due):
+            if spent >= self.budget_ns and i > 0:
+                # 予算切れ。next_due は据え置きなので、次の tick で優先度が上がった状態で再挑戦する
+                self.report_deferred += len(due) - i
+                break
+
+            task.next_due = now + task.period_ns
+            if not task.always:
+                visible = self.is_visible(task.window)
+                task.set_visible(visible)
+                if visible is False:
+                    task.n_skip += 1
+                    self.report_skipped += 1
+                    continue
+
+            t0 = time.perf_counter_ns()
+            try:
+                task.handler(event)
+            except Exception:
+                # 1 つのウィジェットの例外で全体のクロックが止まらないようにする
+                self.logger.exception(f"Update of {task.name} failed.")
+            dt = time.perf_counter_ns() - t0
+            task.cpu_ns += dt
+            task.n_run += 1
+            spent += dt
+
+        self.report_cpu_ns += spent
+
+        elapsed = time.perf_counter_ns() - self.report_start
+        if elapsed >= 1e+9:
+            self.cpu_ms_per_sec = self.report_cpu_ns / elapsed * 1e+3 # ns/ns * 1000 ms
+            self.deferred_per_sec = self.report_deferred
+            self.skipped_per_sec = self.report_skipped
+            self.report_start += elapsed
+            self.report_cpu_ns = 0
+            self.report_deferred = 0
+            self.report_skipped = 0
+
+
+# ウィジェット側から呼ぶ共通の入口。主窓が scheduler を持っていれば登録し、持っていなければ（単体テスト用の
+# MainFrame など）従来どおり専用の wx.Timer を作る。どちらも Start / Stop / IsRunning を持つ。
+def start_update_timer(
+    window,
+    handler,
+    period_ms: int,
+    priority: int = PRIORITY_MONITOR,
+    always: bool = False,
+    on_visibility = None,
+    name: str = None,
+):
+    scheduler = getattr(window.GetTopLevelParent(), 'scheduler', None)
+    if scheduler is None:
+        timer = wx.Timer(window)
+        window.Bind(wx.EVT_TIMER, handler, timer)
+        timer.Start(period_ms)
+        return timer
+    return scheduler.register(
+        window, handler, period_ms, 
+        priority = priority, always = always, on_visibility = on_visibility, name = name,
+    )
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import os
+import json
+import time
+import threading
+import logging
+
+
+# ポートフォリオや vc_config などの json 設定ファイルを、GUI スレッドの外で書き出すためのモジュール。
+#   - schedule() は保存したい dict（の参照）をパスごとの予約として登録するだけで、すぐに戻る。
+#     同じパスへの予約は、書き出されるまで 1 つにまとめられる（スライダーを動かし続けても毎回は書かない）
+#   - 書き出しは専用スレッドが行い、同じパスへの書き出しは interval_sec 秒に 1 回までに抑える
+#   - 書き出しは同じフォルダの一時ファイルに書いてから os.replace するので、途中で落ちても壊れたファイルは残らない
+#   - 呼び出し元は dict を書き換えたら必ず schedule() し直す前提なので、書き出し中に dict が書き換えられて
+#     中途半端な内容になっても、次の予約で最新の内容に上書きされる
+#   - flush() は予約をすべてその場で書き出す。アプリ終了時は shutdown() でスレッドを止めてから残りを書き出す
+
+
+# 一時ファイルに書いてから置き換える。GUI を持たないスクリプト等からも使える
+def write_json_atomic(
+    path: str,
+    obj,
+    indent: int = 4,
+):
+    dir_name = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dir_name, exist_ok = True)
+    text = json.dumps(obj, indent = indent)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JsonWriter:
+    def __init__(
+        self,
+        interval_sec: float = 1.0, # 同じパスに書き出す最小間隔
+        indent: int = 4,
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.interval_sec = max(float(interval_sec), 0.0)
+        self.indent = indent
+
+        self.pending = {} # path -> 保存する dict。書き出されるまで最新の予約だけを持つ
+        self.due = {} # path -> 書き出してよい時刻
+        self.last_write = {} # path -> 前回書き出した時刻
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.running = True
+
+        # 統計。n_requests 回の予約を n_writes 回の書き出しで済ませた
+        self.n_requests: int = 0
+        self.n_writes: int = 0
+        self.n_failed: int = 0
+        self.schedule_sec: float = 0.0 # 呼び出し側のスレッドで schedule() に掛かった合計時間
+        self.write_sec: float = 0.0 # 書き出しスレッドで json を書き出すのに掛かった合計時間
+
+        self.thread = threading.Thread(target = self._run, name = "JsonWriter", daemon = True)
+        self.thread.start()
+
+
+    # path への書き出しを予約する。obj は呼び出し側が持っている dict そのものでよい（書き出し時に直列化する）
+    def schedule(
+        self,
+        path: str,
+        obj,
+    ):
+        t0 = time.perf_counter()
+        with self.cond:
+            self.n_requests += 1
+            if path not in self.pending:
+                self.due[path] = max(time.monotonic(), self.last_write.get(path, 0.0) + self.interval_sec)
+                self.cond.notify()
+            self.pending[path] = obj # 予約済みなら中身だけ差し替え、書き出し時刻は変えない
+            running = self.running
+        self.schedule_sec += time.perf_counter() - t0
+        if not running:
+            self.flush() # 終了処理の後に来た予約は、その場で書く
+
+
+    # 予約をすべてその場で書き出す
+    def flush(self):
+        with self.cond:
+            paths = list(self.pending.keys())
+        for path in paths:
+            self._write(path)
+
+
+    # 書き出しスレッドを止め、残っている予約を書き出す。統計をログに残す
+    def shutdown(self, timeout: float = 5.0):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(timeout = timeout)
+        self.flush()
+        self.logger.info(self.summary())
+
+
+    # GUI スレッドで書いていたら掛かっていたはずの時間（1 回あたりの書き出し時間 x 予約数）から、
+    # 実際に schedule() に掛かった時間を引いたものを「節約した時間」とする
+    def summary(self) -> str:
+        mean_write = self.write_sec / self.n_writes if self.n_writes > 0 else 0.0
+        saved = mean_write * self.n_requests - self.schedule_sec
+        return (
+            f"json writes: {self.n_writes} for {self.n_requests} requests ({self.n_failed} failed), "
+            f"{mean_write * 1000:.2f} ms/write, GUI-thread time saved: {saved * 1000:.1f} ms"
+        )
+
+
+    # 予約を取り出して書き出す。ファイルへの書き込みは self.cond の外で行うので、その間も schedule() は待たされない。
+    # 書き出しスレッドと flush() が同じ一時ファイルに同時に書かないよう、書き込み自体は write_lock で 1 つずつ行う
+    def _write(self, path: str):
+        with self.write_lock:
+            with self.cond:
+                obj = self.pending.pop(path, None)
+                self.due.pop(path, None)
+            if obj is None:
+                return
+            t0 = time.perf_counter()
+            try:
+                write_json_atomic(path, obj, indent = self.indent)
+                ok, failed = True, False
+            except RuntimeError:
+                # 直列化の途中で dict の大きさが変わった。書き換えた側が予約し直すはずだが、念のため予約に戻す
+                ok, failed = False, False
+            except Exception as e:
+                ok, failed = False, True
+                self.logger.warning(f"Failed to save '{path}': {e}")
+            elapsed = time.perf_counter() - t0
+            with self.cond:
+                self.write_sec += elapsed
+                self.n_writes += int(ok)
+                self.n_failed += int(failed)
+                self.last_write[path] = time.monotonic()
+                if not ok and not failed and path not in self.pending:
+                    self.pending[path] = obj
+                    self.due[path] = self.last_write[path] + self.interval_sec
+                    self.cond.notify()
+
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                if len(self.due) == 0:
+                    self.cond.wait()
+                    continue
+                path, due = min(self.due.items(), key = lambda kv: kv[1])
+                wait_sec = due - time.monotonic()
+                if wait_sec > 0:
+                    self.cond.wait(timeout = wait_sec)
+                    continue
+            self._write(path)
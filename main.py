@@ -21,7 +21,9 @@ from wx.adv import SplashScreen as SplashScreen
 import signal
 import os
 import copy
-import json
+from datetime import datetime
+
+import numpy as np
 
 import logging
 import inspect
@@ -45,6 +47,8 @@ from sample_manager import SampleManagerPanel
 from plot_content import PlotEmbeddingPanel
 from style_manager import StyleManagerPanel
 from style_full_manager import FullManagerPanel
+from gui_scheduler import GuiScheduler, PRIORITY_CONTROL
+from utils import sanitize_filename
 
 
 # メニューバーの部品定義とイベントハンドラの作り込み。
@@ -65,6 +69,18 @@ class SoundAppMenu(): # フレーム直下に配置するメニューバー。
         self.frame.Bind(wx.EVT_MENU, self.on_save_app_conf, menu_SaveCurrentAppConf) 
         self.frame.Bind(wx.EVT_MENU, self.on_save_vc_conf, menu_SaveCurrentVCConf) 
 
+        # 直近の入出力音声を、録音を止めずにその場でファイルに書き出す
+        menu_SaveSnapshot = menu_file.Append(wx.ID_ANY, '直前の音声を保存\tCtrl+Shift+S')
+        self.frame.Bind(wx.EVT_MENU, self.on_save_snapshot, menu_SaveSnapshot) 
+
+        # 選んだファイルを、スタイル編集とサンプラーの使用中スロットのスタイルでそれぞれ変換する
+        menu_ConvertAllStyles = menu_file.Append(wx.ID_ANY, 'ファイルを全スロットのスタイルで変換...')
+        self.frame.Bind(wx.EVT_MENU, self.on_convert_all_styles, menu_ConvertAllStyles) 
+
+        # ドラッグ＆ドロップで積んだオフライン VC のジョブを、実行中のものも含めてすべて取り消す
+        menu_CancelOffline = menu_file.Append(wx.ID_ANY, 'オフライン変換をすべて中止')
+        self.frame.Bind(wx.EVT_MENU, self.on_cancel_offline, menu_CancelOffline) 
+
         quitItem = menu_file.Append(wx.ID_EXIT, '終了(Q)\tCtrl+Q')
         self.frame.Bind(wx.EVT_MENU, self.frame.on_frame_close, quitItem) # 属している親フレームのデフォルトメソッドを割り当て
         
@@ -84,6 +100,15 @@ class SoundAppMenu(): # フレーム直下に配置するメニューバー。
     def on_save_vc_conf(self, event):
         self.frame.save_vc_conf()
 
+    def on_save_snapshot(self, event):
+        self.frame.save_snapshot()
+
+    def on_convert_all_styles(self, event):
+        self.frame.convert_with_slot_styles()
+
+    def on_cancel_offline(self, event):
+        self.frame.sc.offline_worker.cancel_all()
+
 
 
 class Frame(wx.Frame):
@@ -114,6 +139,14 @@ class Frame(wx.Frame):
         # ステータスバーの作成
         self.sb = self.CreateStatusBar(number = 4)
         self.sb.SetStatusText('Ready', i = 0) # ステータスバーに文字を表示させる
+
+        # 各パネルの周期的な update は、ここで作る単一のフレームクロックから呼び分ける。
+        # パネルは初期化時に self.scheduler を探して登録するので、子パネルより先に作っておく必要がある。
+        self.scheduler = GuiScheduler(
+            self, 
+            tick_ms = self.app_config.get("gui_tick_ms", 16), 
+            budget_ms = self.app_config.get("gui_frame_budget_ms", 8.0),
+        )
         
         # メニューバーの作成
         SoundAppMenu(self)
@@ -261,6 +294,7 @@ class Frame(wx.Frame):
                 harmof0_ckpt = self.vc_config["model"]["harmof0_ckpt"],
                 SE_ckpt = self.vc_config["model"]["SE_ckpt"],
                 max_slots = self.app_config["max_slots"], 
+                restore_slot = self.app_config["restore_slot"],
                 portfolio_path = self.app_config["sample_portfolio_path"], 
             )
             self.sampler_tab_sizer.Add(self.sampler_panel, proportion = 0, flag = wx.GROW | wx.ALL, border = 0)
@@ -308,10 +342,7 @@ class Frame(wx.Frame):
         # パネル内部の機能を初期化し終えたので、後は終了処理や、主窓上の独立したループ処理などを定義。
 
         # 以下はステータスバー（plot とも stream とも別サイクルの更新処理）を、主窓に入れる場合のみ
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        # wx.EvtHandler 由来の Bind() メソッドで、イベントの種類とハンドラ・メソッドを紐付ける。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(37) # タイマーは手動で起動する必要がある。単位 ms
+        self.timer = self.scheduler.register(self, self.update, 37, priority = PRIORITY_CONTROL) # 単位 ms
 
         # メインウィンドウを閉じたときの挙動として、アプリの終了を追加
         self.Bind(wx.EVT_CLOSE, self.on_frame_close)
@@ -344,21 +375,25 @@ class Frame(wx.Frame):
         )
 
         self.sb.SetStatusText(
-            "(CE{:_>5.1f} | w2s{:_>5.1f} | SE{:_>5.1f} | f0n{:_>5.1f} | D{:_>5.1f} )".format(
+            "(CE{:_>5.1f} | w2s{:_>5.1f} | SE{:_>5.1f} | f0n{:_>5.1f} | D{:_>5.1f} | w2s_o{:_>5.1f} )".format(
                 self.sc.efx_control.CE_lap, # 10 ないし 20 ms
                 self.sc.efx_control.harmof0_lap,
                 self.sc.efx_control.SE_lap, # 10 前後
                 self.sc.efx_control.f0n_lap, # 20 ms まで伸びる → 少し len_proc の影響を受ける
                 self.sc.efx_control.decode_lap, # 50--90 ms くらい → 少し len_proc の影響を受ける
+                self.sc.efx_control.spec_o_lap, # 起動時に HarmoF0 との比較をログに出している
             ), 
             i = 2,
         )
 
         self.sb.SetStatusText(
-            "Plot lapse: wav {: >4.2f} ms, spec {: >4.2f}/{: >4.2f} ms".format(
+            "Plot lapse: wav {: >4.2f} ms, spec {: >4.2f}/{: >4.2f} ms | drop {}/{} | GUI {: >5.1f} ms/s".format(
                 self.monitor_widgets_panel.wav_i_panel.lapse,
                 self.monitor_widgets_panel.mel_pre_panel.lapse,
                 self.monitor_widgets_panel.mel_post_panel.lapse,
+                self.sc.wq_input.dropped, # 波形プロットが間に合わずに捨てた bucket 数
+                self.sc.wq_output.dropped,
+                self.scheduler.cpu_ms_per_sec, # 全パネルの update が 1 秒あたりに使った時間
             ), 
             i = 3,
         )
@@ -370,19 +405,68 @@ class Frame(wx.Frame):
 
 
     # 現在の app_config を上書き保存する。上のメニューから呼び出せる。
+    # 書き出しは backend の JsonWriter が別スレッドで行う（続けて呼ばれても interval ごとに 1 回にまとめられる）
     def save_app_conf(self):
-        with open(self.app.app_config_path, 'w') as f:
-            json.dump(self.app_config, f, indent = 4)
+        self.sc.json_writer.schedule(self.app.app_config_path, self.app_config)
 
 
     # 現在の vc_config を上書き保存する。上のメニューから呼び出せる。
     def save_vc_conf(self):
-        with open(self.app.vc_config_path, 'w') as f:
-            json.dump(self.vc_config, f, indent = 4)
+        self.sc.json_writer.schedule(self.app.vc_config_path, self.vc_config)
+
+
+    # backend の RollingArchive から直前 snapshot_sec 秒の入出力音声を切り出して保存する。書き出しは別スレッド
+    def save_snapshot(self):
+        if self.sc.archive is None:
+            self.sb.SetStatusText("Snapshot is disabled (archive_minutes = 0)", i = 0)
+            return
+        path_prefix = os.path.join(
+            self.vc_config.get("snapshot_dir", "./snapshots"), 
+            "snap_" + datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),
+        )
+        started = self.sc.archive.save_snapshot(
+            seconds = self.vc_config.get("snapshot_sec", 60.0),
+            path_prefix = path_prefix,
+            file_format = self.vc_config.get("snapshot_format", "WAV"),
+        )
+        if not started:
+            self.sb.SetStatusText("Snapshot is being saved ...", i = 0)
+
+
+    # 選んだ音声ファイルを、スタイルを持つ全スロットのスタイルでそれぞれオフライン変換する。
+    # 変換は backend の OfflineWorker が行い、ソースの特徴量は 1 回だけ計算して全スタイルで使い回す。
+    # 出力は入力ファイルと同じ場所の converted フォルダに "<元の名前>_<スロット名>.wav" で書き出す
+    def convert_with_slot_styles(self):
+        styles = self.style_panel.slot_styles()
+        if self.style_from_sample:
+            styles += self.sampler_panel.slot_styles()
+        if len(styles) == 0:
+            self.sb.SetStatusText("No slot has a style to convert with", i = 0)
+            return
+
+        with wx.FileDialog(
+            self, 
+            "Select audio files to convert", 
+            wildcard = "Audio files (*.wav;*.ogg;*.mp3;*.m4a;*.flac;*.opus)|*.wav;*.ogg;*.mp3;*.m4a;*.flac;*.opus",
+            style = wx.FD_OPEN | wx.FD_FILE_MUST_EXIST | wx.FD_MULTIPLE,
+        ) as dialog:
+            if dialog.ShowModal() == wx.ID_CANCEL:
+                return
+            paths = dialog.GetPaths()
+
+        style_vects = np.concatenate([style for _, style in styles], axis = 0).astype(np.float32)
+        labels = [sanitize_filename(name) for name, _ in styles]
+        for path in paths:
+            save_dir_name = os.path.join(os.path.dirname(path), "converted")
+            os.makedirs(save_dir_name, exist_ok = True)
+            stem = os.path.splitext(os.path.basename(path))[0]
+            out_paths = [os.path.join(save_dir_name, f"{stem}_{label}.wav") for label in labels]
+            self.sc.offline_worker.submit_styles(path, out_paths, style_vects)
+        self.sb.SetStatusText(f"Converting {len(paths)} files with {len(styles)} styles", i = 0)
 
 
     # プログラム内で vc_config 由来の設定値を更新した時、メモリ上の元の dict に書き戻す。
-    # save を指定した場合は、update された vc_config をローカルの json ファイルに上書きする処理まで行う。
+    # save を指定した場合は、update された vc_config をローカルの json ファイルに上書きする予約まで行う。
     # ちなみに target_dict の更新は常に inplace で実行される
     def update_vc_config(
         self,
@@ -422,15 +506,15 @@ class Frame(wx.Frame):
     # ウィンドウを閉じたときの挙動には、アプリケーションの終了処理まで含まれている
     # TODO Windows においてアプリケーションを数十分以上起動すると、終了処理が正しく走らなくなる。
     def _on_frame_close(self):
+        self.scheduler.Stop() # 以降はパネルの update を呼ばない
         self.sc.input_stream.stop() 
         self.sc.input_stream.close() 
         self.sc.output_stream.stop() 
         self.sc.output_stream.close() 
-        # サンプラーは独自のオーディオストリームを持つので（贅沢だねぇ）、ご退場願う
+        # サンプラーは backend の入力 callback から引かれるだけで、独自のオーディオストリームは持たない
         if self.style_from_sample:
-            self.sampler_panel.output_stream.stop() 
-            self.sampler_panel.output_stream.close() 
-        self.sc.terminate() # audio backend 自体を終了
+            self.sampler_panel.sample_loader.shutdown() # ロード中のサンプルがあれば、それが終わるのを待つ
+        self.sc.shutdown() # audio backend 自体を終了。録音中なら最後のバッファまで書き出す
         self.Destroy() # frame 自体を終了
         self.app.ExitMainLoop() # アプリケーションを終了
 
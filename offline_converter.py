@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import os
+import time
+import math
+import copy
+import contextlib
+import logging
+import inspect
+
+import numpy as np
+import soundfile as sf
+import onnxruntime as ort
+
+from vc_engine import select_onnx_providers, run_offline_models, run_multi_style
+from audio_io import open_audio_source, read_resampled
+
+
+# ファイルに対するオフライン VC を、区間（チャンク）ごとに処理する。
+# 以前は AudioEfx.convert_offline にファイル全体を一度に渡していたため、offline_max_sec で冒頭を切り詰める必要があり、
+# メモリもファイル長に比例していた。ここではファイルをシークしながら読み、各チャンクの前後にモデルの受容野を
+# カバーする文脈（context）を付けて変換し、デコーダ出力を線形クロスフェードで重ね合わせてそのままディスクに書き出す。
+#
+# 時間軸は ContentVec のフレーム（16 kHz で 320 サンプル = 20 ms）を単位とする。
+# 入力 320 * n + 80 サンプル（HuBERT の窓 400 サンプル）で n フレームになり、デコーダ出力は 1 フレームあたり sr_dec / 50 サンプル。
+
+CONTENT_HOP = 320 # 16 kHz での ContentVec のフレーム間隔
+CONTENT_WIN = 400 # 同じく 1 フレームの窓長
+
+
+class OfflineEngine:
+    """
+    オフライン変換専用の ONNX セッション一式。audio backend を必要としないので、バッチ変換の子プロセスや
+    リアルタイム VC と並行して動かすワーカーで使う。convert_offline の使い方は AudioEfx と同じ。
+    """
+    def __init__(
+        self,
+        vc_config,
+        intra_op_threads: int = 0, # 各セッションのスレッド数。0 なら ONNX Runtime に任せる
+        target_style = None, # 自動推定しない場合の変換先スタイル (1, 128)
+        feature_cache = None, # FeatureCache。あれば同じ音声の HarmoF0 と ContentVec の出力を使い回す
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.vc_config = vc_config
+        self.sr_proc = self.vc_config["backend"]["sr_proc"]
+        self.sr_dec = self.vc_config["backend"]["sr_decode"]
+
+        self.auto_encode = self.vc_config["auto_encode"]
+        self.pitch_shift = self.vc_config["pitch_shift"]
+        self.absolute_pitch = self.vc_config["absolute_pitch"]
+        self.estimate_energy = self.vc_config["estimate_energy"]
+        self.target_style = target_style
+        self.feature_cache = feature_cache
+        self.before_run = None # あれば、各モデル呼び出しの直前に呼ぶ。リアルタイム VC と並行するワーカーが負荷を見て待つのに使う
+
+        self.onnx_provider_list, self.device = select_onnx_providers(self.vc_config["model"]["model_device"])
+        so = ort.SessionOptions()
+        so.log_severity_level = 3
+        so.intra_op_num_threads = intra_op_threads
+        so.inter_op_num_threads = 1
+        self.session_options = so
+
+        time0 = time.perf_counter_ns()
+        model = self.vc_config["model"]
+        self.harmof0_ckpt = model["harmof0_ckpt"] # 特徴量キャッシュのキーに使う
+        self.CE_ckpt = model["CE_ckpt"]
+        self.sess_HarmoF0 = self.make_session(model["harmof0_ckpt"])
+        self.sess_CE = self.make_session(model["CE_ckpt"])
+        self.sess_SE = self.make_session(model["SE_ckpt"])
+        self.sess_f0n = self.make_session(model["f0n_ckpt"])
+        self.sess_dec = self.make_session(model["decoder_ckpt"])
+        self.logger.debug(f"Sessions were created in {(time.perf_counter_ns() - time0)/1e+6: >7.1f} ms ({self.onnx_provider_list}, intra-op threads: {intra_op_threads}).")
+
+
+    def make_session(self, ckpt):
+        return GatedSession(
+            ort.InferenceSession(ckpt, providers = self.onnx_provider_list, session_options = self.session_options),
+            self,
+        )
+
+
+    def convert_offline(
+        self,
+        tensor_i16,
+        style_vect = None,
+        return_style: bool = False,
+        n_valid = None,
+    ):
+        if style_vect is None and not self.auto_encode:
+            style_vect = self.target_style
+        tensor_recon, style_vect = run_offline_models(self, tensor_i16, style_vect = style_vect, n_valid = n_valid)
+        if return_style:
+            return tensor_recon, style_vect
+        return tensor_recon
+
+
+    def convert_offline_styles(
+        self,
+        tensor_i16,
+        style_vects,
+        max_batch: int = 8,
+    ):
+        return run_multi_style(self, tensor_i16, style_vects, max_batch = max_batch)
+
+
+class GatedSession:
+    """
+    InferenceSession の run の直前に engine.before_run を呼ぶだけの薄いラッパー。
+    スレッドの優先度は GPU 上の実行には効かず、Windows では ONNX Runtime のスレッドプールにも引き継がれないので、
+    チャンクの切れ目だけでなくモデル呼び出しごとにリアルタイム側へ譲れるようにする
+    """
+    def __init__(self, sess, engine):
+        self.sess = sess
+        self.engine = engine
+
+
+    def run(self, *args, **kwargs):
+        if self.engine.before_run is not None:
+            self.engine.before_run()
+        return self.sess.run(*args, **kwargs)
+
+
+class WindowStitcher:
+    """
+    1 ファイル分の窓（チャンク＋前後の文脈）ごとの変換結果を、担当区間だけ切り出してクロスフェードで繋ぐ。
+    窓は先頭から順に add すること。戻り値はそのまま書き出してよい確定済みの出力
+    """
+    def __init__(
+        self,
+        n_frames: int, # ファイル全体の ContentVec フレーム数
+        fade_frames: int,
+    ):
+        self.n_frames = n_frames
+        self.fade_frames = fade_frames
+        self.out_hop = None # 出力の 1 フレームあたりのサンプル数。最初の窓で確定させる
+        self.tail = None # 前の窓のフェードアウト部分。次の窓のフェードインに足し込む
+
+
+    def add(self, y, window):
+        f0, f1, w0, w1 = window
+        if self.out_hop is None:
+            self.out_hop = int(round(y.shape[0] / (w1 - w0)))
+            self.fade = self.fade_frames * self.out_hop // 2 * 2
+            self.ramp_in = ((np.arange(self.fade) + 0.5) / max(self.fade, 1)).astype(np.float32)
+            self.ramp_out = 1 - self.ramp_in
+        out_hop, fade = self.out_hop, self.fade
+        is_first = f0 == 0
+        is_last = f1 >= self.n_frames
+
+        # この窓が担当する出力区間。境界の前後 fade / 2 ずつをクロスフェードに使う
+        a = f0 * out_hop - (0 if is_first else fade // 2)
+        b = f1 * out_hop + (0 if is_last else fade // 2)
+        seg = np.zeros(b - a, dtype = np.float32)
+        part = y[a - w0 * out_hop:b - w0 * out_hop]
+        seg[:part.shape[0]] = part
+
+        if not is_first and fade > 0:
+            seg[:fade] = seg[:fade] * self.ramp_in + self.tail
+        if not is_last and fade > 0:
+            self.tail = seg[-fade:] * self.ramp_out
+            seg = seg[:-fade]
+        return seg
+
+
+class ChunkedOfflineConverter:
+    def __init__(
+        self,
+        efx, # AudioEfx か OfflineEngine。convert_offline と sr_proc, sr_dec を借りる
+        chunk_sec: float = 10.0, # 1 回のモデル呼び出しで確定させる長さ
+        context_sec: float = 1.0, # チャンクの前後に付ける文脈。出力には使わない
+        fade_sec: float = 0.1, # チャンク境界のクロスフェード長。context_sec の 2 倍以下であること
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.efx = efx
+        self.sr_proc = efx.sr_proc
+        self.sr_dec = efx.sr_dec
+        self.frame_rate = self.sr_proc // CONTENT_HOP # 50 フレーム/秒
+        self.chunk_frames = max(1, int(round(chunk_sec * self.frame_rate)))
+        self.context_frames = max(0, int(round(context_sec * self.frame_rate)))
+        # フェードはフレーム境界を中心に前後 fade_frames / 2 ずつ。文脈の範囲内に収める
+        self.fade_frames = min(int(round(fade_sec * self.frame_rate)), 2 * self.context_frames)
+        self.fade_frames -= self.fade_frames % 2
+
+
+    # 16 kHz 換算で [start16, stop16) の区間を、元のサンプリング周波数から切り出してリサンプルする
+    def read_16k(self, source, start16: int, stop16: int):
+        return read_resampled(source, self.sr_proc, start16, stop16)
+
+
+    # ソースの 16 kHz 換算の ContentVec フレーム数
+    def count_frames(self, source) -> int:
+        n_16k = int(math.ceil(source.n_samples * self.sr_proc / source.sr))
+        return max(1, (n_16k - CONTENT_WIN) // CONTENT_HOP + 1)
+
+
+    # ファイル全体を窓に分ける。(担当区間の先頭, 末尾, 文脈込みの窓の先頭, 末尾) をフレーム単位で並べたリスト
+    def plan_windows(self, n_frames: int):
+        windows = []
+        for f0 in range(0, n_frames, self.chunk_frames):
+            f1 = min(n_frames, f0 + self.chunk_frames)
+            windows.append((f0, f1, max(0, f0 - self.context_frames), min(n_frames, f1 + self.context_frames)))
+        return windows
+
+
+    # 窓に対応する 16 kHz の入力を読む。長さは (w1 - w0) フレーム分
+    def read_window(self, source, window):
+        _, _, w0, w1 = window
+        return self.read_16k(source, w0 * CONTENT_HOP, w1 * CONTENT_HOP + CONTENT_WIN - CONTENT_HOP)
+
+
+    # 1 ファイルを変換して out_path に書き出す。統計情報の dict を返す
+    def convert_file(
+        self,
+        in_path: str,
+        out_path: str,
+        progress = None, # progress(完了フレーム数, 総フレーム数) を各チャンクの後に呼ぶ
+        cancel = None, # threading.Event。セットされたらチャンクの切れ目で中断する
+        style_vect = None, # None なら efx.convert_offline の既定（自動推定か、現在の変換先スタイル）
+        max_sec: float = None, # 与えれば冒頭のこの秒数だけを変換する
+    ) -> dict:
+        time0 = time.perf_counter_ns()
+        source = open_audio_source(in_path, max_sec = max_sec)
+        try:
+            with sf.SoundFile(out_path, mode = 'w', samplerate = self.sr_dec, channels = 1, subtype = 'FLOAT') as writer:
+                stats = self.convert_source(source, writer.write, progress = progress, cancel = cancel, style_vect = style_vect)
+        finally:
+            source.close()
+        stats["wall_sec"] = (time.perf_counter_ns() - time0) / 1e+9
+        stats["speed"] = stats["audio_sec"] / max(stats["wall_sec"], 1e-9) # 1 秒あたりに変換できた音声の秒数
+        self.logger.debug(f"({inspect.currentframe().f_code.co_name}) '{os.path.basename(in_path)}' -> '{out_path}': {stats}")
+        return stats
+
+
+    # 1 ファイルを K 個のスタイル (K, 128) で変換し、out_paths[k] にそれぞれ書き出す。
+    # 各窓の HarmoF0 と ContentVec は 1 回だけ走り、f0n とデコーダは K 本をまとめて通す
+    def convert_file_styles(
+        self,
+        in_path: str,
+        out_paths: list,
+        style_vects,
+        progress = None,
+        cancel = None,
+        max_batch: int = 8, # f0n とデコーダに一度に通すスタイルの数
+    ) -> dict:
+        time0 = time.perf_counter_ns()
+        source = open_audio_source(in_path)
+        n_chunks = 0
+        cancelled = False
+        try:
+            n_frames = self.count_frames(source)
+            stitchers = [WindowStitcher(n_frames, self.fade_frames) for _ in out_paths]
+            with contextlib.ExitStack() as stack:
+                writers = [
+                    stack.enter_context(sf.SoundFile(path, mode = 'w', samplerate = self.sr_dec, channels = 1, subtype = 'FLOAT'))
+                    for path in out_paths
+                ]
+                for window in self.plan_windows(n_frames):
+                    if cancel is not None and cancel.is_set():
+                        cancelled = True
+                        break
+                    x16 = self.read_window(source, window)
+                    y = self.efx.convert_offline_styles(x16[np.newaxis, :], style_vects, max_batch = max_batch)
+                    for k, writer in enumerate(writers):
+                        writer.write(stitchers[k].add(y[k], window)[:, np.newaxis])
+                    n_chunks += 1
+                    if progress is not None:
+                        progress(window[1], n_frames)
+        finally:
+            source.close()
+
+        stats = {
+            "audio_sec": source.n_samples / source.sr,
+            "n_chunks": n_chunks,
+            "n_styles": len(out_paths),
+            "cancelled": cancelled,
+        }
+        stats["wall_sec"] = (time.perf_counter_ns() - time0) / 1e+9
+        # 1 秒あたりに変換できた音声の秒数。K 本の出力の合計で数える
+        stats["speed"] = stats["audio_sec"] * stats["n_styles"] / max(stats["wall_sec"], 1e-9)
+        self.logger.debug(f"({inspect.currentframe().f_code.co_name}) '{os.path.basename(in_path)}' -> {len(out_paths)} styles: {stats}")
+        return stats
+
+
+    def convert_source(
+        self,
+        source,
+        write, # 出力 (time, 1) の float32 を受け取る callable
+        progress = None,
+        cancel = None,
+        style_vect = None,
+    ) -> dict:
+        n_frames = self.count_frames(source)
+
+        # スタイルはファイル全体で固定する。最初のチャンクで実際に使われた値（自動推定の結果か、その時点の変換先）を使い回す
+
+        stitcher = WindowStitcher(n_frames, self.fade_frames)
+        n_chunks = 0
+        cancelled = False
+        for window in self.plan_windows(n_frames):
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+
+            x16 = self.read_window(source, window)
+            y, style_vect = self.efx.convert_offline(x16[np.newaxis, :], style_vect = style_vect, return_style = True)
+            if n_chunks == 0:
+                style_vect = copy.deepcopy(style_vect) # GUI 側で変換先が差し替えられても影響を受けないように
+            write(stitcher.add(y[0], window)[:, np.newaxis])
+
+            n_chunks += 1
+            if progress is not None:
+                progress(window[1], n_frames)
+
+        return {
+            "audio_sec": source.n_samples / source.sr,
+            "n_chunks": n_chunks,
+            "cancelled": cancelled,
+        }
+
+
+class BatchedOfflineConverter(ChunkedOfflineConverter):
+    """
+    多数のファイルをまとめて変換する。各ファイルを ChunkedOfflineConverter と同じ窓に分け、全ファイルの窓を長さ順に並べて
+    長さの近いもの同士（差が bucket_sec 以内）で最大 batch_size 本のバッチを作り、末尾をゼロ埋めして 1 回の ONNX 呼び出しで
+    HarmoF0, ContentVec, f0n, デコーダを通す。出力は各行の有効区間だけを切り出し、ファイルごとにクロスフェードで繋いで書き出す。
+
+    短いファイルを大量に変換する場合に、1 ファイルずつ batch 1 で呼ぶより演算器とスレッドの利用効率が上がる。
+    ContentVec は窓全体を見るので、ゼロ埋めの無音がわずかに出力に影響する。bucket_sec を小さくするとパディングは減るが、
+    バッチは小さくなる。グループ内の入出力はすべてメモリに置くので、呼び出し側でファイルを適当な量ずつ渡すこと。
+    """
+    def __init__(
+        self,
+        efx, # convert_offline が n_valid を受け付けるもの（OfflineEngine）
+        chunk_sec: float = 10.0,
+        context_sec: float = 1.0,
+        fade_sec: float = 0.1,
+        batch_size: int = 8, # 1 回の呼び出しで束ねる窓の最大数
+        bucket_sec: float = 1.0, # 同じバッチに入れる窓の長さの差の上限。パディングはこれ以下に収まる
+    ):
+        super().__init__(efx, chunk_sec = chunk_sec, context_sec = context_sec, fade_sec = fade_sec)
+        self.batch_size = max(1, batch_size)
+        self.bucket_frames = max(1, int(round(bucket_sec * self.frame_rate)))
+
+
+    # 窓のリスト [(ファイル番号, 窓番号, フレーム数)] を長さ順に並べ、長さの近いもの同士でバッチに分ける
+    def make_batches(self, items):
+        batches = []
+        for item in sorted(items, key = lambda item: item[2]):
+            if len(batches) == 0 or len(batches[-1]) >= self.batch_size or item[2] - batches[-1][0][2] > self.bucket_frames:
+                batches.append([])
+            batches[-1].append(item)
+        return batches
+
+
+    # pairs = [(入力パス, 出力パス), ...] をまとめて変換する。戻り値は (ファイルごとの統計のリスト, グループ全体の統計)
+    def convert_files(
+        self,
+        pairs,
+        progress = None, # progress(完了した窓の数, 窓の総数) を各バッチの後に呼ぶ
+        style_vect = None, # None なら efx.convert_offline の既定（自動推定か、efx の変換先スタイル）
+    ):
+        time0 = time.perf_counter_ns()
+
+        # 入力を先に 16 kHz で読んでおく。ファイルは読み終えたらすぐ閉じる
+        files = []
+        for in_path, out_path in pairs:
+            source = open_audio_source(in_path)
+            try:
+                n_frames = self.count_frames(source)
+                windows = self.plan_windows(n_frames)
+                files.append({
+                    "in_path": in_path,
+                    "out_path": out_path,
+                    "audio_sec": source.n_samples / source.sr,
+                    "n_frames": n_frames,
+                    "windows": windows,
+                    "inputs": [self.read_window(source, window) for window in windows],
+                    "outputs": [None] * len(windows),
+                    "style": style_vect,
+                })
+            finally:
+                source.close()
+        read_sec = (time.perf_counter_ns() - time0) / 1e+9
+
+        # スタイルはファイルごとに固定する（ChunkedOfflineConverter と同じく、最初の窓で使われた値）。
+        # そのため各ファイルの先頭の窓を先にまとめて変換し、残りの窓はそこで決まったスタイルで変換する
+        first_items = [(i, 0, f["windows"][0][3] - f["windows"][0][2]) for i, f in enumerate(files)]
+        rest_items = [
+            (i, j, w[3] - w[2]) for i, f in enumerate(files) for j, w in enumerate(f["windows"]) if j > 0
+        ]
+        n_total = len(first_items) + len(rest_items)
+
+        n_done = 0
+        n_batches = 0
+        valid_frames = 0
+        padded_frames = 0
+        infer_ns = 0
+        for is_first, items in ((True, first_items), (False, rest_items)):
+            for batch in self.make_batches(items):
+                n_max = batch[-1][2] # 長さ順に並んでいるので末尾が最長
+                x = np.zeros((len(batch), n_max * CONTENT_HOP + CONTENT_WIN - CONTENT_HOP), dtype = np.float32)
+                for row, (i, j, n) in enumerate(batch):
+                    x16 = files[i]["inputs"][j]
+                    x[row, :x16.shape[0]] = x16
+                n_valid = [files[i]["inputs"][j].shape[0] for i, j, _ in batch]
+
+                if is_first:
+                    batch_style = style_vect
+                else:
+                    batch_style = np.concatenate([files[i]["style"] for i, _, _ in batch], axis = 0)
+
+                infer0 = time.perf_counter_ns()
+                y, used_style = self.efx.convert_offline(x, style_vect = batch_style, return_style = True, n_valid = n_valid)
+                infer_ns += time.perf_counter_ns() - infer0
+
+                out_hop = int(round(y.shape[1] / n_max))
+                for row, (i, j, n) in enumerate(batch):
+                    files[i]["outputs"][j] = y[row, :n * out_hop].copy()
+                    files[i]["inputs"][j] = None # 入力はもう要らない
+                    if is_first:
+                        files[i]["style"] = np.array(used_style[row:row+1], dtype = np.float32)
+
+                n_batches += 1
+                valid_frames += sum(n for _, _, n in batch)
+                padded_frames += len(batch) * n_max
+                n_done += len(batch)
+                if progress is not None:
+                    progress(n_done, n_total)
+
+        # ファイルごとに窓を順に繋いで書き出す
+        file_stats = []
+        for f in files:
+            stitcher = WindowStitcher(f["n_frames"], self.fade_frames)
+            out = np.concatenate([stitcher.add(y, window) for y, window in zip(f["outputs"], f["windows"])])
+            sf.write(f["out_path"], out[:, np.newaxis], self.sr_dec, subtype = 'FLOAT')
+            f["outputs"] = None
+            file_stats.append({"audio_sec": f["audio_sec"], "n_chunks": len(f["windows"]), "cancelled": False})
+
+        wall_sec = (time.perf_counter_ns() - time0) / 1e+9
+        audio_sec = sum(f["audio_sec"] for f in files)
+        stats = {
+            "n_files": len(files),
+            "audio_sec": audio_sec,
+            "wall_sec": wall_sec,
+            "read_sec": read_sec,
+            "infer_sec": infer_ns / 1e+9,
+            "speed": audio_sec / max(wall_sec, 1e-9),
+            "n_windows": n_total,
+            "n_batches": n_batches,
+            "rows_per_batch": n_total / max(n_batches, 1),
+            "valid_frames": valid_frames,
+            "padded_frames": padded_frames,
+            "utilization": valid_frames / max(padded_frames, 1), # バッチ中の有効フレームの割合（残りはパディング）
+        }
+        self.logger.debug(f"({inspect.currentframe().f_code.co_name}) {stats}")
+        return file_stats, stats
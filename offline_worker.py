@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import os
+import sys
+import time
+import queue
+import threading
+import itertools
+import logging
+import inspect
+
+import numpy as np
+
+from offline_converter import OfflineEngine, ChunkedOfflineConverter
+from feature_cache import make_feature_cache
+
+
+# ドロップされたファイルのオフライン VC を、リアルタイム VC を止めずに裏で処理する。
+#   - リアルタイム側の efx_control とは別に、専用の ONNX セッション（OfflineEngine）を持つ
+#   - ワーカースレッドは OS 上の優先度を下げ、ONNX Runtime のスレッド数も絞る。スレッドプールは
+#     セッション作成時に作られて優先度を引き継ぐので、セッションは優先度を下げた後にワーカー内で作る
+#   - モデル呼び出し（HarmoF0, ContentVec, デコーダ等）の直前ごとに、リアルタイム側の直近 live_window_sec 秒の vc_lap の p99 が
+#     ブロック長の live_budget 倍を超えていないか確認し、超えている間は待つ（リアルタイム側の遅延予算を常に優先する）。
+#     優先度の引き下げは GPU 上の実行や Windows の ONNX Runtime のスレッドプールには効かないので、こちらが主な手段になる。
+#     リアルタイム側が止まって履歴が古くなれば待たず、1 回に待つのも max_wait_sec 秒までにする
+#   - ジョブはキューに積まれ、進捗、キャンセル、ジョブごとの所要時間を持つ
+
+
+class OfflineJob:
+    def __init__(
+        self,
+        job_id: int,
+        in_path: str,
+        out_path: str,
+        out_paths: list = None, # 複数スタイルで変換する場合の、スタイルごとの出力先
+        style_vects = None, # 複数スタイルで変換する場合のスタイル (K, 128)
+        style_vect = None, # 1 つのスタイル (1, 128) を指定して変換する場合
+        settings: dict = None, # リアルタイム側の値の代わりに使う変換設定 {"pitch_shift": ..., ...}
+        max_sec: float = None, # 冒頭のこの秒数だけを変換する
+        on_done = None, # 終了時（完了、キャンセル、失敗のいずれでも）にワーカースレッドで on_done(job) を呼ぶ
+        listed: bool = True, # 進捗表示（summary, busy）に数えるか。サンプラーの試聴用の変換は数えない
+    ):
+        self.job_id = job_id
+        self.in_path = in_path
+        self.out_path = out_path
+        self.out_paths = out_paths
+        self.style_vects = style_vects
+        self.style_vect = style_vect
+        self.settings = settings
+        self.max_sec = max_sec
+        self.on_done = on_done
+        self.listed = listed
+        self.status = "queued" # queued, running, done, cancelled, failed
+        self.progress = 0.0 # 0 から 1
+        self.cancel_event = threading.Event()
+        self.error = None
+        self.stats = {}
+        self.queued_time = time.perf_counter()
+        self.wait_sec = 0.0 # キューで待った時間
+        self.throttle_sec = 0.0 # リアルタイム側を優先して待った時間
+
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+# 現在のスレッドの OS 上の優先度を下げる。失敗しても処理は続ける
+def lower_thread_priority():
+    if str(os.name) == "nt":
+        import ctypes
+        THREAD_PRIORITY_BELOW_NORMAL = -1
+        ctypes.windll.kernel32.SetThreadPriority(ctypes.windll.kernel32.GetCurrentThread(), THREAD_PRIORITY_BELOW_NORMAL)
+    elif sys.platform.startswith("linux"):
+        # Linux では nice 値がスレッド単位で、以降にこのスレッドから作られるスレッドにも引き継がれる
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+
+
+class OfflineWorker:
+    def __init__(
+        self,
+        sc, # audio backend。リアルタイム側の負荷を見るためと、変換先スタイルを取るために使う
+        vc_config,
+        intra_op_threads: int = 2,
+        live_budget: float = 0.8, # リアルタイム側の vc_lap の p99 が、ブロック長のこの割合を超えたら待つ
+        live_window_sec: float = 1.0, # p99 を求めるのに使う、直近の履歴の長さ
+        max_wait_sec: float = 2.0, # 1 回のモデル呼び出しの前に待つ最大時間
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.sc = sc
+        self.vc_config = vc_config
+        self.intra_op_threads = intra_op_threads
+        self.live_budget = live_budget
+        self.live_window_sec = live_window_sec
+        self.max_wait_sec = max_wait_sec
+
+        self.engine = None # 最初のジョブで、ワーカースレッド内で作る
+        self.converter = None
+        self.job_queue = queue.Queue()
+        # 待機中と実行中のジョブだけを持つ。終わったジョブは数えてから外すので、サンプラーの試聴用のジョブ等が溜まり続けない
+        self.jobs = []
+        self.jobs_lock = threading.Lock()
+        self.n_finished = 0 # 進捗表示に数えるジョブのうち、最後にキューが空になった後に終わった数（「今回の一連」）
+        self.current_job = None
+        self.job_counter = itertools.count()
+        self.thread = None
+
+
+    # 変換ジョブを積む。ワーカーは最初のジョブで起動する
+    def submit(self, in_path: str, out_path: str):
+        return self._enqueue(OfflineJob(next(self.job_counter), in_path, out_path))
+
+
+    # 1 つのファイルを複数のスタイル (K, 128) でそれぞれ変換するジョブを積む。out_paths はスタイルの順
+    def submit_styles(self, in_path: str, out_paths: list, style_vects):
+        return self._enqueue(
+            OfflineJob(next(self.job_counter), in_path, out_paths[0], out_paths = out_paths, style_vects = style_vects)
+        )
+
+
+    # サンプラーの試聴用に、スタイルと変換設定を固定して 1 つのファイルを変換するジョブを積む。進捗表示には数えない
+    def submit_preview(self, in_path: str, out_path: str, style_vect, settings: dict, max_sec: float = None, on_done = None):
+        return self._enqueue(
+            OfflineJob(
+                next(self.job_counter), in_path, out_path, 
+                style_vect = style_vect, settings = settings, max_sec = max_sec, on_done = on_done, listed = False,
+            )
+        )
+
+
+    def _enqueue(self, job):
+        with self.jobs_lock:
+            self.jobs.append(job)
+        self.job_queue.put(job)
+        if self.thread is None:
+            self.thread = threading.Thread(target = self._run, daemon = True)
+            self.thread.start()
+        return job
+
+
+    # 待機中と実行中のジョブをすべてキャンセルする
+    def cancel_all(self):
+        with self.jobs_lock:
+            jobs = list(self.jobs)
+        for job in jobs:
+            job.cancel()
+
+
+    @property
+    def busy(self) -> bool:
+        with self.jobs_lock:
+            return any(job.listed for job in self.jobs)
+
+
+    # 表示用の要約。(完了数, 全体数, 実行中ジョブの進捗) 
+    def summary(self):
+        with self.jobs_lock:
+            n_active = sum(1 for job in self.jobs if job.listed)
+            n_done = self.n_finished
+        n_total = n_active + n_done
+        current = self.current_job
+        progress = current.progress if current is not None and current.listed else 0.0
+        return n_done, n_total, progress
+
+
+    def shutdown(self, timeout: float = 5.0):
+        self.cancel_all()
+        if self.thread is not None:
+            self.job_queue.put(None)
+            self.thread.join(timeout)
+
+
+    # リアルタイム側の直近 live_window_sec 秒の vc_lap の p99 (ms)。その間の履歴が足りない（止まっている）ときは 0
+    def live_p99(self) -> float:
+        efx = self.sc.efx_control
+        n = min(efx.n_vc_lap, efx.vc_lap_history.shape[0])
+        recent = efx.vc_lap_history[:n][efx.vc_lap_time[:n] >= time.monotonic() - self.live_window_sec]
+        if recent.shape[0] < 4:
+            return 0.0
+        return float(np.percentile(recent, 99))
+
+
+    # 各モデル呼び出しの直前に呼ばれる。リアルタイム側が予算を超えている間は、最大 max_wait_sec 秒まで待つ
+    def _yield_to_live(self):
+        job = self.current_job
+        if job is None:
+            return
+        budget_ms = self.live_budget * 1000 * self.sc.blocksize / self.sc.sr_out
+        time0 = time.perf_counter()
+        while (
+            self.live_p99() > budget_ms 
+            and not job.cancel_event.is_set() 
+            and time.perf_counter() - time0 < self.max_wait_sec
+        ):
+            time.sleep(2 * self.sc.blocksize / self.sc.sr_out) # 数ブロック分待って、履歴が入れ替わるのを待つ
+        job.throttle_sec += time.perf_counter() - time0
+
+
+    # チャンクの切れ目で呼ばれる
+    def _on_progress(self, job, done, total):
+        job.progress = done / total
+
+
+    def _run(self):
+        try:
+            lower_thread_priority()
+        except Exception:
+            self.logger.exception(f"({inspect.currentframe().f_code.co_name}) Failed to lower the thread priority")
+
+        while True:
+            job = self.job_queue.get()
+            if job is None:
+                break
+            if job.cancel_event.is_set():
+                job.status = "cancelled"
+                self._finish(job)
+                continue
+
+            job.wait_sec = time.perf_counter() - job.queued_time
+            job.status = "running"
+            self.current_job = job
+            try:
+                if self.engine is None:
+                    self.engine = OfflineEngine(
+                        self.vc_config, 
+                        intra_op_threads = self.intra_op_threads,
+                        feature_cache = make_feature_cache(self.vc_config),
+                    )
+                    self.engine.before_run = self._yield_to_live
+                    self.converter = ChunkedOfflineConverter(
+                        self.engine,
+                        chunk_sec = self.vc_config.get("offline_chunk_sec", 10.0),
+                        context_sec = self.vc_config.get("offline_context_sec", 1.0),
+                        fade_sec = self.vc_config.get("offline_fade_sec", 0.1),
+                    )
+                # 変換設定はジョブ開始時点のリアルタイム側の値に合わせる
+                efx = self.sc.efx_control
+                self.engine.auto_encode = efx.auto_encode
+                self.engine.pitch_shift = efx.pitch_shift
+                self.engine.absolute_pitch = efx.absolute_pitch
+                self.engine.estimate_energy = efx.estimate_energy
+                self.engine.target_style = self.sc.current_target_style
+                for name, value in (job.settings or {}).items():
+                    setattr(self.engine, name, value) # ジョブで指定された設定を優先する
+
+                if job.style_vects is not None:
+                    job.stats = self.converter.convert_file_styles(
+                        job.in_path, 
+                        job.out_paths,
+                        job.style_vects,
+                        progress = lambda done, total: self._on_progress(job, done, total),
+                        cancel = job.cancel_event,
+                    )
+                else:
+                    job.stats = self.converter.convert_file(
+                        job.in_path, 
+                        job.out_path,
+                        progress = lambda done, total: self._on_progress(job, done, total),
+                        cancel = job.cancel_event,
+                        style_vect = job.style_vect,
+                        max_sec = job.max_sec,
+                    )
+                job.status = "cancelled" if job.stats["cancelled"] else "done"
+                if job.status == "cancelled":
+                    for out_path in (job.out_paths if job.out_paths is not None else [job.out_path]):
+                        if os.path.exists(out_path):
+                            os.remove(out_path) # 途中までの出力は残さない
+                self.logger.info(
+                    f"Job {job.job_id} {job.status}: '{job.in_path}' ({job.stats['audio_sec']:.1f} s audio) "
+                    f"in {job.stats['wall_sec']:.1f} s (queued {job.wait_sec:.1f} s, yielded to live VC {job.throttle_sec:.1f} s)"
+                )
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                self.logger.exception(f"({inspect.currentframe().f_code.co_name}) Job {job.job_id} failed: '{job.in_path}'")
+            finally:
+                self.current_job = None
+                self._finish(job)
+
+
+    # 終わったジョブを数えてから外し、コールバックを呼ぶ。進捗表示に数えるジョブがなくなったら「今回の一連」を区切る
+    def _finish(self, job):
+        with self.jobs_lock:
+            self.jobs.remove(job)
+            if job.listed:
+                self.n_finished += 1
+            if not any(other.listed for other in self.jobs):
+                self.n_finished = 0
+        self._notify(job)
+
+
+    def _notify(self, job):
+        if job.on_done is None:
+            return
+        try:
+            job.on_done(job)
+        except Exception:
+            self.logger.exception(f"({inspect.currentframe().f_code.co_name}) Callback of job {job.job_id} failed")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import numpy as np
+
+
+# 波形表示用の min/max（ピーク）ピラミッド。
+# 単純な間引き（x[::down_sample]）ではアタックなどの短いピークが消えたり折り返したりするので、
+# 一定サンプル数ごとの最小値と最大値を保持し、表示幅に応じて適切な段から包絡線を作る。
+
+# 段 0 は base_factor サンプルごと、段 l は base_factor * 2^l サンプルごとの min/max を持つ。
+# 新しいデータが届くたびに、各段の末尾だけを更新する（過去分を計算し直すことはない）。
+
+
+# (time, ch) の信号を factor サンプルごとの min/max に畳む。端数は (time, ch) のまま返して次回に持ち越す
+def block_peaks(
+    x,
+    factor: int,
+):
+    n_full = (x.shape[0] // factor) * factor
+    body = x[:n_full].reshape(-1, factor, x.shape[1]) # (n_bucket, factor, ch)
+    return body.min(axis = 1).T, body.max(axis = 1).T, x[n_full:] # mins, maxs は (ch, n_bucket)
+
+
+class PeakPyramid:
+    def __init__(
+        self,
+        n_channel: int = 2,
+        window_samples: int = 192000, # 保持する時間範囲（サンプル数）。例：48000 Hz で 4 秒
+        base_factor: int = 32, # 段 0 の 1 bucket が何サンプルか
+        min_buckets: int = 64, # 最上段でもこの bucket 数は確保する
+    ):
+        self.n_channel = n_channel
+        self.base_factor = base_factor
+        self.n_base = max(window_samples // base_factor, 1)
+        self.window_samples = self.n_base * base_factor
+
+        # 段数は最上段の bucket 数が min_buckets を下回らない範囲で決める
+        self.n_levels = 1
+        while (self.n_base >> self.n_levels) >= min_buckets:
+            self.n_levels += 1
+
+        # 各段の (ch, n_bucket) の min/max。初期値は無音
+        self.mins = [np.zeros((n_channel, self.n_base >> l), dtype = np.float32) for l in range(self.n_levels)]
+        self.maxs = [np.zeros((n_channel, self.n_base >> l), dtype = np.float32) for l in range(self.n_levels)]
+        # 各段で、上の段に送るにはペアが揃っていない bucket の持ち越し
+        self.carry_min = [np.zeros((n_channel, 0), dtype = np.float32) for _ in range(self.n_levels)]
+        self.carry_max = [np.zeros((n_channel, 0), dtype = np.float32) for _ in range(self.n_levels)]
+        # 段 0 に畳む前の端数サンプル (time, ch)
+        self.carry_samples = np.zeros((0, n_channel), dtype = np.float32)
+
+
+    # (time, ch) の生の信号を追加する
+    def push_samples(
+        self,
+        x,
+    ):
+        x = np.concatenate((self.carry_samples, np.asarray(x, dtype = np.float32)[:, :self.n_channel]), axis = 0)
+        mins, maxs, self.carry_samples = block_peaks(x, self.base_factor)
+        self.push_peaks(mins, maxs)
+
+
+    # 段 0 の単位（base_factor サンプルごと）に畳み済みの (ch, n_bucket) の min/max を追加する
+    def push_peaks(
+        self,
+        mins,
+        maxs,
+    ):
+        for l in range(self.n_levels):
+            if mins.shape[1] == 0:
+                break
+            self._shift_in(l, mins, maxs)
+            if l + 1 == self.n_levels:
+                break
+            # 持ち越し分と合わせて 2 つずつ組にし、上の段の bucket を作る
+            mins = np.concatenate((self.carry_min[l], mins), axis = 1)
+            maxs = np.concatenate((self.carry_max[l], maxs), axis = 1)
+            n_pair = mins.shape[1] // 2
+            self.carry_min[l] = mins[:, n_pair*2:]
+            self.carry_max[l] = maxs[:, n_pair*2:]
+            mins = mins[:, :n_pair*2].reshape(self.n_channel, n_pair, 2).min(axis = 2)
+            maxs = maxs[:, :n_pair*2].reshape(self.n_channel, n_pair, 2).max(axis = 2)
+
+
+    # 段 l の末尾に新しい bucket を入れ、同じ数だけ古いものを捨てる
+    def _shift_in(
+        self,
+        l: int,
+        mins,
+        maxs,
+    ):
+        n = self.mins[l].shape[1]
+        m = min(mins.shape[1], n)
+        if m < n:
+            self.mins[l][:, :-m] = self.mins[l][:, m:]
+            self.maxs[l][:, :-m] = self.maxs[l][:, m:]
+        self.mins[l][:, -m:] = mins[:, -m:]
+        self.maxs[l][:, -m:] = maxs[:, -m:]
+
+
+    # 保持している時間範囲全体を width 列の包絡線にする。戻り値は (ch, width) の mins, maxs
+    # 1 列あたりのサンプル数を超えない範囲で最も粗い段を選ぶので、計算量は width に比例する
+    def envelope(
+        self,
+        width: int,
+    ):
+        width = max(int(width), 1)
+        l = 0
+        while l + 1 < self.n_levels and (self.n_base >> (l + 1)) >= width:
+            l += 1
+        n = self.mins[l].shape[1]
+        edges = (np.arange(width) * n) // width # 各列の先頭 bucket。n >= width なら狭義単調増加
+        if n >= width:
+            return np.minimum.reduceat(self.mins[l], edges, axis = 1), np.maximum.reduceat(self.maxs[l], edges, axis = 1)
+        else:
+            # 表示幅が段 0 の bucket 数より広い場合は、同じ bucket を複数列で使い回す
+            return self.mins[l][:, edges], self.maxs[l][:, edges]
+
+
+# オーディオスレッドから波形プロットへの受け渡し用の、容量固定のリングバッファ。
+# 以前は queue.Queue にブロックをそのまま積んでいたため、GUI が止まったり最小化されたりすると際限なく溜まっていた。
+#   - 書き込み時に base_factor サンプルごとの min/max に畳むので、保持量は生の信号の 1/base_factor で済む
+#   - 容量を超えた分は古いものから上書きし、読み手が取りこぼした bucket 数を dropped に数える
+#   - 見えている読み手が 1 つもない間は、書き込み自体を止める（dropped には数えない）
+# 書き手（オーディオスレッド）は 1 つ、読み手は GUI スレッドを想定しており、ロックは取らない。
+
+class PeakFeed:
+    def __init__(
+        self,
+        base_factor: int = 32, # 1 bucket が何サンプルか（読み手の PeakPyramid の段 0 と揃える）
+        capacity: int = 16384, # 保持する bucket 数。48000 Hz で base_factor = 32 なら約 11 秒分
+    ):
+        self.base_factor = base_factor
+        self.capacity = capacity
+        self.n_channel = 0 # 最初の push で決まる。デバイス変更でチャンネル数が変わった場合は作り直す
+        self.mins = np.zeros((0, capacity), dtype = np.float32)
+        self.maxs = np.zeros((0, capacity), dtype = np.float32)
+        self.carry_samples = np.zeros((0, 0), dtype = np.float32)
+        self.n_written = 0 # 起動時からの総 bucket 数
+        self.dropped = 0 # 読み手が間に合わず上書きされた bucket 数（全読み手の合計）
+        self.readers = []
+        self.active = False # 見えている読み手がいるときだけ True
+
+
+    # (time, ch) のブロックを追加する。オーディオのコールバックから呼ぶ
+    def push(
+        self,
+        x,
+    ):
+        if self.active is False:
+            return
+        if x.shape[1] != self.n_channel:
+            self.n_channel = x.shape[1]
+            self.mins = np.zeros((self.n_channel, self.capacity), dtype = np.float32)
+            self.maxs = np.zeros((self.n_channel, self.capacity), dtype = np.float32)
+            self.carry_samples = np.zeros((0, self.n_channel), dtype = np.float32)
+
+        x = np.concatenate((self.carry_samples, np.asarray(x, dtype = np.float32)), axis = 0)
+        mins, maxs, self.carry_samples = block_peaks(x, self.base_factor)
+        m = min(mins.shape[1], self.capacity)
+        if m == 0:
+            return
+        idx = np.arange(self.n_written, self.n_written + m) % self.capacity
+        self.mins[:, idx] = mins[:, -m:]
+        self.maxs[:, idx] = maxs[:, -m:]
+        self.n_written += m # データを書き終えてから進める
+
+
+    # 読み手を作る
+    def subscribe(self):
+        reader = PeakFeedReader(self)
+        self.readers.append(reader)
+        self.update_active()
+        return reader
+
+
+    def update_active(self):
+        active = any(r.visible for r in self.readers)
+        if active and self.active is False:
+            # 再開時は、止まる前の端数を捨てる（時間的に繋がらないため）
+            self.carry_samples = np.zeros((0, self.n_channel), dtype = np.float32)
+        self.active = active
+
+
+class PeakFeedReader:
+    def __init__(
+        self,
+        feed: PeakFeed,
+    ):
+        self.feed = feed
+        self.n_read = feed.n_written
+        self.visible = True
+
+
+    # 読み手が画面に見えているかを伝える。見えている読み手がいなくなると、書き手は push を止める
+    def set_visible(
+        self,
+        visible: bool,
+    ):
+        if visible != self.visible:
+            self.visible = visible
+            if visible:
+                self.n_read = self.feed.n_written # 止まっていた間のことは気にせず、最新から読み始める
+            self.feed.update_active()
+
+
+    # 前回以降に届いた (ch, n) の mins, maxs を返す
+    def read(self):
+        feed = self.feed
+        end = feed.n_written
+        # 書き込み中のブロックに追い越されないよう、リングの古い側 1/4 は読まない
+        start = max(self.n_read, end - feed.capacity * 3 // 4)
+        if start > self.n_read:
+            feed.dropped += start - self.n_read
+        self.n_read = end
+        idx = np.arange(start, end) % feed.capacity
+        return feed.mins[:, idx], feed.maxs[:, idx]
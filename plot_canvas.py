@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import numpy as np
+
+import wx
+import matplotlib # カラーマップの LUT を作る初期化時にだけ使う。描画の更新処理では使わない
+
+# hi dpi 対応
+import ctypes
+try:
+    ctypes.windll.shcore.SetProcessDpiAwareness(True)
+except:
+    pass
+
+
+# matplotlib の FigureCanvasWxAgg を使わずに、wx の DC で直接描くプロット部品の共通部分。
+# matplotlib は Timer ごとに図全体を描き直すので、リアルタイム表示では 1 回あたり数十 ms を要していた。
+# ここでは軸と目盛りだけを wx で描き、データ部分は派生クラスが draw_plot() で描く。
+
+
+# matplotlib のカラーマップから (n_levels, 3) の uint8 参照表を作る
+def make_colormap_lut(
+    cmap_name: str = "inferno",
+    n_levels: int = 256,
+):
+    cmap = matplotlib.colormaps[cmap_name]
+    lut = np.round(cmap(np.linspace(0.0, 1.0, n_levels))[:, :3] * 255)
+    return lut.astype(np.uint8)
+
+
+# 値の配列を参照表で RGB に変換する。出力は入力の形状に末尾次元 3 を足したもの
+def apply_colormap_lut(
+    values,
+    lut,
+    v_range: tuple = (-50, 40),
+):
+    scale = (lut.shape[0] - 1) / (v_range[1] - v_range[0])
+    idx = np.nan_to_num((values - v_range[0]) * scale, nan = 0.0)
+    idx = np.clip(idx, 0, lut.shape[0] - 1).astype(np.intp)
+    return lut[idx]
+
+
+class PlotCanvasPanel(wx.Panel):
+    def __init__(
+        self, 
+        parent, 
+        figsize: tuple = (800, 170), # プロットエリアの横、縦。単位は px
+        margins: tuple = (0.07, 0.98, 0.15, 0.9), # plt.subplots_adjust の (left, right, bottom, top) と同じ意味
+        xticks: list = None, # [(0--1 の横位置, ラベル文字列), ...]
+        yticks: list = None, # [(0--1 の縦位置（下端が 0）, ラベル文字列), ...]
+        grid_y: bool = False, # y の目盛り位置に横線を引く
+        id = -1, 
+        **kwargs,
+    ):
+        super().__init__(parent, id = id, size = figsize, **kwargs)
+
+        self.figsize = figsize
+        self.margins = margins
+        self.xticks = xticks if xticks is not None else []
+        self.yticks = yticks if yticks is not None else []
+        self.grid_y = grid_y
+        self.lapse = 0.00 # （テスト用）プロット所要時間を記録。単位はミリ秒
+        self.plot_ready = False # 派生クラスが描画用のデータを作り終えたら True にする
+
+        self.SetMinSize(figsize)
+        self.SetBackgroundStyle(wx.BG_STYLE_PAINT) # 背景は on_paint で自前で塗る（ちらつき防止）
+        self.bg_colour = wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU) # アプリケーションの背景色に合わせる
+        self.tick_font = wx.Font(wx.FontInfo(6))
+        self.update_plot_rect()
+
+        self.Bind(wx.EVT_PAINT, self.on_paint)
+        self.Bind(wx.EVT_SIZE, self.on_size)
+
+
+    # パネルの大きさからプロット領域（軸の内側）を決める
+    def update_plot_rect(self):
+        w, h = self.GetClientSize()
+        if w <= 0 or h <= 0:
+            w, h = self.figsize
+        left, right, bottom, top = self.margins
+        x0, x1 = round(left * w), round(right * w)
+        y0, y1 = round((1 - top) * h), round((1 - bottom) * h)
+        self.plot_rect = wx.Rect(x0, y0, max(x1 - x0, 1), max(y1 - y0, 1))
+
+
+    def on_size(self, event):
+        old_size = self.plot_rect.GetSize()
+        self.update_plot_rect()
+        if self.plot_ready and self.plot_rect.GetSize() != old_size:
+            self.on_plot_resize()
+        self.Refresh(eraseBackground = False)
+        event.Skip()
+
+
+    # プロット領域の大きさが変わったときに派生クラスが描画用のデータを作り直す
+    def on_plot_resize(self):
+        pass
+
+
+    # 派生クラスがプロット領域の中身を描く
+    def draw_plot(self, dc):
+        pass
+
+
+    def on_paint(self, event):
+        dc = wx.AutoBufferedPaintDC(self)
+        dc.SetBackground(wx.Brush(self.bg_colour))
+        dc.Clear()
+        if self.plot_ready:
+            self.draw_plot(dc)
+        self.draw_axes(dc)
+
+
+    # 軸の枠と目盛りを描く。データと違って毎回同じ内容だが、テキスト数個なので負荷は小さい
+    def draw_axes(self, dc):
+        r = self.plot_rect
+        dc.SetFont(self.tick_font)
+        dc.SetTextForeground(wx.BLACK)
+        dc.SetBrush(wx.TRANSPARENT_BRUSH)
+        dc.SetPen(wx.Pen(wx.BLACK, 1))
+        dc.DrawRectangle(r)
+
+        for pos, label in self.xticks:
+            x = r.x + round(pos * (r.width - 1))
+            dc.DrawLine(x, r.y + r.height, x, r.y + r.height + 3)
+            dc.DrawLine(x, r.y, x, r.y - 3)
+            tw, th = dc.GetTextExtent(label)
+            dc.DrawText(label, x - tw // 2, r.y + r.height + 4)
+
+        for pos, label in self.yticks:
+            y = r.y + r.height - 1 - round(pos * (r.height - 1))
+            if self.grid_y:
+                dc.SetPen(wx.Pen(wx.Colour(176, 176, 176), 1))
+                dc.DrawLine(r.x, y, r.x + r.width, y)
+                dc.SetPen(wx.Pen(wx.BLACK, 1))
+            dc.DrawLine(r.x - 3, y, r.x, y)
+            dc.DrawLine(r.x + r.width, y, r.x + r.width + 3, y)
+            if label:
+                tw, th = dc.GetTextExtent(label)
+                dc.DrawText(label, r.x - tw - 5, y - th // 2)
+
+
+# (ch, n_rows, n_frame) の time last テンソルを画像として表示し、時間方向にスクロールさせる部品。
+# 色付け済みの画像はプロット領域と同じ大きさ（表示の並び）で保持し、そのまま wx.Bitmap に転送する。
+# スクロールはフレーム数を画面の列数に換算し、端数を持ち越しながら整数の列だけずらして、新しく入った列と
+# 書き換わったフレームに当たる列だけを色付けする（画像全体の再配置は、プロット領域の大きさが変わったときだけ）。
+
+class ScrollImagePanel(PlotCanvasPanel):
+    def __init__(
+        self, 
+        parent, 
+        tensor, # (ch, n_rows, n_frame) の初期データ。以後はこの配列を派生クラスが更新する
+        channel: int = 0,
+        cmap: str = "inferno",
+        v_range: tuple = (-50, 40),
+        origin_lower: bool = True, # True なら row 0 が下端（imshow の origin = 'lower' 相当）
+        **kwargs,
+    ):
+        super().__init__(parent, **kwargs)
+
+        self.tensor = tensor
+        self.channel = channel
+        self.v_range = v_range
+        self.origin_lower = origin_lower
+        self.lut = make_colormap_lut(cmap)
+        self.on_plot_resize()
+        self.plot_ready = True
+
+
+    # プロット領域の大きさに合わせて、行と列の対応表と色付け済み画像を作り直す（全列の色付けはここだけ）
+    def on_plot_resize(self):
+        ph, pw = self.plot_rect.height, self.plot_rect.width
+        n_rows, n_frames = self.tensor.shape[1], self.tensor.shape[2]
+        self.row_map = ((np.arange(ph) + 0.5) * n_rows / ph).astype(np.intp)
+        if self.origin_lower:
+            self.row_map = self.row_map[::-1] # 画面の上端に最も大きな row が来る
+        self.col_map = ((np.arange(pw) + 0.5) * n_frames / pw).astype(np.intp)
+        self.scroll_frac = 0.0 # 列に換算したスクロール量の、まだずらしていない端数
+        self.rgb = self.colorize(0) # (ph, pw, 3) の C 連続配列
+        self.plot_bmp = wx.Bitmap(pw, ph, 24)
+        self.refresh_bitmap()
+
+
+    # 画面の first 列目以降を、現在の self.tensor から色付けして返す
+    def colorize(self, first: int):
+        return apply_colormap_lut(
+            self.tensor[self.channel][:, self.col_map[first:]][self.row_map, :], self.lut, self.v_range,
+        )
+
+
+    # self.tensor が n_scroll フレーム進み、末尾 k フレームが書き換わったことを画像に反映する
+    def scroll_columns(
+        self,
+        n_scroll: int,
+        k: int,
+    ):
+        pw = self.rgb.shape[1]
+        n_frames = self.tensor.shape[2]
+        self.scroll_frac += n_scroll * pw / n_frames
+        shift = min(int(self.scroll_frac), pw)
+        self.scroll_frac -= int(self.scroll_frac)
+        if 0 < shift < pw:
+            self.rgb[:, :-shift] = self.rgb[:, shift:]
+        # スクロールで空いた列と、書き換わった末尾 k フレームに当たる列だけを色付けし直す
+        k = min(max(k, n_scroll), n_frames)
+        first = min(pw - shift, int(np.searchsorted(self.col_map, n_frames - k)))
+        if first < pw:
+            self.rgb[:, first:] = self.colorize(first)
+        self.refresh_bitmap()
+
+
+    def refresh_bitmap(self):
+        self.plot_bmp.CopyFromBuffer(self.rgb)
+
+
+    def draw_plot(self, dc):
+        dc.DrawBitmap(self.plot_bmp, self.plot_rect.x, self.plot_rect.y)
@@ -23,10 +23,6 @@ import numpy as np
 import logging
 import inspect
 
-import wx
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg
-
 # hi dpi 対応
 import ctypes
 try:
@@ -35,7 +31,14 @@ except:
     pass
 
 
-class PlotEmbeddingPanel(wx.Panel):
+from plot_canvas import ScrollImagePanel
+from gui_scheduler import start_update_timer, PRIORITY_PLOT
+
+
+# 以前は matplotlib の imshow を Timer ごとに描き直していたが、現在は ScrollImagePanel で
+# 新しく届いたフレームの列だけを色付けし、wx の DC で描画する（更新処理に matplotlib を使わない）。
+
+class PlotEmbeddingPanel(ScrollImagePanel):
     def __init__(
         self, 
         parent, # parent として通常は wx.Panel（wx.Frame でも可）を指定する。
@@ -50,14 +53,9 @@ class PlotEmbeddingPanel(wx.Panel):
         id: int = -1, 
         **kwargs,
     ):
-        super().__init__(parent, id = id, **kwargs)
-
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.logger.debug("Initializing ...")
 
-        # plot 対象を定義後、 plt.ion() で interactive 化し、 update() で更新。
-        plt.ion() # interactive mode をオンにする。こいつがないとグラフを Timer で更新しない。場所は図の作成よりも上。
-
         self.host = host
         self.target_name = target_name # 名前だけ渡しておいて、呼び出しのたびに中身を取得
         # raw_input が描画対象のテンソルの実体
@@ -66,7 +64,7 @@ class PlotEmbeddingPanel(wx.Panel):
         if raw_input.ndim == 2:
             raw_input = raw_input[np.newaxis, :, :] # 本来趣旨では ndim = 3 だけ受け入れるべきである
 
-        self.channel = min(channel, raw_input.shape[0] - 1) # どのチャンネルを描画するか
+        self.input_channel = min(channel, raw_input.shape[0] - 1) # どのチャンネルを描画するか
         self.dim_emb = raw_input.shape[1] # この時点で (n_ch, dim_emb, n_frame) が保証される
         self.hop_sec: float = hop_sec
 
@@ -80,78 +78,46 @@ class PlotEmbeddingPanel(wx.Panel):
         self.frame_len: int = int(self.from_sec / self.hop_sec) + 1 # ただし意図的に 1 frame を水増し
         self.logger.debug(f"Plot range: {self.from_sec} sec, {self.frame_len} frames")
         
+        # 手元で保持するのは描画するチャンネルだけの (1, dim_emb, frame_len)
+        tensor = np.zeros((1, self.dim_emb, self.frame_len), dtype = np.float32) 
         if self.frame_len > self.orig_frame_len:
             # こちらのバッファが入力データよりも長い→後ろ側に代入する
-            self.tensor = np.zeros((1, self.dim_emb, self.frame_len), dtype = np.float32) 
-            self.tensor[:, :, -self.orig_frame_len:] = raw_input[self.channel:self.channel+1, :, :]
+            tensor[:, :, -self.orig_frame_len:] = raw_input[self.input_channel:self.input_channel+1, :, :]
         else:
             # こちらのバッファよりも入力データのほうが長い→入力データの後ろの方だけ使う
-            self.tensor = raw_input[self.channel:self.channel+1, :, -self.frame_len:] 
-        
-        self.v_range = v_range 
-        self.figsize = figsize
-        self.update_ms = update_ms
-        self.lapse = 0.0 # （テスト用）プロット所要時間を記録。単位はミリ秒
-        
-        ## 初期状態の plot を作る。安全を考えると、下はクラス化した方がいい。
-
-        px = 1/plt.rcParams['figure.dpi'] # 1/100 （マシンによって異なる）
-        plt.rc('font', size = 6)          # default text sizes
-        plt.rc('axes', titlesize = 6)     # font size of the axes title
-        plt.rc('axes', labelsize = 6)     # font size of the x and y labels
-        plt.rc('xtick', labelsize = 6)    # font size of the tick labels
-        plt.rc('ytick', labelsize = 6)    # font size of the tick labels
-        plt.rc('legend', fontsize = 6)    # legend font size
-        plt.rc('figure', titlesize = 10)  # font size of the figure title
-
-        self.figure, self.ax = plt.subplots(
-            figsize = (self.figsize[0]*px, self.figsize[1]*px),
-        )
-        self.figure.patch.set_facecolor(
-            (
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[0]/255, 
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[1]/255, 
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[2]/255, 
-                1
+            tensor[:, :, :] = raw_input[self.input_channel:self.input_channel+1, :, -self.frame_len:] 
+
+        # host が FrameSnapshot を公開していれば、以降は更新分だけを受け取って self.tensor に反映する（deepcopy 不要）
+        snapshots = getattr(self.host, "snapshots", {})
+        self.reader = snapshots[self.target_name].subscribe() if self.target_name in snapshots else None
+        if self.reader is not None:
+            self.reader.read() # 初期状態は上で取り込み済みなので、既読にしておく
+
+        # x 軸の目盛り。プロット範囲が何秒分であっても 0%, 25%, 50%, 75%, 100% に置く。y 軸の tickmark は省略
+        xtick_divide = 5
+        xticks = [
+            (pos, str(label)) for pos, label in zip(
+                np.linspace(0, 1, xtick_divide), np.linspace(-self.from_sec, 0.0, xtick_divide).round(3),
             )
-        ) # plot 外のエリア色を、アプリケーションの背景色に合わせる場合
-        plt.subplots_adjust(left = 0.07, right = 0.98, bottom = 0.2, top = 0.9) # 軸ラベル分の余白確保が必要
-
-        self.content_imshow = self.ax.imshow(
-            self.tensor[self.channel, :, :], 
-            aspect = 'auto', # aspect{'auto', 'equal'} or float
-            interpolation = 'none', # 'none' もしくは 'nearest'
-            vmin = self.v_range[0], 
-            vmax = self.v_range[1],
-            cmap = 'seismic', # bwr
-            origin = 'upper',
-        )
+        ]
 
-        xtick_divide = 5 # プロット範囲が何秒分であっても 0%, 25%, 50%, 75%, 100% に目盛り
-        self.ax.set_xticks(np.linspace(0, self.frame_len, xtick_divide))
-        self.ax.set_xticklabels(np.linspace(-self.from_sec, 0.0, xtick_divide).round(3))
-        # y 軸の tickmark は省略
-
-        self.ax.tick_params(
-            bottom = True, 
-            top = True, 
-            labelbottom = True, 
-            right = True, 
-            left = True, 
-            labelleft = True,
+        super().__init__(
+            parent, 
+            tensor = tensor,
+            channel = 0, # 手元の tensor は描画するチャンネルだけを持つ
+            cmap = 'seismic', # bwr
+            v_range = v_range,
+            origin_lower = False, # imshow の origin = 'upper' 相当
+            figsize = figsize,
+            margins = (0.07, 0.98, 0.2, 0.9), # 軸ラベル分の余白確保が必要
+            xticks = xticks,
+            id = id,
+            **kwargs,
         )
+        self.update_ms = update_ms
 
-        # FigureCanvasWxAgg は matplotlib と wx の連携用のパーツ
-        self.canvas = FigureCanvasWxAgg(self, -1, self.figure)
-        self.root_sizer = wx.BoxSizer(wx.VERTICAL)
-        self.root_sizer.Add(self.canvas, proportion = 0, flag = wx.TOP)
-        self.SetSizer(self.root_sizer)
-        self.root_sizer.Fit(self) # Sizer を親要素である Panel のサイズに自動適合
-
-        # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.timer = wx.Timer(self) 
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(self.update_ms)
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, self.update_ms, priority = PRIORITY_PLOT)
 
         self.logger.debug("Initialized.")
 
@@ -160,25 +126,20 @@ class PlotEmbeddingPanel(wx.Panel):
     def update(self, event):
         self.time0 = time.perf_counter_ns() # time in nanosecond
 
-        raw_input = copy.deepcopy(getattr(self.host, self.target_name)) 
-
-        if raw_input.ndim == 2:
-            raw_input = raw_input[np.newaxis, :, :]
-
-        if self.frame_len > raw_input.shape[2]:
-            # こちらのバッファが入力データよりも長い→後ろ側に代入する
-            self.tensor[:, :, -raw_input.shape[2]:] = raw_input[self.channel, :, :]
+        if self.reader is not None:
+            # self.tensor は (1, dim_emb, frame_len) なので、描画するチャンネルだけを書き込む
+            changed = self.reader.update(self.tensor, channel = self.input_channel)
+            if changed is not None:
+                self.scroll_columns(*changed)
         else:
-            # こちらのバッファよりも入力データのほうが長い→入力データの後ろの方だけ使う
-            self.tensor = raw_input[self.channel, :, -self.frame_len:] 
+            raw_input = getattr(self.host, self.target_name)
+            if raw_input.ndim == 2:
+                raw_input = raw_input[np.newaxis, :, :]
+            n = min(self.frame_len, raw_input.shape[2])
+            self.tensor[0, :, -n:] = raw_input[self.input_channel, :, -n:]
+            self.scroll_columns(self.frame_len, self.frame_len) # 全列を色付けし直す
 
-        self.content_imshow.set_data(
-            self.tensor[self.channel, :, :], 
-        ) 
-        
         # 強制再描画。これがないと Linux では画面が更新されない場合がある
-        self.Refresh()
-        self.Update()
+        self.Refresh(eraseBackground = False)
 
         self.lapse = (time.perf_counter_ns() - self.time0)/1e+6 # time in millisecond
-
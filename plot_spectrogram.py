@@ -20,14 +20,11 @@ import time
 import copy
 import numpy as np
 import math
-import librosa
 
 import logging
 import inspect
 
 import wx
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg
 
 # hi dpi 対応
 import ctypes
@@ -38,6 +35,8 @@ except:
 
 
 from utils import hz_to_onehot
+from plot_canvas import ScrollImagePanel
+from gui_scheduler import start_update_timer, PRIORITY_PLOT
 
 
 contour_color_cycle = [
@@ -57,10 +56,11 @@ contour_color_cycle = [
 # Y 軸の設計をみて分かるとおり、現在は log spectrogram のプロットに特化している。
 # マルチチャンネルを突っ込むと、 channel 引数に指定した 1 つのチャンネルだけが描画される
 
-# なお update_ms を小さく（30 ms 台など）すると、それだけで Panel の更新動作が極端に遅くなるので注意。
+# 以前は matplotlib の imshow を Timer ごとに描き直していたが、現在は ScrollImagePanel で
+# 新しく届いたフレームの列だけを色付けし、wx の DC で描画する（更新処理に matplotlib を使わない）。
 
 
-class PlotSpecPanel(wx.Panel):
+class PlotSpecPanel(ScrollImagePanel):
     def __init__(
         self, 
         parent, # parent として通常は wx.Panel（wx.Frame でも可）を指定する。
@@ -80,18 +80,18 @@ class PlotSpecPanel(wx.Panel):
         id = -1, 
         **kwargs,
     ):
-        super().__init__(parent, id = id, **kwargs)
-
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.logger.debug("Initializing ...")
 
-        # plot 対象を定義後、 plt.ion() で interactive 化し、 update() で更新。
-        plt.ion() # interactive mode をオンにする。こいつがないとグラフを Timer で更新しない。場所は図の作成よりも上
-
         self.host = host
         self.target_name = target_name # 名前だけ渡しておいて、呼び出しのたびに中身を取得
-        # self.tensor が描画対象のテンソルの実体。常に time last が前提
-        self.tensor = copy.deepcopy(getattr(self.host, self.target_name)) # 3D (ch, dim_spec, n_frame)
+        # tensor が描画対象のテンソルの実体。常に time last が前提
+        tensor = copy.deepcopy(getattr(self.host, self.target_name)) # 3D (ch, dim_spec, n_frame)
+        # host が FrameSnapshot を公開していれば、以降は更新分だけを受け取って self.tensor に反映する（deepcopy 不要）
+        snapshots = getattr(self.host, "snapshots", {})
+        self.reader = snapshots[self.target_name].subscribe() if self.target_name in snapshots else None
+        if self.reader is not None:
+            self.reader.read() # 初期状態は上で取り込み済みなので、既読にしておく
 
         self.sr = sr
         self.hop_size = hop_size
@@ -105,156 +105,117 @@ class PlotSpecPanel(wx.Panel):
         self.logger.debug(f"Hop: {self.hop_size}, bins: {self.dim_spec} ({self.f_min}--{self.f_max})")
 
         # プロットするフレームの元データの長さは、最初に投入したテンソルの長さに従う
-        self.frame_len =  self.tensor.shape[2]
+        self.frame_len =  tensor.shape[2]
         # プロットに描画する時間範囲で、単位は秒
         self.time_range = self.hop_size * self.frame_len / self.sr
 
         self.logger.debug(f"Time range: {self.time_range} seconds, frame length: {self.frame_len}")
-        
-        # 同時にプロットする F0 の値。時間解像度を自動調整して spec 側に合わせられる。
-        # なお contour はマルチチャンネルも許容する。そのため、(ch, time) の 2D に強制的に変更する処理が入る。
+
+        # 同時にプロットする F0 の値。contour はマルチチャンネルも許容し、(ch, time) の 2D に強制的に変更して扱う。
+        # 時間解像度が spec と違う場合も、以前のように resample はせず、描画時に x 座標をフレーム位置に対応させる
         self.pitch_contour_name = pitch_contour
-        if self.pitch_contour_name is not None:
-            pitch_data = copy.deepcopy(getattr(self.host, self.pitch_contour_name))
-            if pitch_data.ndim == 3:
-                pitch_data = pitch_data[:, 0, :]
-            if pitch_data.ndim == 1:
-                pitch_data = pitch_data[np.newaxis, :] # 強制的に 2D 化する
-            
-            # pitch contour の末尾次元サイズを pitch_adj_rate 倍して spec の時間に合わせる
-            self.pitch_adj_rate: float = 1.0
-            # 時間解像度が違う場合、adjust rate を決めてデータをリサンプリングする
-            if pitch_data.shape[1] != self.tensor.shape[-1]:
-                self.pitch_adj_rate = self.tensor.shape[-1] / pitch_data.shape[1]
-                pitch_data = librosa.resample(
-                    pitch_data, 
-                    orig_sr = 1000, # sr を整数化しても値がずれないよう、適当な大きな値にしている
-                    target_sr = round(1000*self.pitch_adj_rate),
-                    res_type = "polyphase",
-                )
-                self.logger.debug(f"Pitch is adjusted by {self.pitch_adj_rate}. Adjusted shape: {pitch_data.shape}")
-            else:
-                pass
-        
-        # スペクトログラムはマルチチャンネル化していないため、ステレオを突っ込むと後のチャンネルだけ描画する
-        self.channel = min(channel, self.tensor.shape[0] - 1) # どのチャンネルを描画するか
-        self.v_range = v_range 
-        self.figsize = figsize
-        self.update_ms = update_ms
-        self.lapse = 0.00 # （テスト用）プロット所要時間を記録。単位はミリ秒
-        
-        ## 初期状態の plot を作る。安全を考えると、下はクラス化した方がいい。
-
-        px = 1/plt.rcParams['figure.dpi'] # 1/100 （マシンによって異なる）
-        plt.rc('font', size = 6)          # default text sizes
-        plt.rc('axes', titlesize = 6)     # font size of the axes title
-        plt.rc('axes', labelsize = 6)     # font size of the x and y labels
-        plt.rc('xtick', labelsize = 6)    # font size of the tick labels
-        plt.rc('ytick', labelsize = 6)    # font size of the tick labels
-        plt.rc('legend', fontsize = 6)    # legend font size
-        plt.rc('figure', titlesize = 10)  # font size of the figure title
-
-        self.figure, self.ax = plt.subplots(
-            figsize = (self.figsize[0]*px, self.figsize[1]*px),
-        )
-        self.figure.patch.set_facecolor(
-            (
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[0]/255, 
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[1]/255, 
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[2]/255, 
-                1
+        self.contour_x = None # contour の各点の x 座標（プロット領域の大きさと contour の長さで決まる）
+        self.contour_points = []
+        self.contour_pens = [
+            wx.Pen(wx.Colour(*[round(v*255) for v in rgba]), 1) for rgba in contour_color_cycle
+        ] # ファイル冒頭で定義したもの。本当は線幅や線種も変えられるが、今のところ実装していない
+
+        # x 軸の目盛り。プロット範囲が何秒分であっても 0%, 25%, 50%, 75%, 100% に置き、「x 秒前」を表示する
+        xtick_divide = 5
+        xticks = [
+            (pos, str(label)) for pos, label in zip(
+                np.linspace(0, 1, xtick_divide), np.linspace(-self.time_range, 0.0, xtick_divide).round(3),
             )
-        ) # rgba で指定。現在は plot 外のエリア色を、アプリケーションの背景色に合わせるようになっている
-        plt.subplots_adjust(left = 0.07, right = 0.98, bottom = 0.15, top = 0.9) # 軸ラベル分の余白確保が必要
-
-        self.spec_imshow = self.ax.imshow(
-            self.tensor[self.channel, :, :], 
-            aspect = 'auto', # aspect{'auto', 'equal'} or float
-            interpolation = 'nearest', # 'none' もしくは 'nearest' それ以外は非推奨
-            vmin = self.v_range[0], 
-            vmax = self.v_range[1],
+        ]
+        # y 軸の目盛り。bin の位置を 0--1 に換算する
+        ax_bins = [(i+1)*100 for i in range(9)] + [(i+1)*1000 for i in range(4)]
+        ax_bins_label = [str(100)] + [""]*8 + [str(1000)] + [""] + [""] + [str(4000)]
+        yticks = [
+            (
+                (math.log((hz + 1e-7) / self.f_min) / math.log(2.0**(1.0 / self.bins_per_octave)) + 0.5) / tensor.shape[1], 
+                label,
+            ) for hz, label in zip(ax_bins, ax_bins_label)
+        ]
+
+        # スペクトログラムはマルチチャンネル化していないため、ステレオを突っ込むと後のチャンネルだけ描画する
+        super().__init__(
+            parent, 
+            tensor = tensor,
+            channel = min(channel, tensor.shape[0] - 1), # どのチャンネルを描画するか
             cmap = 'inferno',
-            origin = 'lower',
+            v_range = v_range,
+            origin_lower = True,
+            figsize = figsize,
+            margins = (0.07, 0.98, 0.15, 0.9), # 軸ラベル分の余白確保が必要
+            xticks = xticks,
+            yticks = yticks,
+            id = id,
+            **kwargs,
         )
-        
-        # 設計上は contour は 1 本とは限らないので、ループで 1 本ずつ描画を追加していく
-        self.contour_cmap = contour_color_cycle # ファイル冒頭で定義したもの
+        self.update_ms = update_ms
+
         if self.pitch_contour_name is not None:
-            self.contour_plot = []
-            # Pitch contour の方は、別々の Line2D オブジェクトを束ねたリストとして作成する
-            for i in range(pitch_data.shape[0]):
-                line, = self.ax.plot(
-                    np.arange(pitch_data.shape[1]), # x 
-                    hz_to_onehot(pitch_data[i, :]), # y 
-                    color = self.contour_cmap[i],
-                    linewidth = 0.5, # 本当は線幅や線種も変えられるが、今のところ実装していない
-                )
-                self.contour_plot.append(line)
-
-        xtick_divide = 5 # プロット範囲が何秒分であっても 0%, 25%, 50%, 75%, 100% に目盛り
-        self.ax.set_xticks(np.linspace(0, self.frame_len, xtick_divide))
-        self.ax.set_xticklabels(np.linspace(-self.time_range, 0.0, xtick_divide).round(3)) # 「x 秒前」になる
-        # y 軸の tickmark 
-        self.ax_bins = [(i+1)*100 for i in range(9)] + [(i+1)*1000 for i in range(4)]
-        self.ax_bins_label = [str(100)] + [""]*8 + [str(1000)] + [""] + [""] + [str(4000)]
-        self.ax.set_yticks(
-            [math.log((hz + 1e-7) / self.f_min) / math.log(2.0**(1.0 / self.bins_per_octave)) + 0.5 for hz in self.ax_bins], 
-            labels = self.ax_bins_label,
-            minor = False,
-        )
+            self.update_contour()
 
-        self.ax.tick_params(
-            bottom = True, 
-            top = True, 
-            labelbottom = True, 
-            right = True, 
-            left = True, 
-            labelleft = True,
-        )
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, self.update_ms, priority = PRIORITY_PLOT)
 
-        # FigureCanvasWxAgg は matplotlib と wx の連携用のパーツ
-        self.canvas = FigureCanvasWxAgg(self, -1, self.figure)
-        self.root_sizer = wx.BoxSizer(wx.VERTICAL)
-        self.root_sizer.Add(self.canvas, proportion = 0, flag = wx.TOP)
-        self.SetSizer(self.root_sizer)
-        self.root_sizer.Fit(self) # Sizer を親要素である Panel のサイズに自動適合
+        self.logger.debug("Initialized.")
 
-        # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.timer = wx.Timer(self) 
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(self.update_ms)
 
-        self.logger.debug("Initialized.")
+    def on_plot_resize(self):
+        super().on_plot_resize()
+        self.contour_x = None # 次の update_contour で作り直す
+
+
+    # pitch contour の折れ線の頂点を作る。x はフレーム位置の対応だけで決まるのでキャッシュしておく
+    def update_contour(self):
+        # host 側は f0 のバッファを毎回 np.roll や np.concatenate で作り直して代入するので、参照の取得だけで足りる
+        pitch = getattr(self.host, self.pitch_contour_name)
+        if pitch.ndim == 3:
+            pitch = pitch[:, 0, :]
+        if pitch.ndim == 1:
+            pitch = pitch[np.newaxis, :] # 強制的に 2D 化する
 
+        r = self.plot_rect
+        n_pitch = pitch.shape[1]
+        if self.contour_x is None or self.contour_x.shape[0] != n_pitch:
+            # contour の i 番目の点が spec の何フレーム目の中心に当たるかを、長さの比で対応させる
+            frame_pos = (np.arange(n_pitch) + 0.5) * self.frame_len / n_pitch
+            self.contour_x = np.round(r.x + frame_pos * r.width / self.frame_len).astype(np.int32)
+
+        y = r.y + r.height - hz_to_onehot(pitch) * r.height / self.tensor.shape[1]
+        y = np.round(y).astype(np.int32)
+        self.contour_points = [
+            np.stack((self.contour_x, y[i]), axis = 1).tolist() for i in range(min(y.shape[0], len(self.contour_pens)))
+        ]
+
+
+    def draw_plot(self, dc):
+        super().draw_plot(dc)
+        # contour はプロット領域からはみ出さないようにクリップする
+        dc.SetClippingRegion(self.plot_rect)
+        for pen, points in zip(self.contour_pens, self.contour_points):
+            dc.SetPen(pen)
+            dc.DrawLines(points)
+        dc.DestroyClippingRegion()
 
-    # self.update_ms が大きい時、以下のメソッドの何処かが、パネル全体の更新処理を著しく重くしている。
 
     # ロールする機能は PlotSpecPanel には持たせないことにした。そこにある tensor を素直に描画する機能に特化。
     def update(self, event):
         self.time0 = time.perf_counter_ns() # time in nanosecond
-        
-        data = copy.deepcopy(getattr(self.host, self.target_name))
-        self.spec_imshow.set_data(
-            data[self.channel, :, :], 
-        ) 
+
+        if self.reader is not None:
+            changed = self.reader.update(self.tensor)
+            if changed is not None:
+                self.scroll_columns(*changed)
+        else:
+            self.tensor[...] = getattr(self.host, self.target_name)
+            self.scroll_columns(self.frame_len, self.frame_len) # 全列を色付けし直す
 
         if self.pitch_contour_name is not None:
-            pitch = copy.deepcopy(getattr(self.host, self.pitch_contour_name))
-            if pitch.ndim == 3:
-                pitch = pitch[:, 0, :]
-            if pitch.ndim == 1:
-                pitch = pitch[np.newaxis, :] # 強制的に 2D 化する
-
-            pitch = librosa.resample(
-                pitch, 
-                orig_sr = 1000, # sr を整数化しても値がずれないよう、適当な大きな値にしている
-                target_sr = round(1000*self.pitch_adj_rate),
-                res_type = "polyphase",
-            )
-            for i, line in enumerate(self.contour_plot):
-                line.set_data(
-                    np.arange(pitch.shape[1]), 
-                    hz_to_onehot(pitch[i, :]), 
-                ) 
+            self.update_contour()
+
+        self.Refresh(eraseBackground = False)
 
         self.lapse = round((time.perf_counter_ns() - self.time0)/1e+6, 2) # time in millisecond
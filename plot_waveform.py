@@ -17,7 +17,6 @@
 # ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
 
 import time
-import queue
 
 import logging
 import inspect
@@ -25,8 +24,6 @@ import inspect
 import numpy as np
 
 import wx
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg
 
 # hi dpi 対応
 import ctypes
@@ -35,149 +32,157 @@ try:
 except:
     pass
 
+
+from plot_canvas import PlotCanvasPanel
+from peak_pyramid import PeakPyramid
+from gui_scheduler import start_update_timer, PRIORITY_PLOT
+
+
 # 要検討：self.backend.n_ch_in_use[2] は「出力をプロットに用いるよう決め打ちした場合のチャンネル数」であり、
 # もしプロット対象のデータを別のキューから取得するように経路を変更すると、チャンネル数が合わなくなる虞がある。
 # channel 引数（self.channel）でそのへんをうまく調整できるのだが、現在はまだ処理に反映されていない。
 
-# waveform を図示するためのデータは wq から block_size 単位で送られてくる。
-# 全部保持するわけではなく、表示用に間引いたデータだけを保持させる。
+# waveform を図示するためのデータは、backend の PeakFeed から min/max に畳み済みの bucket として受け取る。
+# 全部保持するわけではなく、表示用に min/max ピラミッド（PeakPyramid）に積んだデータだけを保持させる。
 # sr_proc ではなく sr_out の世界で完結させる。
 
-class PlotWaveformPanel(wx.Panel):
+# 以前は x[::down_sample] で間引いた点を matplotlib の線で描いていたが、間引きでピークが消えるうえに描画が重かった。
+# 現在は表示幅 1 px ごとの min/max 包絡線を、wx の DC で折れ線として直接描く。
+
+# matplotlib の既定の色（C0, C1, ...）に揃えている
+line_color_cycle = [
+    (31, 119, 180), 
+    (255, 127, 14), 
+    (44, 160, 44), 
+    (214, 39, 40), 
+]
+
+
+class PlotWaveformPanel(PlotCanvasPanel):
     def __init__(
         self, 
         parent, 
         id = -1, 
         backend = None, # SoundControl クラスのインスタンスを指定。
-        queue_name: str = None, # parent に含まれるキューの名称（例："wq_input"）を文字列で
+        queue_name: str = None, # backend に含まれる PeakFeed の名称（例："wq_input"）を文字列で
         sr: int = None,
         channel: int | list = [0, 1],
-        down_sample: int = 32, # プロット時にサンプルを間引く。最低 1 = 全サンプルを描画。デフォルト 10
-        plot_window_sec: float = 4.0, # プロットに描画する時間範囲で、単位はミリ秒
+        down_sample: int = 32, # ピラミッドの最下段の 1 bucket が何サンプルか。最低 1
+        plot_window_sec: float = 4.0, # プロットに描画する時間範囲で、単位は秒
         figsize: tuple = (800, 120),
         update_ms: int = 100, # プロットの更新間隔で、単位はミリ秒
         **kwargs,
     ):
-        super().__init__(parent, id = id, **kwargs) # parent として通常は wx.Panel（wx.Frame でも可）を指定する。
-
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.logger.debug("Initializing ...")
 
-        plt.ion() # interactive mode をオンにする。こいつがないとグラフを Timer で更新しない。場所は図の作成よりも上。
-
         self.backend = backend # こいつは参照渡しなので、backend を本クラスのインスタンスから再定義できる。
         self.queue_name = queue_name
         self.sr = sr if sr is not None else self.backend.sr_out
-        self.figsize = figsize
         
-        # 波形を図示する際の間引きと描画範囲を定義。1000 フレーム 2 ch の描画におよそ 1 ms を要する
-        self.channel = channel
-        self.down_sample = down_sample 
-        self.plot_window_sec = plot_window_sec # 単位ミリ秒。200 ms で 44100 だと 8820
-        # キューから受け取った self.backend.blocksize の長さのサンプルを、解像度を落とした後、self.buffer に貯めていく
-        self.buffer_length = int(self.plot_window_sec * self.sr / self.down_sample) # 802
-        # プロットすべき波形データ（固定サイズとし、古いサンプルは捨てる）を、まずゼロで初期化しておく。
-        self.buffer = np.zeros((self.buffer_length, len(self.channel)))
+        # 波形を図示する際の間引きと描画範囲を定義。
+        self.channel = channel if isinstance(channel, list) else [channel]
+        # 最下段の bucket の大きさは PeakFeed 側で畳む単位に合わせる必要がある
+        self.feed = getattr(self.backend, self.queue_name)
+        self.reader = self.feed.subscribe()
+        self.down_sample = self.feed.base_factor
+        if self.down_sample != down_sample:
+            self.logger.debug(f"down_sample {down_sample} is replaced with the base factor of the feed ({self.down_sample})")
+        self.plot_window_sec = plot_window_sec # 単位は秒。4 秒で 48000 Hz だと 192000 サンプル
+        # キューから受け取った self.backend.blocksize の長さのサンプルを、min/max に畳んでピラミッドに貯めていく
+        self.pyramid = PeakPyramid(
+            n_channel = len(self.channel),
+            window_samples = int(self.plot_window_sec * self.sr),
+            base_factor = self.down_sample,
+        )
         self.update_ms = update_ms # 波形プロットの更新間隔。単位ミリ秒
 
-        self.lapse = 0.0
-
-        ## 初期状態の plot を作る。安全を考えると、下はクラス化した方がいい。
-
-        px = 1/plt.rcParams['figure.dpi']
-        plt.rc('font', size = 6)          # controls default text sizes
-        plt.rc('axes', titlesize = 6)     # font size of the axes title
-        plt.rc('axes', labelsize = 6)     # font size of the x and y labels
-        plt.rc('xtick', labelsize = 6)    # font size of the tick labels
-        plt.rc('ytick', labelsize = 6)    # font size of the tick labels
-        plt.rc('legend', fontsize = 6)    # legend font size
-        plt.rc('figure', titlesize = 10)  # font size of the figure title
-
-        self.figure, self.ax = plt.subplots(
-            figsize = (self.figsize[0]*px, self.figsize[1]*px),
-        )
-        self.figure.patch.set_facecolor(
-            (
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[0]/255, 
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[1]/255, 
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[2]/255, 
-                1
-            )
-        ) # rgba で指定。現在は plot 外のエリア色を、アプリケーションの背景色に合わせるようになっている
-        plt.subplots_adjust(left = 0.07, right = 0.98, bottom = 0.2, top = 0.9)
-        
-        self.lines = self.ax.plot(
-            self.buffer, # (time, ch) の 2d tensor
-            linewidth = 0.85,
-        )
-        
-        # チャンネル番号を凡例表示する
-        if len(self.channel) > 0:
-            self.legends = self.ax.legend(
-                ['ch {}'.format(c) for c in self.channel], 
-                loc = 'lower left', 
-                ncol = len(self.channel),
-            )
-            self.legends.get_frame().set_linewidth(0.0)# 凡例の枠線を非表示にする
-            self.legends.get_frame().set_facecolor('none') # 凡例の背景色を非表示にする
-        
-        self.ax.axis((0, self.buffer_length, -1, 1))
         xtick_divide = 5 # プロット範囲が何秒分であっても 0%, 25%, 50%, 75%, 100% に目盛り
-        self.ax.set_xticks(np.linspace(0, self.buffer_length, xtick_divide))
-        self.ax.set_xticklabels(np.linspace(-self.plot_window_sec, 0.0, xtick_divide).round(3)) # 「x 秒前」になる
-        # y 軸の tickmark 
-        self.ax.set_yticks(np.linspace(-1.0, 1.0, 5))
-        self.ax.yaxis.grid(True)
-        self.ax.tick_params(
-            bottom = False, 
-            top = False, 
-            labelbottom = True, 
-            right = False, 
-            left = False, 
-            labelleft = True,
-        )
-        self.ax.set_facecolor((
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[0]/255, 
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[1]/255, 
-                wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU)[2]/255, 
-                1
+        xticks = [
+            (pos, str(label)) for pos, label in zip(
+                np.linspace(0, 1, xtick_divide), np.linspace(-self.plot_window_sec, 0.0, xtick_divide).round(3),
             )
+        ]
+        yticks = [((v + 1) / 2, str(v)) for v in np.linspace(-1.0, 1.0, 5)] # y は -1 から 1 の固定
+
+        super().__init__(
+            parent, 
+            figsize = figsize,
+            margins = (0.07, 0.98, 0.2, 0.9),
+            xticks = xticks,
+            yticks = yticks,
+            grid_y = True,
+            id = id,
+            **kwargs,
         )
-        
-        # FigureCanvasWxAgg は matplotlib と wx の連携用のパーツ
-        self.canvas = FigureCanvasWxAgg(self, -1, self.figure)
-        self.plot_sizer = wx.BoxSizer(wx.VERTICAL)
-        self.plot_sizer.Add(self.canvas, proportion = 0, flag = wx.TOP)
-        self.SetSizer(self.plot_sizer)
-        self.plot_sizer.Fit(self) # Sizer を親要素である Panel のサイズに自動適合
-
-        # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.timer = wx.Timer(self) 
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(self.update_ms)
+        self.line_pens = [wx.Pen(wx.Colour(*line_color_cycle[i % len(line_color_cycle)]), 1) for i in range(len(self.channel))]
+        self.legend_labels = ['ch {}'.format(c) for c in self.channel] # チャンネル番号を凡例表示する
+        self.on_plot_resize()
+        self.plot_ready = True
+
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, self.update_ms, priority = PRIORITY_PLOT, on_visibility = self.reader.set_visible)
 
         self.logger.debug("Initialized.")
 
 
+    # リサイズ時は、保持しているピラミッドから新しい幅の包絡線を作るだけでいい（履歴の再計算は不要）
+    def on_plot_resize(self):
+        r = self.plot_rect
+        self.line_x = r.x + np.arange(r.width)
+        self.make_lines()
+
+
+    # 包絡線を、列ごとに (x, max) → (x, min) と往復する折れ線の頂点リストにする
+    def make_lines(self):
+        r = self.plot_rect
+        mins, maxs = self.pyramid.envelope(r.width)
+        mid = r.y + (r.height - 1) / 2
+        half = (r.height - 1) / 2
+        self.lines = []
+        for c in range(mins.shape[0]):
+            points = np.empty((r.width * 2, 2), dtype = np.int32)
+            points[0::2, 0] = self.line_x
+            points[1::2, 0] = self.line_x
+            points[0::2, 1] = np.round(mid - np.clip(maxs[c], -1, 1) * half)
+            points[1::2, 1] = np.round(mid - np.clip(mins[c], -1, 1) * half)
+            self.lines.append(points.tolist())
+
+
+    def draw_plot(self, dc):
+        dc.SetClippingRegion(self.plot_rect)
+        for pen, points in zip(self.line_pens, self.lines):
+            dc.SetPen(pen)
+            dc.DrawLines(points)
+        dc.DestroyClippingRegion()
+
+        # 凡例（左下）
+        dc.SetFont(self.tick_font)
+        x = self.plot_rect.x + 4
+        for pen, label in zip(self.line_pens, self.legend_labels):
+            dc.SetTextForeground(pen.GetColour())
+            tw, th = dc.GetTextExtent(label)
+            dc.DrawText(label, x, self.plot_rect.y + self.plot_rect.height - th - 2)
+            x += tw + 8
+
+
     # 毎フレームのプロットデータを作るメソッド。上で handler として使われ、self.timer にバインドしている。
-    # plot_spectrogram は更新処理のたびに与えたデータを素直に全部描画するが、こちらは
-    # waveform そのものではなく適度に間引いたデータを独自に保持する。なので roll が入っている。
-    
     def update(self, event):
         self.time0 = time.perf_counter_ns() # time in nanosecond
 
-        # メソッドを 1 回呼び出すごとに、キューが空になるまで get してプロットデータを充填する手続きを回す
-        while True:
-            try:
-                temp = getattr(self.backend, self.queue_name).get_nowait()
-            except queue.Empty:
-                break
-            # self.down_sample でサンプルを時間方向に間引く（エイリアシングは発生するが、速度のために妥協）
-            temp = temp[::self.down_sample, :] # 本当は range(self.channel) で回すほうが安全
-            self.buffer = np.roll(self.buffer, -len(temp), axis = 0) # 既存の self.buffer を最初の軸について左にロール
-            self.buffer[-len(temp):, :] = temp # ロールして古いデータが入った部分を最新のデータに置換。
-        
-        for column, line in enumerate(self.lines):
-            line.set_ydata(self.buffer[:, column]) 
+        # タブが非表示、あるいはウィンドウが最小化されている間は、backend 側の書き込みごと止める
+        visible = self.IsShownOnScreen() and not self.GetTopLevelParent().IsIconized()
+        self.reader.set_visible(visible)
+        if visible is False:
+            return
+
+        # 前回以降に届いた bucket をまとめてピラミッドに入れる
+        mins, maxs = self.reader.read() # (ch, n)
+        if mins.shape[1] > 0:
+            # 入力のチャンネル数が描画チャンネル数より少ない場合（モノラル入力など）は、最後のチャンネルで埋める
+            ch_index = [min(c, mins.shape[0] - 1) for c in self.channel]
+            self.pyramid.push_peaks(mins[ch_index], maxs[ch_index])
+            self.make_lines()
+            self.Refresh(eraseBackground = False)
 
         self.lapse = round((time.perf_counter_ns() - self.time0)/1e+6, 2) # time in millisecond
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import os
+import csv
+import threading
+import logging
+import inspect
+
+import numpy as np
+import soundfile as sf
+
+
+# 直近 N 分の入出力音声を、事前に確保したメモリマップトファイル上のリングに書き続ける。
+# audio callback は memmap にコピーするだけで、ファイル I/O（ページの書き戻し）は OS に任せる。
+# 「直前 N 秒を保存」は別スレッドでリングから切り出して WAV/FLAC に書くので、audio thread には触れない。
+
+
+class MmapRing:
+    """
+    上書き型のリング (capacity, n_channel)。書き手は 1 つで、常に最新 capacity 行を保持する。
+    読み手は書き手を止めずに読むので、読んでいる間に上書きされた先頭部分は read_last 側で捨てる。
+    """
+    def __init__(
+        self,
+        path: str,
+        capacity: int,
+        n_channel: int,
+        dtype = np.float32,
+    ):
+        self.path = path
+        self.capacity = capacity
+        self.n_channel = n_channel
+        # 毎回作り直す（前回起動時の内容は引き継がない）。mode = 'w+' で作ったファイルは最初から 0 で埋まっているので、
+        # ここで全体に書き込むことはしない（既定の 3 分でも百数十 MB のページを起動のたびに汚すことになる）
+        self.buf = np.memmap(path, dtype = dtype, mode = 'w+', shape = (capacity, n_channel))
+        self.n_written = 0 # 書き込んだ総行数。データを書いてから進める
+
+
+    # audio callback から呼ぶ。チャンネル数が違う場合は足りない ch を 0 で埋める
+    def append(self, x):
+        n = x.shape[0]
+        if n > self.capacity:
+            x = x[-self.capacity:]
+            self.n_written += n - self.capacity
+            n = self.capacity
+        c = min(x.shape[1], self.n_channel)
+        start = self.n_written % self.capacity
+        first = min(n, self.capacity - start)
+        self.buf[start:start + first, :c] = x[:first, :c]
+        self.buf[:n - first, :c] = x[first:, :c]
+        if c < self.n_channel:
+            self.buf[start:start + first, c:] = 0
+            self.buf[:n - first, c:] = 0
+        self.n_written += n
+
+
+    # 最新 n 行をコピーして返す。(data, 先頭行の通し番号)
+    def read_last(self, n: int):
+        end = self.n_written
+        # 書き手が 1 周する前に読み終える前提で、直後に書かれうる分（容量の 1/8）は最初から避ける
+        start = max(0, end - n, end - self.capacity + self.capacity // 8)
+        length = end - start
+        s = start % self.capacity
+        first = min(length, self.capacity - s)
+        data = np.concatenate([self.buf[s:s + first], self.buf[:length - first]], axis = 0) # ここでコピーになる
+        # コピー中に上書きされた行があれば、その分を先頭から落とす
+        overwritten = self.n_written - self.capacity - start
+        if overwritten > 0:
+            data = data[overwritten:]
+            start += overwritten
+        return data, start
+
+
+class RollingArchive:
+    # ブロックごとのメタデータの列。すべて float64 で持つ
+    meta_fields = [
+        "head_o", "input_dBFS", "output_dBFS", "is_voice", "vc_now",
+        "vc_lap", "CE_lap", "harmof0_lap", "SE_lap", "f0n_lap", "decode_lap",
+    ]
+
+    def __init__(
+        self,
+        directory: str,
+        sr: int,
+        n_ch_in: int,
+        n_ch_out: int,
+        blocksize: int,
+        minutes: float = 5.0, # 保持する長さ
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.directory = directory
+        self.sr = int(sr)
+        self.blocksize = int(blocksize)
+        os.makedirs(self.directory, exist_ok = True)
+
+        capacity = int(minutes * 60 * self.sr)
+        self.ring_i = MmapRing(os.path.join(self.directory, "archive_i.f32"), capacity, n_ch_in)
+        self.ring_o = MmapRing(os.path.join(self.directory, "archive_o.f32"), capacity, n_ch_out)
+        self.ring_meta = MmapRing(
+            os.path.join(self.directory, "archive_meta.f64"), 
+            capacity // self.blocksize + 1, len(self.meta_fields), dtype = np.float64,
+        )
+        self.meta_row = np.zeros((1, len(self.meta_fields)), dtype = np.float64) # callback でアロケートしないための作業領域
+        self.saving = False
+
+        self.logger.debug(f"Archive of {minutes} min ({capacity} samples) was mapped in '{self.directory}'.")
+
+
+    # input_callback から呼ぶ
+    def append_input(self, data_send):
+        self.ring_i.append(data_send)
+
+
+    # output_callback から呼ぶ。meta は meta_fields の順の値
+    def append_output(self, outdata, meta):
+        self.ring_o.append(outdata)
+        self.meta_row[0] = meta
+        self.ring_meta.append(self.meta_row)
+
+
+    # 直近 seconds 秒を別スレッドで書き出す。保存中に再度呼ばれた場合は何もせず False
+    def save_snapshot(
+        self,
+        seconds: float,
+        path_prefix: str, # 例 "./snapshots/snap_2024-01-01_00-00-00"。"_i.wav" などを付けて保存
+        file_format: str = "WAV",
+        callback = None, # 保存完了時に書き出したパスのリストを渡して呼ぶ（GUI 側は wx.CallAfter で包むこと）
+    ) -> bool:
+        if self.saving:
+            return False
+        self.saving = True
+        threading.Thread(
+            target = self._save_snapshot, 
+            args = (seconds, path_prefix, file_format, callback), 
+            daemon = True,
+        ).start()
+        return True
+
+
+    def _save_snapshot(self, seconds, path_prefix, file_format, callback):
+        paths = []
+        try:
+            n = int(seconds * self.sr)
+            os.makedirs(os.path.dirname(path_prefix) or ".", exist_ok = True)
+            ext = file_format.lower()
+            # 入力と出力は別の callback で書かれるので、それぞれの最新位置から同じ長さを切り出す
+            for tag, ring in (("i", self.ring_i), ("o", self.ring_o)):
+                data, _ = ring.read_last(n)
+                path = f"{path_prefix}_{tag}.{ext}"
+                sf.write(path, data, self.sr, format = file_format)
+                paths.append(path)
+
+            meta, _ = self.ring_meta.read_last(-(-n // self.blocksize))
+            path = f"{path_prefix}_meta.csv"
+            with open(path, 'w', newline = '') as f:
+                writer = csv.writer(f)
+                writer.writerow(self.meta_fields)
+                writer.writerows(meta.tolist())
+            paths.append(path)
+            self.logger.info(f"Snapshot of the last {seconds} s was saved: {paths}")
+        except Exception:
+            self.logger.exception(f"({inspect.currentframe().f_code.co_name}) Failed to save the snapshot")
+        finally:
+            self.saving = False
+        if callback is not None:
+            callback(paths)
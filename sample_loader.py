@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import os
+import math
+import time
+import queue
+import contextlib
+import threading
+import logging
+import inspect
+
+import wx
+import numpy as np
+
+from offline_worker import lower_thread_priority
+from audio_io import open_audio_source, read_resampled, resampled_length, fill_resampled, audio_duration, DecodePool
+
+
+# Sampler のスロットに音声ファイルをロードする処理（デコード、2 種類のリサンプル、HarmoF0 とスタイルエンコーダ）を
+# GUI スレッドの外で行う。
+#   - ジョブはキューに積まれ、1 本のワーカースレッドが処理する。ワーカーはその時点で積まれているジョブをまとめて取り、
+#     HarmoF0 とスタイルエンコーダを、長さの近い音声同士をゼロ埋めしたバッチで 1 回ずつ呼ぶ（calculate_embeddings）
+#   - 音声は 1 回のデコードから、再生用と埋め込み用の 2 つの周波数の音声を作る。
+#     複数のファイルを同時にロードする場合は、デコードをスレッドプール（DecodePool）で並列に行う
+#   - リサンプル済みの音声は、ファイルの内容のハッシュと変換先のサンプリング周波数をキーとして .npy でキャッシュし、
+#     次からはメモリマップで読むだけにする。キャッシュには区間ごとにリサンプルしながら直接書くので、
+#     スロットの数や長さによらずメモリに音声全体を置かない。再生用の音声は sampler_max_sec を超えて play_max_sec まで読み、
+#     再生時は audio_io.StreamedSample がメモリマップから先読みしながら読み出す
+#   - スタイル埋め込みとプロット用の HarmoF0 出力は、ファイルの内容と HarmoF0・スタイルエンコーダのハッシュをキーとして
+#     portfolio の隣にキャッシュする。起動時の復元では、portfolio に記録したキーとファイルのサイズ・更新時刻が
+#     一致すればハッシュを取らずにそのエントリを使い、全スロットを表示し終えてから（キューが空いてから）内容のハッシュで
+#     検証する。一致しなければそのスロットだけ計算し直す
+#   - sampler_max_sec より長いファイルは、プロット用には冒頭だけを使い、スタイルだけはファイルの
+#     style_max_sec 秒までを固定長の窓に分けて求める（extract_long_style）。無声の窓は飛ばし、窓ごとのスタイルを
+#     平均（または有声区間のエネルギーで重み付け）する。窓ごとのスタイルもジョブとキャッシュに残す
+#   - 結果をウィジェットに反映する処理（プロット、portfolio の保存、再生サンプルの差し替え）は、wx.CallAfter で
+#     GUI スレッドに戻してから、スロット側の finish_load で行う
+
+
+# デコードプールのスレッドも、ワーカーと同じく優先度を下げる
+def _lower_priority_quietly():
+    try:
+        lower_thread_priority()
+    except Exception:
+        pass
+
+
+class SampleLoadJob:
+    def __init__(
+        self,
+        slot, # AudioSlotPanel インスタンス
+        file_path: str,
+        sr_out: float,
+        sr_proc: float,
+        max_sec: float,
+        restore: bool = False, # 起動時の復元か（ユーザーの操作によるロードか）
+        style_hint: dict = None, # 前回の {"style_key": キー, "file_stat": [サイズ, 更新時刻]}。一致すれば検証を後回しにする
+    ):
+        self.slot = slot
+        self.file_path = file_path
+        self.sr_out = sr_out
+        self.sr_proc = sr_proc
+        self.max_sec = max_sec
+        self.restore = restore
+        self.style_hint = style_hint
+        self.status = "queued" # queued, running, done, cancelled, failed
+        self.progress = 0.0 # 0 から 1
+        self.cancel_event = threading.Event()
+        self.error = None
+        self.n_cache_hit = 0
+        self.style_cache_hit = False
+        self.needs_verify = False # スタイルのキャッシュを、内容のハッシュを取らずに使った
+        self.wall_sec = 0.0
+
+        # 結果
+        self.file_audio_play = None # (time, channel) で sr_out
+        self.file_audio_store = None # (channel, time) で sr_proc
+        self.file_sec = 0.0
+        self.real_F0 = None
+        self.activation = None
+        self.spectrogram = None
+        self.style = None
+        self.style_key = None
+        self.window_styles = None # スタイルを求めた窓ごとのスタイル (K, 128)
+        self.window_info = None # 同じく窓ごとの (開始秒, 有声フレームの割合, 重み) (K, 3)
+        self.source_sec = 0.0 # ファイル全体の長さ
+        self.file_stat = None # [サイズ, 更新時刻 (ns)]
+
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+
+class SampleLoader:
+    def __init__(
+        self,
+        sess_HarmoF0,
+        sess_SE,
+        cache = None, # FeatureCache（names = ("audio",)）。None ならキャッシュしない
+        style_cache = None, # FeatureCache（make_style_cache）。None ならキャッシュしない
+        model_paths = (), # スタイルのキャッシュのキーに含める、HarmoF0 とスタイルエンコーダのチェックポイント
+        batch_size: int = 8, # 埋め込みを 1 回のモデル呼び出しでまとめて計算する、音声の最大数
+        bucket_sec: float = 0.5, # 長さの差がこれ以内の音声同士をまとめる
+        style_max_sec: float = 600.0, # max_sec より長いファイルは、この秒数までを窓に分けてスタイルを求める
+        window_sec: float = 4.0, # その窓の長さ
+        weighting: str = "energy", # 窓ごとのスタイルの集約方法。"mean" か "energy"（有声区間のエネルギーで重み付け）
+        activation_threshold: float = 0.7, # HarmoF0 の activation がこれを超えるフレームを有声とみなす
+        min_voiced_ratio: float = 0.3, # 有声フレームの割合がこれに満たない窓は使わない
+        decode_workers: int = 2, # デコードとリサンプルを並列に行うスレッド数
+        play_max_sec: float = 600.0, # 再生用の音声をこの秒数まで読む（キャッシュが有効な場合。max_sec より短ければ max_sec）
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.sess_HarmoF0 = sess_HarmoF0
+        self.sess_SE = sess_SE
+        self.cache = cache
+        self.style_cache = style_cache
+        self.model_paths = tuple(path for path in model_paths if path is not None)
+        self.batch_size = batch_size
+        self.bucket_sec = bucket_sec
+        self.style_max_sec = style_max_sec
+        self.window_sec = window_sec
+        self.weighting = weighting
+        self.activation_threshold = activation_threshold
+        self.min_voiced_ratio = min_voiced_ratio
+        self.play_max_sec = play_max_sec
+        self.decode_pool = DecodePool(max_workers = decode_workers, initializer = _lower_priority_quietly)
+        self.unverified = [] # ハッシュでの検証を後回しにした、完了済みのジョブ
+        self.burst_time0 = None # キューが空の状態から積まれた、一連のロードの開始時刻
+        self.burst_jobs = []
+        self.burst_lock = threading.Lock()
+        self.pending_group = None # group() の中で submit されたジョブ
+        self.job_queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+
+    # ロードを積む。ワーカーは最初のジョブで起動する。group() の中で呼んだ場合は、抜けるときにまとめて積む
+    def submit(self, slot, file_path: str, sr_out: float, sr_proc: float, max_sec: float, restore: bool = False, style_hint: dict = None):
+        job = SampleLoadJob(slot, file_path, sr_out, sr_proc, max_sec, restore = restore, style_hint = style_hint)
+        with self.burst_lock:
+            if self.burst_time0 is None:
+                self.burst_time0 = time.perf_counter()
+            self.burst_jobs.append(job)
+        if self.pending_group is not None:
+            self.pending_group.append(job)
+        else:
+            self._put([job])
+        return job
+
+
+    # この中で submit したジョブは 1 つのグループとして積まれ、埋め込みの計算がバッチでまとめて行われる。
+    # 起動時の復元や、複数のファイルを同時にドロップした場合に使う。GUI スレッドからのみ呼ぶこと
+    @contextlib.contextmanager
+    def group(self):
+        self.pending_group = []
+        try:
+            yield
+        finally:
+            jobs, self.pending_group = self.pending_group, None
+            if len(jobs) > 0:
+                self._put(jobs)
+
+
+    def _put(self, jobs):
+        self.job_queue.put(jobs)
+        if self.thread is None:
+            self.thread = threading.Thread(target = self._run, daemon = True)
+            self.thread.start()
+
+
+    # 待機中のジョブは捨て、実行中のジョブが終わるのを待つ
+    def shutdown(self, timeout: float = 5.0):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.job_queue.put(None)
+            self.thread.join(timeout)
+        self.decode_pool.shutdown()
+
+
+    def _run(self):
+        try:
+            lower_thread_priority() # VC やサンプル再生のコールバックを邪魔しない
+        except Exception:
+            self.logger.exception(f"({inspect.currentframe().f_code.co_name}) Failed to lower the thread priority")
+
+        while True:
+            jobs = self.job_queue.get()
+            if jobs is None or self.stop_event.is_set():
+                break
+            # 既に積まれている分も、まとめて 1 つのグループとして処理する
+            while not self.job_queue.empty():
+                more = self.job_queue.get_nowait()
+                if more is None:
+                    self.stop_event.set()
+                    break
+                jobs = jobs + more
+            if self.stop_event.is_set():
+                break
+
+            for job in jobs:
+                job.status = "cancelled" if job.cancel_event.is_set() else "running"
+            jobs = [job for job in jobs if job.status == "running"]
+            if len(jobs) == 0:
+                continue
+
+            time0 = time.perf_counter()
+            self.load_group(jobs)
+            wall_sec = time.perf_counter() - time0
+            if self.stop_event.is_set():
+                break # アプリの終了中なので、ウィジェットには反映しない
+
+            for job in jobs:
+                if job.status == "running":
+                    job.status = "cancelled" if job.cancel_event.is_set() else "done"
+                job.wall_sec = wall_sec
+                job.progress = 1.0
+                if job.status != "cancelled":
+                    self.logger.debug(
+                        f"({inspect.currentframe().f_code.co_name}) '{job.file_path}' {job.status} in {job.wall_sec:.2f} s "
+                        f"(group of {len(jobs)}, audio cache hit {job.n_cache_hit}/2, style cache hit {job.style_cache_hit})"
+                    )
+                wx.CallAfter(job.slot.finish_load, job) # ウィジェットの操作は GUI スレッドで行う
+                if job.needs_verify and job.status == "done":
+                    self.unverified.append(job)
+
+            if self.job_queue.empty():
+                self._log_burst()
+                self._verify()
+
+
+    # 一連のロードが終わったら、その所要時間を記録する（起動時の復元にかかった時間の目安）
+    def _log_burst(self):
+        with self.burst_lock:
+            if self.burst_time0 is None:
+                return
+            jobs, time0 = self.burst_jobs, self.burst_time0
+            self.burst_time0 = None
+            self.burst_jobs = []
+        done = [job for job in jobs if job.status == "done"]
+        self.logger.info(
+            f"({inspect.currentframe().f_code.co_name}) Loaded {len(done)}/{len(jobs)} samples "
+            f"in {time.perf_counter() - time0:.2f} s "
+            f"(style cache hit {sum(job.style_cache_hit for job in done)}, "
+            f"audio cache hit {sum(job.n_cache_hit for job in done)})"
+        )
+
+
+    # 後回しにした検証。ファイルと 2 つのチェックポイントの内容のハッシュでキーを作り直し、記録と違えばロードし直させる
+    def _verify(self):
+        while len(self.unverified) > 0 and self.job_queue.empty() and not self.stop_event.is_set():
+            job = self.unverified.pop(0)
+            try:
+                key = self.style_key(job)
+            except OSError:
+                continue # ファイルが消された。次の起動時に飛ばされる
+            if key != job.style_key:
+                self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Cached style is stale, reloading '{job.file_path}'")
+                wx.CallAfter(job.slot.reload_if_current, job)
+
+
+    def style_key(self, job) -> str:
+        return self.style_cache.make_file_key(
+            job.file_path, 
+            model_paths = self.model_paths, 
+            sr = float(job.sr_proc), 
+            max_sec = float(job.max_sec),
+            style_max_sec = float(self.style_max_sec),
+            window_sec = float(self.window_sec),
+            weighting = self.weighting,
+            activation_threshold = float(self.activation_threshold),
+            min_voiced_ratio = float(self.min_voiced_ratio),
+        )
+
+
+    # 各ジョブの音声を用意し、スタイルのキャッシュに無かったものだけ、長さの近いもの同士でまとめて埋め込みを計算する
+    def load_group(self, jobs):
+        # デコードとリサンプル（とキャッシュの確認）は、複数のファイルがあればデコードプールで並列に行う
+        if len(jobs) > 1:
+            needs = self.decode_pool.map(self._prepare_or_fail, jobs)
+        else:
+            needs = [self._prepare_or_fail(job) for job in jobs]
+        pending = [job for job, need in zip(jobs, needs) if need and not job.cancel_event.is_set()]
+        if len(pending) == 0:
+            return
+
+        try:
+            results = calculate_embeddings(
+                self.sess_HarmoF0, 
+                self.sess_SE, 
+                [job.file_audio_store for job in pending],
+                max_batch = self.batch_size,
+                bucket_samples = int(self.bucket_sec * pending[0].sr_proc),
+            )
+        except Exception:
+            # バッチで通らなければ（メモリ不足など）、1 つずつ計算し直す
+            self.logger.exception(f"({inspect.currentframe().f_code.co_name}) Batched embedding failed, falling back to one by one")
+            results = []
+            for job in pending:
+                try:
+                    results.append(calculate_embedding(self.sess_HarmoF0, self.sess_SE, np.ascontiguousarray(job.file_audio_store, dtype = np.float32)))
+                except Exception as e:
+                    self._fail(job, e)
+                    results.append(None)
+
+        for job, result in zip(pending, results):
+            job.file_audio_store = None # 埋め込みを計算し終えたら、16 kHz の音声は持たない
+            if result is None:
+                continue
+            job.real_F0, job.activation, job.spectrogram, job.style = result
+            job.window_styles = job.style
+            job.window_info = np.array([[0.0, float(np.mean(job.activation > self.activation_threshold)), 1.0]], dtype = np.float32)
+            if job.source_sec > job.max_sec + 0.5 * self.window_sec and self.style_max_sec > job.max_sec:
+                # 長いファイルは、スタイルだけファイル全体（style_max_sec まで）から求め直す
+                try:
+                    source = open_audio_source(job.file_path)
+                    try:
+                        style, job.window_styles, job.window_info = extract_long_style(
+                            self.sess_HarmoF0, 
+                            self.sess_SE, 
+                            source, 
+                            job.sr_proc,
+                            max_sec = self.style_max_sec,
+                            window_sec = self.window_sec,
+                            batch_size = self.batch_size,
+                            weighting = self.weighting,
+                            activation_threshold = self.activation_threshold,
+                            min_voiced_ratio = self.min_voiced_ratio,
+                            cancel = job.cancel_event,
+                        )
+                    finally:
+                        source.close()
+                    if style is None:
+                        continue # キャンセルされた
+                    job.style = style
+                except Exception as e:
+                    self._fail(job, e)
+                    continue
+            if self.style_cache is not None:
+                self.style_cache.put(job.style_key, {
+                    "real_F0": job.real_F0, 
+                    "activation": job.activation, 
+                    "spectrogram": job.spectrogram, 
+                    "style": job.style,
+                    "window_styles": job.window_styles,
+                    "window_info": job.window_info,
+                })
+
+
+    def _fail(self, job, e):
+        job.status = "failed"
+        job.error = str(e)
+        self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Failed to load the audio sample {job.file_path}: {e}")
+
+
+    # 再生用の音声を用意し、スタイルのキャッシュを引く。埋め込みの計算が必要なら 16 kHz の音声も用意して True を返す
+    def prepare(self, job) -> bool:
+        st = os.stat(job.file_path)
+        job.file_stat = [st.st_size, st.st_mtime_ns]
+
+        # スタイルのキャッシュを引く。ファイルが前回から変わっていなければ、ハッシュを取らずに前回のキーを使う
+        features = None
+        if self.style_cache is not None:
+            hint = job.style_hint
+            if hint is not None and hint.get("style_key") and hint.get("file_stat") == job.file_stat:
+                features = self.style_cache.get(hint["style_key"])
+                if features is not None:
+                    job.style_key = hint["style_key"]
+                    job.needs_verify = True
+            if features is None:
+                job.style_key = self.style_key(job)
+                features = self.style_cache.get(job.style_key)
+
+        # 再生用のバッファは sr_out、channel last で持つ。embedding 計算用のバッファは sr_proc (16000 Hz)、time last で持つ。
+        # 再生用はキャッシュのメモリマップから読むので、play_max_sec まで（max_sec より長く）取ってよい。
+        # キャッシュが無効ならメモリに置くことになるので、max_sec で切る
+        play_max_sec = max(job.max_sec, self.play_max_sec) if self.cache is not None else job.max_sec
+        specs = [(job.sr_out, True, play_max_sec)] + ([(job.sr_proc, False, job.max_sec)] if features is None else [])
+        buffers = self.resampled(job, specs)
+        job.file_audio_play = buffers[0]
+        job.file_sec = job.file_audio_play.shape[0] / job.sr_out # 単位：秒
+        if self.style_max_sec > job.max_sec and job.file_sec >= job.max_sec - 0.01:
+            job.source_sec = audio_duration(job.file_path) # max_sec で切り詰められている可能性があるので、全体の長さを調べる
+        else:
+            job.source_sec = job.file_sec
+        job.progress = 0.4 if features is None else 0.9
+        if job.cancel_event.is_set():
+            return False
+
+        if features is not None:
+            job.style_cache_hit = True
+            job.real_F0 = np.asarray(features["real_F0"])
+            job.activation = np.asarray(features["activation"])
+            job.spectrogram = np.asarray(features["spectrogram"], dtype = np.float32)
+            job.style = np.array(features["style"]) # VC に使うので、memmap ではなくメモリ上に複製する
+            job.window_styles = features["window_styles"]
+            job.window_info = features["window_info"]
+            return False
+
+        job.file_audio_store = buffers[1]
+        return True
+
+
+    # prepare の例外をジョブの失敗として記録する版。デコードプールから呼ぶ
+    def _prepare_or_fail(self, job) -> bool:
+        try:
+            return self.prepare(job)
+        except Exception as e:
+            self._fail(job, e)
+            return False
+
+
+    # specs = [(サンプリング周波数, channel last か, 最大秒数), ...] の音声を返す。キャッシュに無いものだけを 1 回のデコードで作る。
+    # キャッシュがあれば、リサンプルした音声はキャッシュのファイルに直接書き、メモリマップで返す（メモリに全体を置かない）
+    def resampled(self, job, specs):
+        outputs = [None] * len(specs)
+        keys = [None] * len(specs)
+        if self.cache is not None:
+            for i, (sr, channel_last, max_sec) in enumerate(specs):
+                keys[i] = self.cache.make_file_key(job.file_path, sr = float(sr), max_sec = float(max_sec), channel_last = channel_last)
+                hit = self.cache.get(keys[i])
+                if hit is not None:
+                    job.n_cache_hit += 1
+                    outputs[i] = hit["audio"] # 読み取り専用の memmap のまま使う
+
+        missing = [i for i in range(len(specs)) if outputs[i] is None]
+        if len(missing) == 0:
+            return outputs
+        source = open_audio_source(job.file_path, max_sec = max(specs[i][2] for i in missing))
+        try:
+            for i in missing:
+                sr, channel_last, max_sec = specs[i]
+                n = resampled_length(source, sr, max_sec)
+                # (time, 1) も (1, time) も、reshape(-1) すれば書き込める 1 次元のビューになる
+                fill = lambda arrays, sr = sr: fill_resampled(source, sr, arrays["audio"].reshape(-1), cancel = job.cancel_event)
+                entry = None
+                if keys[i] is not None:
+                    entry = self.cache.put_streamed(keys[i], {"audio": (n, 1) if channel_last else (1, n)}, fill)
+                if entry is not None:
+                    outputs[i] = entry["audio"]
+                else:
+                    audio = np.zeros((n, 1) if channel_last else (1, n), dtype = np.float32)
+                    fill({"audio": audio})
+                    outputs[i] = audio
+                if job.cancel_event.is_set():
+                    break # 呼び出し側がキャンセルを見て捨てる
+        finally:
+            source.close()
+        return outputs
+
+
+# 16 kHz の音声 (channel, time) のスタイル埋め込みを計算する。なお、末尾（時間）次元は 4 の倍数でないと動作しない
+def calculate_embedding(sess_HarmoF0, sess_SE, audio_i16):
+    real_F0, activation, real_N, spectrogram = sess_HarmoF0.run(
+        ['freq_t', 'act_t', 'energy_t', 'spec'], 
+        {"input": audio_i16},
+    )
+    # 末尾（時間）次元を 4 の倍数に切り詰める
+    spec_size_by_four = (spectrogram.shape[-1] // 4) * 4
+    style = sess_SE.run(
+        ['output'], 
+        {'input': spectrogram[:, np.newaxis, 48:, :spec_size_by_four]},
+    )[0]
+    return real_F0, activation, spectrogram, style
+
+
+# 16 kHz の音声 [(channel, time), ...] のスタイル埋め込みを、長さの近いもの同士でまとめて計算する。
+# 戻り値は入力の順に [(real_F0, activation, spectrogram, style), ...] で、各要素の形は calculate_embedding と同じ。
+#   - 長さでソートし、先頭との差が bucket_samples 以内かつ max_batch 個までを 1 つのバケットにする
+#   - HarmoF0 は末尾をゼロ埋めしたバッチで 1 回呼び、出力は各行の有効なフレーム数で切り出す
+#   - スタイルエンコーダはバケットの中で最も短い行のフレーム数（4 の倍数）に揃えて 1 回呼ぶ。
+#     長い行は末尾の最大 bucket_samples 分がスタイルに使われないが、バケットに 1 つだけなら calculate_embedding と同じ
+def calculate_embeddings(
+    sess_HarmoF0, 
+    sess_SE, 
+    audios, 
+    max_batch: int = 8, 
+    bucket_samples: int = 8000,
+):
+    order = sorted(range(len(audios)), key = lambda i: audios[i].shape[-1])
+    buckets = []
+    for i in order:
+        n = audios[i].shape[-1]
+        if len(buckets) == 0 or len(buckets[-1]) >= max_batch or n - audios[buckets[-1][0]].shape[-1] > bucket_samples:
+            buckets.append([])
+        buckets[-1].append(i)
+
+    results = [None] * len(audios)
+    for bucket in buckets:
+        lengths = [audios[i].shape[-1] for i in bucket]
+        batch = np.zeros((len(bucket), max(lengths)), dtype = np.float32)
+        for row, i in enumerate(bucket):
+            batch[row, :lengths[row]] = audios[i][0, :] # モノラル（channel 0）
+
+        real_F0, activation, real_N, spectrogram = sess_HarmoF0.run(
+            ['freq_t', 'act_t', 'energy_t', 'spec'], 
+            {"input": batch},
+        )
+        n_frames = [min(spectrogram.shape[-1], int(math.ceil(spectrogram.shape[-1] * n / batch.shape[-1]))) for n in lengths]
+        # 末尾（時間）次元を、最も短い行に合わせて 4 の倍数に切り詰める
+        spec_size_by_four = (min(n_frames) // 4) * 4
+        style = sess_SE.run(
+            ['output'], 
+            {'input': spectrogram[:, np.newaxis, 48:, :spec_size_by_four]},
+        )[0]
+
+        for row, i in enumerate(bucket):
+            results[i] = (
+                real_F0[row:row+1, :n_frames[row]], 
+                activation[row:row+1, :n_frames[row]], 
+                spectrogram[row:row+1, :, :n_frames[row]], 
+                style[row:row+1, :],
+            )
+    return results
+
+
+# 長い参照音声のスタイルを、window_sec 秒の窓に分けて求める。source は open_audio_source で開いたもの。
+#   - 窓を batch_size 個ずつ読んで HarmoF0 とスタイルエンコーダに通すので、メモリは音声の長さによらない
+#   - HarmoF0 の activation が activation_threshold を超えるフレームの割合が min_voiced_ratio 未満の窓は使わない
+#   - weighting = "mean" なら使った窓の単純平均、"energy" なら有声フレームの RMS の和で重み付けした平均
+# 戻り値は (スタイル (1, 128), 使った窓のスタイル (K, 128), 使った窓の (開始秒, 有声フレームの割合, 重み) (K, 3))。
+# cancel がセットされたら (None, None, None)。有声の窓が 1 つもなければ、全ての窓の単純平均にする
+def extract_long_style(
+    sess_HarmoF0, 
+    sess_SE, 
+    source, 
+    sr_proc: int, 
+    max_sec: float = 600.0, 
+    window_sec: float = 4.0, 
+    batch_size: int = 8, 
+    weighting: str = "energy", 
+    activation_threshold: float = 0.7, 
+    min_voiced_ratio: float = 0.3,
+    cancel = None,
+):
+    hop = int(sr_proc) // 100 # HarmoF0 のフレーム間隔（10 ms）
+    win = int(window_sec * sr_proc) // (hop * 4) * (hop * 4) # スタイルエンコーダが通るように 4 フレームの倍数にする
+    n_16k = min(int(math.ceil(source.n_samples * sr_proc / source.sr)), int(max_sec * sr_proc))
+    n_windows = max(1, n_16k // win) # 末尾の窓長に満たない端数は使わない
+
+    sum_style = np.zeros((1, 128), dtype = np.float64)
+    sum_weight = 0.0
+    sum_all = np.zeros((1, 128), dtype = np.float64) # 有声の窓が無かった場合の予備
+    window_styles = []
+    window_info = []
+    for k0 in range(0, n_windows, batch_size):
+        if cancel is not None and cancel.is_set():
+            return None, None, None
+        ks = list(range(k0, min(k0 + batch_size, n_windows)))
+        x = np.stack([read_resampled(source, sr_proc, k * win, (k + 1) * win) for k in ks]) # (B, win)
+        real_F0, activation, real_N, spectrogram = sess_HarmoF0.run(
+            ['freq_t', 'act_t', 'energy_t', 'spec'], 
+            {"input": x},
+        )
+        n_frames = min(activation.shape[-1], win // hop)
+        voiced = activation[:, :n_frames] > activation_threshold # (B, n_frames)
+        style = sess_SE.run(
+            ['output'], 
+            {'input': spectrogram[:, np.newaxis, 48:, :(spectrogram.shape[-1] // 4) * 4]},
+        )[0] # (B, 128)
+        sum_all += style.sum(axis = 0, keepdims = True)
+
+        frame_rms = np.sqrt(np.mean(x[:, :n_frames * hop].reshape(len(ks), n_frames, hop) ** 2, axis = -1)) # (B, n_frames)
+        for row, k in enumerate(ks):
+            voiced_ratio = float(voiced[row].mean())
+            if voiced_ratio < min_voiced_ratio:
+                continue
+            weight = float(frame_rms[row][voiced[row]].sum()) if weighting == "energy" else 1.0
+            sum_style += weight * style[row:row+1, :]
+            sum_weight += weight
+            window_styles.append(style[row, :])
+            window_info.append((k * win / sr_proc, voiced_ratio, weight))
+
+    if sum_weight > 0:
+        result = sum_style / sum_weight
+    else:
+        result = sum_all / n_windows
+    window_styles = np.array(window_styles, dtype = np.float32).reshape(-1, 128)
+    window_info = np.array(window_info, dtype = np.float32).reshape(-1, 3)
+    return result.astype(np.float32), window_styles, window_info
@@ -40,6 +40,12 @@ so.log_severity_level = 0
 from utils import truncate_string
 from sample_player_widgets import SamplePlayerWidgets
 from sample_slot import AudioSlotPanel, ResultEmbeddingPanel
+from sample_loader import SampleLoader
+from audio_io import StreamedSample
+from feature_cache import make_sample_cache, make_style_cache, make_preview_cache
+from sample_preview import SamplePreview
+from gui_scheduler import start_update_timer, PRIORITY_CONTROL
+from json_writer import write_json_atomic
 
 
 # s44 現在、計算したスタイル埋め込みを JSON に保存できるが、前回計算したスタイルは自動ではロードされない。
@@ -60,13 +66,14 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
         backend = None, # SoundControl クラス
         id = -1,
         host = None,
-        mute_direct_out: bool = True, # 音声デバイスへの、backend を介さない直接出力をミュートする
+        mute_direct_out: bool = None, # サンプルを VC を通さずに出力デバイスでも鳴らす（モニター）のをやめる。None なら vc_config の sampler_monitor に従う
         model_device = "cpu",
         harmof0_ckpt: str = None,
         SE_ckpt: str = None,
         initial_sec: float = 8.0, # 埋め込み計算に使う初期化用（ダミー）データの秒数
         ch_map: list = [0], # 入力信号のどのチャンネルを、処理関数に流すかを決めるマップ（下記）
         max_slots: int = 8, # 最大いくつの音声ファイルを保持するか。3 以上だとなぜか UI の反応が鈍くなる
+        restore_slot: bool = False, # 前回終了時に読み込んでいた音声ファイルを、バックグラウンドで再ロードする
         portfolio_path: str = None, # config を保存するときのファイル名
         debug: bool = False,
         **kwargs,
@@ -83,7 +90,6 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
         # 以下は audio backend インスタンス変数から拾う 
         self.sr_out: float = self.backend.sr_out
         self.sr_proc: float = self.backend.sr_proc
-        self.blocksize: int = copy.deepcopy(self.backend.blocksize) # この変数は OutputStream の作り直しに必要
         self.ch_map = ch_map
         # 流すデータの種類に注意。音声チャンクを (blocksize, n_ch) の np.float64 で用意する。
 
@@ -100,11 +106,14 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
         # 再生設定
         self.initial_sec: float = initial_sec # 秒数で定義
         self.max_sec = self.backend.sampler_max_sec
-        self.cs = None # 実際に再生する current sample。ただし最初は None で初期化する
+        self.cs = None # 実際に再生する current sample（StreamedSample）。ただし最初は None で初期化する
         self.cs_name: str = "" # 実際に再生するサンプルの名前。set_sample の内部でのみ書き換えが可能。
+        self.cs_path = None # 実際に再生するサンプルの元のファイル。試聴用の変換結果のキーに使う
         self.cs_sec: float = self.initial_sec  # 単位は seconds であり、まずダミーの秒数で初期化する。
         self.play_position: int = 0 # こちらの単位は秒ではなくサンプル
-        self.mute_direct_out = mute_direct_out # 本パネルの OutputStream からデバイスへの直接出力をミュートするか
+        if mute_direct_out is not None:
+            self.backend.sample_monitor = not mute_direct_out # モニターの実体は backend の出力側にある
+        self.sample_block = None # backend に渡すチャンク。pull_block で使い回す
         self.playing = False
         self.repeat = False
         self.sldr_updatable = False # 再生ポジションのスライダーが更新可能か否か。callback の評価中はロックされる
@@ -160,7 +169,41 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
             {'input': spec_chunk[:, np.newaxis, 48:, :spec_size_by_four]},
         )[0] # (1, 128)
 
+        # 音声ファイルのロードは GUI スレッドの外で行う。リサンプル済みの音声と、スタイル埋め込みはディスクにキャッシュする
+        self.sample_loader = SampleLoader(
+            self.sess_HarmoF0, 
+            self.sess_SE, 
+            cache = make_sample_cache(self.backend.vc_config),
+            style_cache = make_style_cache(self.sample_portfolio_path, self.backend.vc_config),
+            model_paths = (self.harmof0_ckpt, self.SE_ckpt),
+            batch_size = self.backend.vc_config.get("sampler_batch_size", 8),
+            bucket_sec = self.backend.vc_config.get("sampler_bucket_sec", 0.5),
+            style_max_sec = self.backend.vc_config.get("sampler_style_max_sec", 600.0),
+            window_sec = self.backend.vc_config.get("sampler_style_window_sec", 4.0),
+            weighting = self.backend.vc_config.get("sampler_style_weighting", "energy"),
+            activation_threshold = self.backend.vc_config.get("activation_threshold", 0.7),
+            min_voiced_ratio = self.backend.vc_config.get("sampler_style_min_voiced", 0.3),
+            decode_workers = self.backend.vc_config.get("sampler_decode_workers", 2),
+            play_max_sec = self.backend.vc_config.get("sampler_play_max_sec", 600.0),
+        )
+
+        # 同じサンプルを同じスタイルと変換設定で繰り返し聞く場合のために、オフライン変換した結果をキャッシュして再生する
+        self.sample_preview = None
+        preview_cache = make_preview_cache(self.backend.vc_config) if hasattr(self.backend, "offline_worker") else None
+        if preview_cache is not None:
+            model = self.backend.vc_config["model"]
+            self.sample_preview = SamplePreview(
+                self.backend, 
+                preview_cache, 
+                model_paths = (model["harmof0_ckpt"], model["CE_ckpt"], model["f0n_ckpt"], model["decoder_ckpt"]),
+                max_sec = self.backend.vc_config.get("sampler_play_max_sec", 600.0),
+            )
+        self.preview_audio = None # 現在のサンプルの、現在の設定での変換結果（StreamedSample）。無ければ None
+        self.preview_key = None
+        self.use_preview = False # 今回の再生で変換結果を使っているか。再生の開始時（ヘッドが 0 のとき）に決める
+
         # ダミーデータを再生サンプルにロードしておく
+        self.file_audio_path = None # 選択中ファイルのパス。ダミーは None
         self.set_sample(self.initial_audio_name, self.initial_sec, self.initial_audio_play)
 
         #### 初期スタイルの作成
@@ -171,6 +214,9 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
 
         # 平均埋め込みの計算に各 embedding を何割ずつ反映するか（いったん 1 固定）
         self.mix_coef_list = [1.0]*self.max_slots # 長さは常に全スロット数分
+        if restore_slot:
+            for i, slot_config in enumerate(self.sample_portfolio[:self.max_slots]):
+                self.mix_coef_list[i] = slot_config.get("mix_coef", 1.0)
         # 下に active_coef_list というものも作る。これは「アクティブなスロットの成分だけ抜き出した」可変長のリスト
 
         #### 音声ファイル用のスロットパネルおよび、最終採用スタイルの表示パネルの初期化
@@ -218,27 +264,34 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
 
         self.SetupScrolling()
 
-        #### ストリームの開始
+        # 前回のファイルを復元する。ロードはバックグラウンドで、全スロット分をまとめて行う。見つからないファイルは飛ばす
+        if restore_slot:
+            with self.sample_loader.group():
+                for i, slot_config in enumerate(self.sample_portfolio[:self.max_slots]):
+                    last_relpath = slot_config.get("last_selected_file")
+                    if last_relpath is None:
+                        continue
+                    file_path = last_relpath.replace('/', os.path.sep).replace('\\', os.path.sep)
+                    if os.path.isfile(file_path):
+                        self.slot_list[i].current_file_path = file_path
+                        self.slot_list[i].load_file(
+                            file_path, 
+                            self.sr_out, 
+                            self.sr_proc, 
+                            restore = True, 
+                            style_hint = {"style_key": slot_config.get("style_key"), "file_stat": slot_config.get("file_stat")},
+                        )
+                    else:
+                        self.logger.debug(f"Sample for slot {i} was not found: '{file_path}'")
+
+        #### backend の入力への接続
         
-        # 本インスタンスから出力デバイスに音声を直接送る経路部分のストリームを作る。
-        # 音声デバイス自体は backend と重複してもいいが、sr, チャンネル数、blocksize, dtype は厳密に一致させる
-        # なお set_sample 後でないと output_callback で使う変数が揃わない
-        self.output_stream = sd.OutputStream(
-            samplerate = self.backend.sr_out, # scan() で作成される
-#            device = self.backend.dev_ids_in_use, # scan() で作成される
-            # query_devices() で得られる max_input_channels ないし max_output_channels が設定可能な最大値。最小値は 1
-            channels = self.backend.n_ch_in_use[2], 
-            dtype = 'float32', # 'float32' and 'float64' use [-1.0, +1.0]. 'uint8' is an unsigned 8 bit format
-            blocksize = self.backend.blocksize, # 標準は 0  だが、だいたい 128 くらいになる。
-#            latency = self.backend.latency, #0.1, # 単位は秒もしくは 'high' 'low'
-            callback = self.output_callback, # コールバックは backend 用ではなく、このクラス内で作る専用品
-#            extra_settings = self.backend.api_specific_settings,
-        )
-        self.output_stream.start()
+        # backend の input_callback が、入力ブロックごとに pull_block を呼んでサンプルをミックスする。
+        # 専用のストリームは持たない。なお set_sample 後でないと pull_block で使う変数が揃わない
+        self.backend.sample_source = self.pull_block
 
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(100) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録する。VC に使うスタイルを決めるので、タブが非表示でも止めない。単位 ms
+        self.timer = start_update_timer(self, self.update, 100, priority = PRIORITY_CONTROL, always = True)
 
         self.logger.debug("Initialized.")
 
@@ -295,6 +348,51 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
         # というわけで、self.style_result が VC 用の埋め込みとして backend に送られる
         self.backend.candidate_style_list[1] = copy.deepcopy(self.style_result)
 
+        self.refresh_preview()
+
+
+    # 再生サンプルと現在の変換設定に対応する、試聴用の変換結果を用意する。設定が変わっていれば、再生中でも
+    # 直ちにリアルタイムの VC に戻す。変換結果が無いサンプルが実際に再生されたら（リアルタイムの VC で聞いている間に）
+    # 現在の設定での変換を裏で始め、終わったら次の再生から使う
+    def refresh_preview(self):
+        if self.sample_preview is None:
+            return
+        key = self.sample_preview.make_key(self.cs_path) if self.cs_path is not None else None
+        if key != self.preview_key:
+            self.preview_key = key
+            self.use_preview = False
+            if self.preview_audio is not None:
+                self.preview_audio.close()
+                self.preview_audio = None
+            if key is not None:
+                self._open_preview(key, request = False) # 以前に変換済みなら、すぐ使える
+        elif key is not None and self.preview_audio is None:
+            if self.sample_preview.is_ready(key):
+                self._open_preview(key, request = False)
+            elif self.playing:
+                self._open_preview(key, request = True)
+
+
+    def _open_preview(self, key, request: bool):
+        audio = self.sample_preview.get(self.cs_path, key, request = request) # 無ければ None
+        if audio is not None:
+            self.preview_audio = StreamedSample(
+                audio, 
+                n_ch = self.backend.n_ch_in_use[0], 
+                sr = self.backend.sr_out,
+                readahead_sec = self.backend.vc_config.get("sampler_readahead_sec", 2.0),
+            )
+
+
+    # 複数スタイルでのオフライン変換用に、チェックの入ったスロットのスタイルを [(名前, (1, 128))] で返す
+    def slot_styles(self):
+        styles = []
+        for i, slot in enumerate(self.slot_list):
+            if slot.is_active_checkbox.GetValue() is True and hasattr(slot, "style"):
+                name = os.path.splitext(os.path.basename(slot.current_file_path))[0] if slot.current_file_path else ""
+                styles.append((f"sample{i}_{name}" if name else f"sample{i}", copy.deepcopy(slot.style)))
+        return styles
+
 
     # 再生状態の変数は変えずに、ボタンの状態を整合させる。もっぱら update から呼ばれる。
     # 最初は _send_sound, _stop_sound からも毎回呼び出していたが、Linux で再生終了処理時に segmentation fault に
@@ -363,10 +461,12 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
                     self.file_audio_name = copy.deepcopy(self.slot_list[slot_index].file_audio_name)
                     self.file_sec = copy.deepcopy(self.slot_list[slot_index].file_sec)
                     self.file_audio_play = self.slot_list[slot_index].file_audio_play
+                    self.file_audio_path = self.slot_list[slot_index].loaded_job.file_path
                     self.set_sample(
                         self.file_audio_name, 
                         self.file_sec, 
                         self.file_audio_play,
+                        file_path = self.file_audio_path,
                     )
                     self.remake_sldr() # 再生位置スライダーを再作成する（こいつが必要なため、再生中は処理に入れない）
 
@@ -410,22 +510,29 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
 
     # 実際に再生する音声を current sample、すなわち OutputStream から見える場所である self.cs 変数にセットする。
     # このメソッドを呼び出すポイントは SampleManagerPanel に 3 つ、AudioSlotPanel に 1 つ存在する。
+    # 音声の実体（通常はサンプルのキャッシュのメモリマップ）は複製せず、StreamedSample で包んで、
+    # 再生位置の先を先読みしながらブロックごとに読み出す。チャンネル数の変換も読み出し時に行う
     def set_sample(
         self,
         file_audio_name, # 引数としてサンプルの名称（ファイル名）、
         file_sec, # 秒数、
         file_audio_data, # そして音声の実体である array (time, n_ch) が必要
+        file_path: str = None, # 試聴用の変換結果のキーに使う、元のファイルのパス。ダミーなら None
     ):
         # 現在セットされているサンプルの名前を反映→再生中にファイルを選択し直した場合の、再反映タイミング決定に使う
         self.cs_name = file_audio_name
         self.cs_sec = file_sec
-        # この段階でチャンネル数を OutputStream に合わせている。現在、サラウンド等のマルチチャンネルに非対応
-        if self.backend.n_ch_in_use[0] == 2 and file_audio_data.shape[1] == 1:
-            self.cs = np.hstack((file_audio_data, file_audio_data)) # モノラル→ステレオ
-        elif self.backend.n_ch_in_use[0] == 1 and file_audio_data.shape[1] == 2:
-            self.cs = file_audio_data[:, 0] # ステレオ→ ch0 だけ送る
-        else:
-            self.cs = file_audio_data
+        self.cs_path = file_path
+        # チャンネル数は読み出し時に OutputStream に合わせる（モノラル→ステレオ、ステレオ→ ch0 だけ送る）。
+        # 現在、サラウンド等のマルチチャンネルに非対応
+        if self.cs is not None:
+            self.cs.close() # 前のサンプルの先読みスレッドを止める
+        self.cs = StreamedSample(
+            file_audio_data, 
+            n_ch = self.backend.n_ch_in_use[0], 
+            sr = self.backend.sr_out,
+            readahead_sec = self.backend.vc_config.get("sampler_readahead_sec", 2.0),
+        )
 
         self.play_position = int(0) # いずれにせよ再生ヘッドを 0 戻しする
 
@@ -438,52 +545,52 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
 
     ####
 
-    # 音声のコールバック関数であるが、スライダーや再生状態の変数の制御ループもここに書く。
+    # backend の input_callback から、ブロックごとに呼ばれる。スライダーや再生状態の変数の制御ループもここに書く。
     # 最初はスライダーの状態整合処理を独立した update メソッドにして wx.Timer で呼んでいたが、
     # スライダーが一時的に操作できないタイミングで update が走ると segmentation fault になることが判明した
 
-    # 以下の音声出力は「本クラス→出力デバイス」の直接経路。
-    # ただし実際には mute_direct_out = True を指定し、こちらからは直接音が鳴らないようにする
+    # 以前は本クラスが専用の OutputStream を持ち、その callback でブロックを queueP に積んで backend の input_callback が
+    # 取り出していた。2 つのストリームのクロックがずれるとキューが溜まったり空になったりし、blocksize が変わるたびに
+    # ストリームを作り直す必要があったので、backend が入力ブロックと同じ長さ（frames）をここから直接引く形にした。
+    # 出力デバイスで直接聞く（モニター）場合は、backend が sample_monitor_ring を通して出力に混ぜる
     
-    def output_callback(self, outdata, frames, time, status):
-        # 最初に、バックエンドの blocksize が変わっていたら Stream 自体を作り直す機能
-        if self.blocksize != self.backend.blocksize:
-            self.remake_stream() # つまり output_callback 自体もいったん生まれ変わる必要がある
-
+    def pull_block(self, frames):
         # フラグのリセット
         self.sldr_updatable = False # 送信処理中は position slider の更新を無効化
         reset_play_position = False # 現在のコールバックを処理した瞬間に終端に達する場合のみ True にするフラグ
-        # キューに送る用のチャンクを初期化
-        chunk0 = np.zeros((self.backend.blocksize, self.backend.n_ch_in_use[0])) # ダミーとして供給する無音サンプル
-        chunk = np.zeros_like(chunk0) # これから中身の声を入れる
-        
-        # 再生ヘッドをまず調べる
-        remains = int(len(self.cs) - self.play_position) # まだ送られていないサンプルの長さ（最低 1）
-        
-        # playing である場合のみ、キュー（to backend）に送るサンプルを作成
-        # 加えて mute_direct_out == False の場合のみ、自前の音声出力である outdata に声の入ったサンプルを供給する
+        chunk = None # 再生していなければ None を返す
+
+        # playing である場合のみ、backend に渡すサンプルを作成
         if self.playing:
+            # 再生ヘッドをまず調べる
+            remains = int(len(self.cs) - self.play_position) # まだ送られていないサンプルの長さ（最低 1）
             if remains <= 0:
                 # ヘッドがサンプルの有効長を超えている → 再生できないのでリセット処理に進む
                 reset_play_position = True
                 self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Head {self.play_position} exceeds the sample length ({remains} samples remaining)")
-            elif remains <= self.backend.blocksize:
-                # 現ブロックを最後に再生が終わる → 残りサンプルをチャンクに当てはめて送る
-                reset_play_position = True
-                self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Reached the last chunk (played {self.play_position} samples, {remains} remaining)")
-                chunk[:remains, :] = self.cs[-remains:, :]
-                self.backend.queueP.put_nowait(copy.deepcopy(chunk)) # VC バックエンドに queueP を通じてデータを送出
-            else:
-                # まだ 1 ブロック分以上再生すべきサンプルが残っている
-                chunk[:] = self.cs[int(self.play_position):int(self.play_position + self.backend.blocksize), :]
-                self.backend.queueP.put_nowait(copy.deepcopy(chunk))
-                self.play_position += self.backend.blocksize # ブロック分だけヘッドを進める
-
-            # 音声デバイスへの音声チャンクの直接送出
-            if self.mute_direct_out is False:
-                outdata[:] = copy.deepcopy(chunk[:])
             else:
-                outdata[:] = copy.deepcopy(chunk0[:]) # ミュートする場合も無音サンプルの送出は必要
+                # チャンクは使い回す。入力のチャンネル数（デバイス変更で変わりうる）と frames に合わせて作り直す
+                n_ch = self.backend.n_ch_in_use[0]
+                if self.sample_block is None or self.sample_block.shape != (frames, n_ch):
+                    self.sample_block = np.zeros((frames, n_ch), dtype = np.float32)
+                chunk = self.sample_block
+                # 再生の開始時に、現在の設定での変換結果があればそれを使うと決める。設定が変われば refresh_preview が外す
+                if self.play_position == 0:
+                    self.use_preview = self.preview_audio is not None
+                preview = self.preview_audio
+                if self.use_preview and preview is not None:
+                    # 変換済みの音を出力側に直接流し、VC の入力には何も足さない（推論の負荷がかからない）
+                    preview.read(int(self.play_position), chunk)
+                    self.backend.sample_monitor_ring.push(chunk * self.backend.sample_amp)
+                    chunk = None
+                else:
+                    self.cs.read(int(self.play_position), chunk) # 終端より先は無音で埋まる
+                if remains <= frames:
+                    # 現ブロックを最後に再生が終わる
+                    reset_play_position = True
+                    self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Reached the last chunk (played {self.play_position} samples, {remains} remaining)")
+                else:
+                    self.play_position += frames # ブロック分だけヘッドを進める
 
             # 現ブロックを最後に再生が終わる場合のヘッド処理。
             # callback 内でサンプルを再ロードしたりスライダーを弄ったりする機能は、これ以降に組み込むこと
@@ -495,9 +602,6 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
                     self.play_position = int(0) # リピートする場合、ヘッドの 0 戻しだけ行う
                 
         else:
-            # 再生中でない場合は常に無音サンプルの送出
-            outdata[:] = copy.deepcopy(chunk0[:])
-
             # 選択中のファイル（ホストにコピーした名前）と再生中のサンプル名が異なったら、再生サンプルに反映させる必要
             # 再生中である場合は原則として、ヘッドが終端に達するこの瞬間にのみ self.sample を走らせる
             
@@ -508,38 +612,13 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
             if self.cs_name != self.file_audio_name:
                 self.logger.debug("Change samples from {} to {}".format(self.cs_name, self.file_audio_name))
                 self.player_panel._stop_sound() # サンプル切り替え前に、必ず再生を停止する。ヘッドも内部で 0 戻し
-                self.set_sample(self.file_audio_name, self.file_sec, self.file_audio_play)
+                self.set_sample(self.file_audio_name, self.file_sec, self.file_audio_play, file_path = self.file_audio_path)
                 self.remake_sldr() # 再生位置のスライダーを作り直す
                 self._update_btn_state() # ここにボタンの状態整合を手動で入れる必要がある
 
         # ここでスライダー表示をアップデートしていたが、 segmentation fault の原因になるため削除した。
         self.sldr_updatable = True # 最後に timer による update を可能に戻す
-
-
-    # さらに、VC 本体側の backend が OutputStream を作り直したときに、こちらも blocksize を変えて再作成する。
-    # トリガーとしては self.backend.sr_out と、こちらで保持している変数が一致しない場合。callback 内で判定させる。
-
-    def remake_stream(
-        self,
-    ):
-        self.terminate()
-        self.blocksize: int = copy.deepcopy(self.backend.blocksize) # 更新が必要
-        self.output_stream = sd.OutputStream(
-            samplerate = self.backend.sr_out, # scan() で作成される
-            channels = self.backend.n_ch_in_use[2], 
-            dtype = 'float32', # 'float32' and 'float64' use [-1.0, +1.0]. 'uint8' is an unsigned 8 bit format
-            blocksize = self.backend.blocksize, # 標準は 0  だが、だいたい 128 くらいになる。
-            callback = self.output_callback, # コールバックは backend ではなく、このクラス内で作る専用品
-        )
-        self.output_stream.start()
-    
-    
-    # ストリームを停止させる処理
-    def terminate(
-        self,
-    ) -> None:
-        self.output_stream.stop()
-        self.output_stream.close() 
+        return chunk
 
 
     # 指定した名称の config ファイルがない場合、作成する
@@ -560,23 +639,26 @@ class SampleManagerPanel(scrolled.ScrolledPanel):
                 config_list.append(slot_config)
             return config_list
 
-    # 本当はさらに、保存した self.sample_portfolio から次回アプリ起動時に状態を復元したい。でも
-    # 面倒くさいのでまだ実装していない。
-    
-    # なぜ面倒かというとファイルの移動・削除への対処を考慮する必要があり、しかもロード動作はかなり重い。
-    # なのでアプリの起動後に、バックグラウンドでロードさせる等の方策を検討しなければならない
-    # さらに、環境によっては 3 つ以上のサンプルをロードするとアプリが不安定になる。
+
+    # self.sample_portfolio の保存を予約する。スロット側で portfolio を書き換えたら、これを呼ぶ。
+    # 書き出しは backend の JsonWriter が別スレッドでまとめて行う（単体テスト用の backend では、その場で書く）
+    def save_portfolio(self):
+        json_writer = getattr(self.backend, "json_writer", None)
+        if json_writer is not None:
+            json_writer.schedule(self.sample_portfolio_path, self.sample_portfolio)
+        else:
+            write_json_atomic(self.sample_portfolio_path, self.sample_portfolio)
+
+    # 保存した self.sample_portfolio からの復元は、restore_slot = True のときにバックグラウンドで行う。
+    # 移動・削除されたファイルは飛ばすだけで、portfolio の記録は残す。
+    # なお、環境によっては 3 つ以上のサンプルをロードするとアプリが不安定になる。
     # また、ロード済みのサンプルを unload する処理をまだ実装していない
-    
-    # なので、自動で復元するのは諦め、ファイル選択のダイアログ初期値を前回ファイルにするのが落としどころでは
 
 
 ####
 
 # 以下は、player.py をスクリプトで実行するときだけ利用される独自の audio backend
 
-import queue
-
 class Backend(wx.Panel):
     def __init__(
         self, 
@@ -592,7 +674,8 @@ class Backend(wx.Panel):
         self.mic_mix: float = 0.5 # マイクからくる音と sample player からくる音のミックス比（1.0 でマイクのみ）
         self.sample_amp: float = 1.0 # sample player からくる音の音量を絞る
         self.blocksize = 2048*3
-        self.queueP = queue.Queue() # P は sample player -> InputStream のミックス用信号
+        self.sample_source = None # SampleManagerPanel が pull_block を登録する
+        self.sample_monitor = False
         self.sr_out: float = 44100 # 実は int だと librosa.resample でバグる
         self.sr_proc: float = 16000
         self.n_ch_in_use = [2, 1, 2]
@@ -618,8 +701,8 @@ class Backend(wx.Panel):
         if status:
             self.logger.debug(f"{status}")
         data_p = np.zeros((frames, self.n_ch_in_use[2])) # self.n_ch_in_use[0] が入力 ch 数
-        if self.queueP.empty() is False:
-            side_wav = self.queueP.get() # ここは wait が必要。でないとこちらの反応が速すぎてサンプルが落ちる
+        side_wav = self.sample_source(frames) if self.sample_source is not None else None
+        if side_wav is not None:
             for i in list(range(self.n_ch_in_use[2])):
                 data_p[:, i] = side_wav[: , i] * self.sample_amp # n_ch_in_use[0] = 2 だったら i = 0, 1 の 2 チャンネル分
         outdata[:] = data_p[:]
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import os
+import hashlib
+import tempfile
+import threading
+import logging
+import inspect
+
+import numpy as np
+
+from audio_io import open_audio_source, resampled_length, fill_resampled
+
+
+# サンプラーの試聴用の変換結果のキャッシュ。
+#   - 同じサンプルを同じスタイルと変換設定で何度も VC に通して聞く場合、毎回リアルタイムの推論を走らせる代わりに、
+#     1 回だけオフライン変換（OfflineWorker、リアルタイム側の負荷を優先して裏で進む）した結果を再生する
+#   - キーは「サンプルのファイルの内容 + 変換先スタイル + pitch_shift, absolute_pitch, estimate_energy
+#     + チェックポイント + 出力のサンプリング周波数と秒数」のハッシュ。いずれかが変われば別のキーになるので、
+#     古い変換結果は使われなくなる（LRU で消える）
+#   - 変換結果はデコーダのサンプリング周波数の一時 wav に書き、sr_out にリサンプルしながらキャッシュ（.npy）に書き込む。
+#     再生はそのメモリマップから行う
+#   - スタイルを入力から自動推定する設定（auto_encode）や、VC をバイパスしている間は使わない
+
+
+class SamplePreview:
+    def __init__(
+        self,
+        backend, # SoundControl。変換設定、変換先スタイル、OfflineWorker を借りる
+        cache, # FeatureCache（make_preview_cache）
+        model_paths = (), # キーに含めるチェックポイント
+        max_sec: float = 600.0, # 冒頭のこの秒数だけを変換する（再生用の音声と同じ長さ）
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.backend = backend
+        self.cache = cache
+        self.model_paths = tuple(path for path in model_paths if path is not None)
+        self.max_sec = max_sec
+        self.lock = threading.Lock()
+        self.pending = {} # ファイルパス → (キー, OfflineJob)。1 つのファイルにつき、最新のキーの変換だけを残す
+        self.ready = set() # 変換を終えてキャッシュに入ったキー
+        self.failed = set() # 変換に失敗したキー。同じ設定では積み直さない
+
+
+    # 現在の変換設定 {名前: 値} と変換先スタイル。試聴用の変換を使えない設定なら None
+    def current_settings(self):
+        efx = self.backend.efx_control
+        if self.backend.bypass or efx.auto_encode:
+            return None, None
+        settings = {
+            "auto_encode": False,
+            "pitch_shift": efx.pitch_shift,
+            "absolute_pitch": efx.absolute_pitch,
+            "estimate_energy": efx.estimate_energy,
+        }
+        return settings, np.array(self.backend.current_target_style, dtype = np.float32)
+
+
+    # サンプルの現在の設定でのキー。使えない設定なら None
+    def make_key(self, file_path: str):
+        settings, style = self.current_settings()
+        if settings is None:
+            return None
+        return self.cache.make_file_key(
+            file_path, 
+            self.model_paths, 
+            style = hashlib.sha256(style.tobytes()).hexdigest(),
+            sr = float(self.backend.sr_out),
+            max_sec = float(self.max_sec),
+            **{name: value for name, value in settings.items() if name != "auto_encode"},
+        )
+
+
+    # キャッシュにあれば (time, 1) の memmap を返す。無ければ None で、request なら変換を積む
+    def get(self, file_path: str, key: str, request: bool = True):
+        with self.lock:
+            job_pending = file_path in self.pending and self.pending[file_path][0] == key
+        if job_pending:
+            return None
+        hit = self.cache.get(key)
+        if hit is not None:
+            return hit["audio"]
+        if request:
+            self.request(file_path, key)
+        return None
+
+
+    # 変換を積む。同じファイルの古いキーの変換が残っていれば取り消す
+    def request(self, file_path: str, key: str):
+        settings, style = self.current_settings()
+        if settings is None:
+            return
+        with self.lock:
+            if key in self.failed:
+                return
+            if file_path in self.pending:
+                old_key, old_job = self.pending[file_path]
+                if old_key == key:
+                    return
+                old_job.cancel()
+            fd, tmp_path = tempfile.mkstemp(prefix = "preview_", suffix = ".wav")
+            os.close(fd)
+            job = self.backend.offline_worker.submit_preview(
+                file_path, 
+                tmp_path, 
+                style, 
+                settings, 
+                max_sec = self.max_sec, 
+                on_done = lambda job, key = key: self._finish(job, key),
+            )
+            self.pending[file_path] = (key, job)
+        self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Converting '{os.path.basename(file_path)}' for preview.")
+
+
+    # OfflineWorker のスレッドで呼ばれる。変換結果を sr_out にリサンプルしながらキャッシュに書き、一時ファイルを消す
+    def _finish(self, job, key: str):
+        try:
+            if job.status == "done":
+                source = open_audio_source(job.out_path)
+                try:
+                    sr_out = int(self.backend.sr_out)
+                    n = resampled_length(source, sr_out)
+                    entry = self.cache.put_streamed(
+                        key, {"audio": (n, 1)}, lambda arrays: fill_resampled(source, sr_out, arrays["audio"].reshape(-1)),
+                    )
+                finally:
+                    source.close()
+                if entry is not None:
+                    with self.lock:
+                        self.ready.add(key)
+                    self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Preview of '{os.path.basename(job.in_path)}' is ready ({n / sr_out:.1f} s).")
+            elif job.status == "failed":
+                with self.lock:
+                    self.failed.add(key)
+        finally:
+            with self.lock:
+                if self.pending.get(job.in_path, (None, None))[1] is job:
+                    del self.pending[job.in_path]
+            if os.path.exists(job.out_path):
+                os.remove(job.out_path)
+
+
+    # 変換が終わったキーか（GUI のタイマーから、キャッシュを見に行く前の確認に使う）
+    def is_ready(self, key: str) -> bool:
+        with self.lock:
+            return key in self.ready
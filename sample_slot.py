@@ -17,11 +17,8 @@
 # ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
 
 import wx
-import librosa
-from pydub import AudioSegment
 
 import os
-import json
 import copy
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg
 import numpy as np
@@ -33,6 +30,7 @@ import logging
 import inspect
 
 from utils import plot_spectrogram_harmof0, plot_embedding_cube, truncate_string
+from gui_scheduler import start_update_timer, PRIORITY_PLOT
 
 
 class ImageDropTarget(wx.FileDropTarget):
@@ -41,16 +39,23 @@ class ImageDropTarget(wx.FileDropTarget):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.host = host # host というのは AudioSlotPanel インスタンスのこと
 
+    # 複数のファイルをドロップした場合は、ドロップ先のスロットから順に後ろのスロットへ割り当て、まとめてロードする
     def OnDropFiles(self, x, y, filenames):
         try:
-            file_path = filenames[0]
-            if file_path.lower().endswith(('.wav', '.ogg', '.mp3', '.m4a', '.flac', '.opus')):
-                self.host.current_file_path_raw = file_path
-                # OS 依存のパス区切り文字を修正。なおドライブレター等はうまく処理できない
-                self.host.current_file_path = self.host.current_file_path_raw.replace('/', self.host.os_sep).replace('\\', self.host.os_sep) 
-                self.logger.debug(f"({inspect.currentframe().f_code.co_name}) selecting... {self.host.current_file_path}")
-                # ファイルをロードしてメモリ上の変数に格納するところまで実行
-                self.host.load_file(self.host.current_file_path, self.host.manager.sr_out, self.host.manager.sr_proc) 
+            file_paths = [path for path in filenames if path.lower().endswith(('.wav', '.ogg', '.mp3', '.m4a', '.flac', '.opus'))]
+            if len(file_paths) > 0:
+                manager = self.host.manager
+                slots = manager.slot_list[self.host.slot_index:self.host.slot_index + len(file_paths)]
+                with manager.sample_loader.group():
+                    for slot, file_path in zip(slots, file_paths):
+                        slot.current_file_path_raw = file_path
+                        # OS 依存のパス区切り文字を修正。なおドライブレター等はうまく処理できない
+                        slot.current_file_path = slot.current_file_path_raw.replace('/', slot.os_sep).replace('\\', slot.os_sep) 
+                        self.logger.debug(f"({inspect.currentframe().f_code.co_name}) selecting... {slot.current_file_path}")
+                        # ファイルをロードしてメモリ上の変数に格納するところまで実行
+                        slot.load_file(slot.current_file_path, manager.sr_out, manager.sr_proc) 
+                if len(file_paths) > len(slots):
+                    self.logger.debug(f"({inspect.currentframe().f_code.co_name}) {len(file_paths) - len(slots)} files were ignored (no more slots).")
                 return True
             else:
                 wx.MessageBox("Unsupported file format. Please drop an audio file (wav, ogg, mp3).", "Error", wx.OK | wx.ICON_ERROR)
@@ -77,6 +82,9 @@ class AudioSlotPanel(wx.Panel):
         self.os_sep = os.path.sep # 現在の OS で有効なパス区切り文字
         
         self.is_file_loaded = False # まず file load されていない状態で初期化
+        self.load_job = None # バックグラウンドでのロード中は SampleLoadJob が入る
+        self.loaded_job = None # 最後に反映した SampleLoadJob
+        self.file_audio_name = None
         
         # アクティブにするか（VC 用のスタイル埋め込み計算に反映させるか）のチェックボックス
         self.is_active_checkbox = wx.CheckBox(self, wx.ID_ANY, '')
@@ -162,9 +170,8 @@ class AudioSlotPanel(wx.Panel):
         self.SetDropTarget(ImageDropTarget(self))
 
         # self.update は作成済みのプロットを再描画する。
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(57) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, 57, priority = PRIORITY_PLOT)
 
         self.logger.debug(f"({inspect.currentframe().f_back.f_code.co_name}) AudioSlotPanel {self.slot_index} was initialized.")
     
@@ -173,6 +180,9 @@ class AudioSlotPanel(wx.Panel):
         if hasattr(self, 'canvas_spec') and self.canvas_spec is not None:
             self.canvas_spec.draw()
 
+        if self.load_job is not None and self.load_job.active:
+            self.update_file_label(self.file_audio_name) # ロードの進捗を表示する
+
         if self.is_file_loaded is False:
             self.export_btn.Hide()
             self.label_export_sizer.Hide(self.mix_coef_sizer, recursive = True)
@@ -219,16 +229,22 @@ class AudioSlotPanel(wx.Panel):
 
 
     # 選択したファイルを実際にロードする
+    # デコード、リサンプル、埋め込み計算は manager の sample_loader がバックグラウンドで行い、終わったら GUI スレッドで
+    # finish_load が呼ばれる。その間 self.load_job が進捗を持ち、ラベルに表示される。
     # 音声のロードに成功すれば self.is_file_loaded = True になり、self.file_sec に有効値が入る
-    # ただし音声は self.file_audio_store/play に格納され、まだ実際の再生サンプル self.manager.cs には反映されない。
-    # 再生中に実行された場合の安全のため、self.load_file までは自動的に実行され self.file_audio_store が更新されるが、
+    # ただし音声は self.file_audio_play に格納され、まだ実際の再生サンプル self.manager.cs には反映されない。
+    # 再生中に完了した場合の安全のため、self.file_audio_play までは自動的に更新されるが、
     # self.manager.cs 変数の実際の書き換えは self.manager.playing == False の場合しか実行できないようにする。
+    # なお self.file_audio_play は通常サンプルのキャッシュのメモリマップで、スロットは音声の実体をメモリに持たない。
+    # 埋め込み計算用の 16 kHz の音声は、計算が終わった時点で捨てる
 
     def load_file(
         self,
         file_path, # select_file() が走った状態なので、file_path の指す内容は有効な音声ファイルのはず。
         sr_out: float,
         sr_proc: float,
+        restore: bool = False, # 起動時に portfolio から復元する場合
+        style_hint: dict = None, # 復元時に、portfolio に記録されたスタイルのキャッシュのキーとファイルの状態
     ):
         if file_path is not None:
             self.is_file_loaded = False # まず file load されていない状態に戻す
@@ -236,82 +252,100 @@ class AudioSlotPanel(wx.Panel):
             # サンプルを変える場合、再生を停止する。ヘッドも内部で 0 戻しされる
             if self.manager.playing:
                 self.manager._stop_sound() 
-            try:
-                # soundfile をロードしたら 2 種類のバッファに保存する。リサンプリングは time last が必要。
-                # sf は返り値は channel last だが、librosa は timel last なので注意
-                file_audio_raw, file_orig_fs = self.read_audio(
-                    file_path, 
-                    max_sec = self.manager.max_sec,
-                ) # (time, channel)
-                self.file_audio_name = os.path.basename(file_path)
-                # sf.read を使う場合、以下が shape[0] を使うようになる
-                self.file_sec: float = file_audio_raw.shape[1] / file_orig_fs # 単位：秒
-                
-                # TODO ここは重い処理なので、実際には threading を使って非同期化し、その間に「変換中」の画面表示を出すべき
-
-                # 再生用のバッファに保存 self.manager.sr_out (44100 Hz) で作る
-                self.file_audio_play = librosa.resample(
-                    file_audio_raw,  # time last の状態で音声をリサンプルする
-                    orig_sr = file_orig_fs, 
-                    target_sr = sr_out,
-                    res_type = "polyphase",
-                    axis = -1,
-                ).T # 再生サンプルは channel last で保持する
-                
-                # embedding 計算用のバッファに保存 self.manager.sr_proc (16000 Hz) で作る
-                self.file_audio_store = librosa.resample(
-                    file_audio_raw,  # time last の状態で音声をリサンプルする
-                    orig_sr = file_orig_fs, 
-                    target_sr = sr_proc,
-                    res_type = "polyphase",
-                    axis = -1,
-                ) # 加工用サンプルは time last で保持する
-
-                self.calculate_embedding() # ロードしたら、さっそく embedding を計算する。self.style が作成される
-                self.plot_embedding() # embedding が計算できたら、plot に反映する
-                self.is_active_checkbox.Enable() # さらに、アクティブスロットのチェックボックスを選択状態にする
+            if self.load_job is not None:
+                self.load_job.cancel() # 前のロードがまだ終わっていなければ捨てる
+            self.file_audio_name = os.path.basename(file_path)
+            self.load_job = self.manager.sample_loader.submit(
+                self, 
+                file_path, 
+                sr_out, 
+                sr_proc, 
+                self.manager.max_sec, 
+                restore = restore,
+                style_hint = style_hint,
+            )
+        else:
+            pass # 有効なファイルパスを与えない場合は何もしない（通常はファイルが選択される前提であり、このルートには入らない）
+
+        self.update_file_label(self.file_audio_name)
+        self.Refresh()
+
+
+    # sample_loader のワーカーがロードを終えたときに、GUI スレッドで呼ばれる
+    def finish_load(
+        self,
+        job, # SampleLoadJob
+    ):
+        if job is not self.load_job or job.status == "cancelled":
+            return # 後から別のファイルが選ばれた
+        self.load_job = None
+        self.loaded_job = job
+
+        if job.status == "done":
+            self.file_audio_play = job.file_audio_play # 再生サンプルは channel last で保持する
+            self.file_sec: float = job.file_sec # 単位：秒
+            self.real_F0, self.activation, self.spectrogram, self.style = job.real_F0, job.activation, job.spectrogram, job.style
+            # スタイルを求めた窓ごとのスタイルと (開始秒, 有声フレームの割合, 重み)。長いファイルでなければ 1 窓だけ
+            self.window_styles, self.window_info = job.window_styles, job.window_info
+            if job.source_sec > self.file_sec:
+                self.logger.debug(
+                    f"({inspect.currentframe().f_code.co_name}) Style of '{self.file_audio_name}' was aggregated from "
+                    f"{self.window_styles.shape[0]} voiced windows ({job.source_sec:.1f} s in total, {self.file_sec:.1f} s loaded for playback)"
+                )
+            self.plot_embedding() # embedding が計算できたら、plot に反映する
+            self.is_active_checkbox.Enable() # さらに、アクティブスロットのチェックボックスを選択状態にする
+            if job.restore:
+                self.is_active_checkbox.SetValue(self.manager.sample_portfolio[self.slot_index].get("is_active", True))
+            else:
                 self.is_active_checkbox.SetValue(True)
 
-                # サンプル一覧を更新＆ファイル保存。現在、保存先ファイル名はハードコーディングされている
-                try:
-                    # 絶対パスから相対パスに変換。絶対パスを json に残すと個人情報保護や複数マシン間での共有にリスク
-                    rel_path = os.path.relpath(file_path, os.getcwd()) 
-                    # ファイルを開くたびに config ファイルを更新する
-                    self.manager.sample_portfolio[self.slot_index]["last_selected_file"] = rel_path
-                    self.manager.sample_portfolio[self.slot_index]["is_active"] = True
-                    self.manager.sample_portfolio[self.slot_index]["mix_coef"] = self.manager.mix_coef_list[self.slot_index]
-                    self.manager.sample_portfolio[self.slot_index]["embedding"] = self.style.tolist()
-
-                    # サンプルロードに伴い、自動的にサンプル一覧のファイルが保存される
-                    # これ、他の場所からも呼び出すと思うので、manager 側に保存メソッドとして書き出した方がいいだろう
-                    with open(self.manager.sample_portfolio_path, 'w') as f:
-                        json.dump(self.manager.sample_portfolio, f, indent = 4)
-                    self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Sample portfolio was updated: '{self.manager.sample_portfolio_path}'")
-                except:
-                    self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Failed to update the sample portfolio.")
-                
+            # サンプル一覧を更新＆ファイル保存。現在、保存先ファイル名はハードコーディングされている
+            try:
+                # 絶対パスから相対パスに変換。絶対パスを json に残すと個人情報保護や複数マシン間での共有にリスク
+                rel_path = os.path.relpath(job.file_path, os.getcwd()) 
+                # ファイルを開くたびに config ファイルを更新する
+                self.manager.sample_portfolio[self.slot_index]["last_selected_file"] = rel_path
+                self.manager.sample_portfolio[self.slot_index]["is_active"] = self.is_active_checkbox.GetValue()
+                self.manager.sample_portfolio[self.slot_index]["mix_coef"] = self.manager.mix_coef_list[self.slot_index]
+                self.manager.sample_portfolio[self.slot_index]["embedding"] = self.style.tolist()
+                # 次回の復元で、ファイルが変わっていなければスタイルを計算し直さずにキャッシュから読むための記録
+                self.manager.sample_portfolio[self.slot_index]["style_key"] = job.style_key
+                self.manager.sample_portfolio[self.slot_index]["file_stat"] = job.file_stat
+
+                # サンプルロードに伴い、自動的にサンプル一覧のファイルが保存される
+                # 書き出し自体は manager 経由で別スレッドに任せる
+                self.manager.save_portfolio()
+                self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Sample portfolio save was scheduled: '{self.manager.sample_portfolio_path}'")
+            except:
+                self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Failed to update the sample portfolio.")
+
+            self.is_file_loaded = True # ファイルロードの完了フラグ
+
+            # 起動時の復元では、再生サンプルは差し替えない（スロットをクリックすれば再生サンプルになる）
+            if not job.restore:
                 # 音声のロードに成功したら、ホスト側にも選択ファイルとして登録する。
                 self.manager.file_audio_name = copy.deepcopy(self.file_audio_name)
                 self.manager.file_sec = copy.deepcopy(self.file_sec)
                 self.manager.file_audio_play = self.file_audio_play
+                self.manager.file_audio_path = job.file_path
 
                 # さらに self.manager.playing == False の場合のみ、manager における実際の再生サンプルの反映まで行う。
-                # もし True だったら、再生中のサンプルの末尾に達した瞬間に callback から評価させる
+                # もし True だったら、再生が止まった後に callback から評価させる
                 # （ホストにおいて self.file_audio_name と self.cs_name が異なることがフラグとなる）
-                self.manager.set_sample(self.file_audio_name, self.file_sec, self.file_audio_play) # サンプル反映
-                self.manager.remake_sldr() # 再生位置スライダーを再作成する
-                # （初期化時は手動で部品を作るのでここを使わない）
-
-                self.is_file_loaded = True # ファイルロードの完了フラグ
-            except:
-                self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Failed to load the audio sample {file_path}")
+                if not self.manager.playing:
+                    self.manager.set_sample(self.file_audio_name, self.file_sec, self.file_audio_play, file_path = job.file_path) # サンプル反映
+                    self.manager.remake_sldr() # 再生位置スライダーを再作成する
+        else:
+            self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Failed to load the audio sample {job.file_path}: {job.error}")
+            if not job.restore:
                 # 対応する音声が存在しない／正常にロードできない場合は config file をリネームして末尾に ".bak" を付加
                 ex_config_name = self.manager.sample_portfolio_path.replace('.json', '.json.bak')
-                os.rename(self.manager.sample_portfolio_path, ex_config_name)
-                self.logger.debug(f"({inspect.currentframe().f_code.co_name}) {self.manager.sample_portfolio_path} was renamed to {ex_config_name}")
-        else:
-            pass # 有効なファイルパスを与えない場合は何もしない（通常はファイルが選択される前提であり、このルートには入らない）
-        
+                try:
+                    os.replace(self.manager.sample_portfolio_path, ex_config_name)
+                    self.logger.debug(f"({inspect.currentframe().f_code.co_name}) {self.manager.sample_portfolio_path} was renamed to {ex_config_name}")
+                except OSError:
+                    pass
+
         # ファイルロード試行の後、選択中のファイルを示すラベル文字列を更新する
         # 正確に言うと、ロードした音声の embedding 計算／プロットに失敗してもファイル名は更新される。一応これは仕様である。
         self.update_file_label(self.file_audio_name)
@@ -321,36 +355,12 @@ class AudioSlotPanel(wx.Panel):
         self.manager.SetupScrolling()  # スクロール設定を再度適用
 
 
-    def read_audio(
-        self, 
-        file_path: str, 
-        max_sec: float = 16.0,
-    ):
-        _, file_extension = os.path.splitext(file_path) # 拡張子はドット . を含む
-
-        if file_extension.lower() in ['.wav', '.flac', '.ogg']:
-            audio, sr = librosa.load(file_path, sr = None, mono = True, duration = max_sec)
-            if audio.ndim == 1:
-                audio = audio[np.newaxis, :]
-            return audio.astype('float32'), int(sr)
-
-        elif file_extension.lower() in ['.mp3', '.m4a', '.opus']:
-            audio = AudioSegment.from_file(file_path)
-            sr = audio.frame_rate
-            audio = audio.set_channels(1) if audio.channels == 2 else audio  # Ensure mono audio
-            audio = audio.set_sample_width(2)    # Set sample width to 16-bit (adjust as needed)
-        
-            if max_sec < len(audio) / 1000:
-                audio = audio[:max_sec * 1000] # 操作はミリ秒単位で実施する必要がある
+    # 復元時にキャッシュから読んだスタイルが、後の検証で古いと分かった場合に sample_loader から呼ばれる。
+    # その後に別のファイルが選ばれていなければ、キャッシュを使わずにロードし直す
+    def reload_if_current(self, job):
+        if self.loaded_job is job and self.load_job is None:
+            self.load_file(job.file_path, job.sr_out, job.sr_proc, restore = True)
 
-            audio = audio.get_array_of_samples()
-            audio = np.array(audio, dtype = 'float32') / 32768.0  # Normalize to float32
-            if audio.ndim == 1:
-                audio = audio[np.newaxis, :]
-
-            return audio, int(sr)  # Assume 16kHz sample rate for pydub
-        else:
-            raise ValueError(f"Unsupported file extension: {file_extension}")
 
     # スロットが選択中であるファイルのラベルをセットする。なおテキストエリアのサイズは最初に十分量を確保して固定
     def update_file_label(
@@ -360,7 +370,11 @@ class AudioSlotPanel(wx.Panel):
         self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Updating file label")
 
         if hasattr(self, 'current_file_label'):
-            if self.is_file_loaded:
+            if self.load_job is not None and self.load_job.active:
+                # バックグラウンドでロード中
+                text = f"\nLoading audio file:\n{truncate_string(file_name, max = 23)}\n{self.load_job.progress * 100:.0f} %"
+                tooltip_text = f"'{file_name}'\nLoading..."
+            elif self.is_file_loaded:
                 text = f"\nLoaded audio file:\n{truncate_string(file_name, max = 23)}\n" # ロード完了フラグが立っている場合
                 tooltip_text = f"'{file_name}'\nClick: activate, Right-click: deactivate"
             else:
@@ -371,7 +385,7 @@ class AudioSlotPanel(wx.Panel):
         self.root_sizer.Layout()
 
 
-    # TODO portfolio の保存は複数回呼び出されるので、部品化してホストに置くべき
+    # portfolio の保存は manager.save_portfolio に予約するだけなので、チェックやスライダーのたびに呼んでよい
     
     def on_active_checkbox_click(self, event):
         if self.is_active_checkbox.GetValue() == True:
@@ -379,9 +393,8 @@ class AudioSlotPanel(wx.Panel):
         else:
             self.manager.sample_portfolio[self.slot_index]["is_active"] = False
         try:
-            with open(self.manager.sample_portfolio_path, 'w') as f:
-                json.dump(self.manager.sample_portfolio, f, indent = 4)
-            self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Sample portfolio was updated: '{self.manager.sample_portfolio_path}'")
+            self.manager.save_portfolio()
+            self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Sample portfolio save was scheduled: '{self.manager.sample_portfolio_path}'")
         except:
             self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Failed to update the sample portfolio.")
         event.Skip(False)
@@ -396,31 +409,12 @@ class AudioSlotPanel(wx.Panel):
         self.manager.mix_coef_list[self.slot_index] = self.mix_coef_sldr.GetValue() / self.mix_coef_sldr_mult 
         self.manager.sample_portfolio[self.slot_index]["mix_coef"] = self.manager.mix_coef_list[self.slot_index]
         try:
-            with open(self.manager.sample_portfolio_path, 'w') as f:
-                json.dump(self.manager.sample_portfolio, f, indent = 4)
-            self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Sample portfolio was updated: '{self.manager.sample_portfolio_path}'")
+            self.manager.save_portfolio()
+            self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Sample portfolio save was scheduled: '{self.manager.sample_portfolio_path}'")
         except:
             self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Failed to update the sample portfolio.")
         event.Skip(False)
 
-    # TODO portfolio の保存は複数回呼び出されるので、部品化してホストに置くべき
-
-    # 選択中のオーディオデータのスタイル埋め込みを計算する。なお、末尾（時間）次元は 4 の倍数でないと動作しない
-    def calculate_embedding(self):
-        self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Calculating embedding")
-        self.real_F0, self.activation, self.real_N, self.spectrogram = self.manager.sess_HarmoF0.run(
-            ['freq_t', 'act_t', 'energy_t', 'spec'], 
-            {"input": self.file_audio_store},
-        )
-        # 末尾（時間）次元を 4 の倍数に切り詰める
-        self.spec_size_by_four = (self.spectrogram.shape[-1] // 4) * 4
-        self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Spectrogram for SE: {self.spectrogram[:, np.newaxis, 48:, :self.spec_size_by_four].shape}")
-
-        self.style = self.manager.sess_SE.run(
-            ['output'], 
-            {'input': self.spectrogram[:, np.newaxis, 48:, :self.spec_size_by_four]},
-        )[0]
-
 
     # 選択中のオーディオデータのスタイル埋め込みをプロットする。
     def plot_embedding(self):
@@ -531,9 +525,8 @@ class ResultEmbeddingPanel(wx.Panel):
         self.SetSizer(self.root_sizer) 
 
         # self.update は作成済みのプロットを再描画する
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(99) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, 99, priority = PRIORITY_PLOT)
 
         self.logger.debug(f"({inspect.currentframe().f_back.f_code.co_name}) Initialized.")
     
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import threading
+
+import numpy as np
+
+
+# VC エンジン（オーディオスレッド）が書き込むバッファを、GUI 側がコピーなしで・書き込み途中の状態を見ずに読むための仕組み。
+
+# エンジンのバッファ（buf_spec_p など）は np.roll で毎回作り直した後にスライス代入しているため、
+# GUI から getattr で取ると「ロール済みだが最新フレーム未代入」の瞬間を掴む可能性があり、
+# かといって毎回 deepcopy すると (ch, 352, 400) を丸ごと複製することになる。
+
+# FrameSnapshot は時間軸（末尾次元）のリングバッファとシーケンス番号を持つ seqlock である。
+#   - 書き手は 1 人（オーディオスレッド）。書き込み中は seq が奇数、書き終わると偶数になる
+#   - 読み手は seq が偶数かつ読み取り前後で変化しなかった場合だけ結果を採用し、そうでなければ読み直す
+#   - 読み手は前回以降に書き換わったフレームだけを受け取るので、コピー量は 1 回の更新分で済む
+
+class FrameSnapshot:
+    def __init__(
+        self,
+        initial, # (..., n_frame) の time last 配列。形状とリングの長さは最初に与えたものに固定される
+    ):
+        initial = np.asarray(initial)
+        self.capacity = initial.shape[-1]
+        self.ring = np.array(initial, copy = True)
+        # 各列（フレーム）を最後に書いた publish の通し番号。読み手が「どこから変わったか」を知るために使う
+        self.stamp = np.zeros(self.capacity, dtype = np.int64)
+
+        self.seq = 0 # seqlock の番号（奇数の間は書き込み中）
+        self.serial = 0 # publish の通し番号
+        self.n_written = self.capacity # 起動時からの総フレーム数（初期値の分も数える）
+        self.write_lock = threading.Lock() # 書き手が 1 人なら不要だが、念のため書き手同士だけは排他する
+
+
+    # frames (..., w) をリング末尾に書き込み、時間を n_new フレーム進める。
+    # w > n_new の場合、直近 (w - n_new) フレームは上書き（substitute_all_for_* の場合に相当）
+    def publish(
+        self,
+        frames,
+        n_new: int = None,
+    ):
+        w = min(frames.shape[-1], self.capacity)
+        n_new = w if n_new is None else min(n_new, self.capacity)
+        if w == 0 and n_new == 0:
+            return
+
+        with self.write_lock:
+            self.seq += 1 # 書き込み開始（奇数）
+            self.serial += 1
+            end = self.n_written + n_new # 書き込み後の総フレーム数
+            if n_new > w:
+                # 時間だけ進んで中身がない区間は、リングに 1 周前の内容が残らないよう最初のフレームで埋める
+                gap = np.arange(self.n_written, end - w) % self.capacity
+                self.ring[..., gap] = frames[..., :1] if w > 0 else self.ring[..., gap]
+                self.stamp[gap] = self.serial
+            if w > 0:
+                idx = np.arange(end - w, end) % self.capacity
+                self.ring[..., idx] = frames[..., -w:]
+                self.stamp[idx] = self.serial
+            self.n_written = end
+            self.seq += 1 # 書き込み終了（偶数）
+
+
+    # 読み手を作る。読み手ごとに「どこまで読んだか」を持つ
+    def subscribe(self):
+        return SnapshotReader(self)
+
+
+class SnapshotReader:
+    def __init__(
+        self,
+        source: FrameSnapshot,
+    ):
+        self.source = source
+        self.serial = -1 # 最初の read では全フレームを返す
+        self.n_read = None
+
+
+    # 前回以降に変化したフレームを返す。戻り値は (frames, n_scroll) で、
+    #   frames: 変化した末尾の (..., k) 配列。時間順に並んだ読み取り専用のコピー（k はリング長以下）
+    #   n_scroll: 前回から時間が何フレーム進んだか。描画側はこの分だけスクロールしてから末尾 k 列を描き直せばいい
+    def read(
+        self,
+        max_retry: int = 8,
+    ):
+        src = self.source
+        for _ in range(max_retry):
+            seq0 = src.seq
+            if seq0 % 2 == 1:
+                continue # 書き込み中
+            n_written = src.n_written
+            serial = src.serial
+            k = int(np.count_nonzero(src.stamp > self.serial)) # 書き込みは常に末尾なので、変化した列は末尾に連続する
+            idx = np.arange(n_written - k, n_written) % src.capacity
+            frames = src.ring[..., idx] # fancy index なので、ここで必要な列だけがコピーされる
+            if src.seq == seq0:
+                break
+        else:
+            return None, 0 # 書き込みが続いて読めなかった場合は、今回は諦めて次回に回す
+
+        n_scroll = src.capacity if self.n_read is None else min(n_written - self.n_read, src.capacity)
+        self.serial = serial
+        self.n_read = n_written
+        frames.setflags(write = False)
+        return frames, n_scroll
+
+
+    # 手元に持っている time last の配列 dst を、前回以降の変化分だけ更新する（スクロール＋末尾の書き換え）。
+    # dst の時間長はリングと違っていてもいい。channel を指定すると、そのチャンネルだけを (1, ...) として書き込む
+    # 変化がなければ None を、あれば (スクロール量, 書き換えた末尾の列数) を返す
+    def update(
+        self,
+        dst,
+        channel: int = None,
+    ):
+        frames, n_scroll = self.read()
+        if frames is None or (frames.shape[-1] == 0 and n_scroll == 0):
+            return None # 変化なし
+        if channel is not None:
+            frames = frames[channel:channel+1]
+
+        n = dst.shape[-1]
+        if n_scroll >= n:
+            pass # 全体が入れ替わるので、スクロールは不要
+        elif n_scroll > 0:
+            dst[..., :-n_scroll] = dst[..., n_scroll:] # 重なりのある代入だが NumPy が正しく処理する
+        k = min(frames.shape[-1], n)
+        if k > 0:
+            dst[..., -k:] = frames[..., -k:]
+        return min(n_scroll, n), k
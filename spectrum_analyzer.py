@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+import math
+import functools
+
+import numpy as np
+
+
+# 表示専用の軽量スペクトログラム解析器。
+# HarmoF0 と同じ 352 bins, 48 bins/octave の対数周波数軸を、NumPy の STFT ＋ 固定フィルタバンクで近似する。
+# ピッチや energy は計算しないので VC 本体の入力には使えないが、出力音声のモニタ表示には十分である。
+
+# フィルタバンクは (sr, n_fft, fmin, n_bins, bins_per_octave) が同じなら使い回せるのでキャッシュする
+
+@functools.lru_cache(maxsize = 8)
+def make_log_filterbank(
+    sr: int = 16000,
+    n_fft: int = 2048,
+    fmin: float = 27.5,
+    n_bins: int = 352,
+    bins_per_octave: int = 48,
+):
+    # 各 bin の中心周波数。HarmoF0 と同じく fmin * 2^(k/48) で、k = 351 が spec_fmax に一致する
+    freqs_center = fmin * 2.0**(np.arange(n_bins) / bins_per_octave)
+    freqs_fft = np.arange(n_fft // 2 + 1) * sr / n_fft
+
+    # 三角窓の半値幅は constant-Q の帯域幅とするが、FFT の周波数分解能より狭くはできない。
+    # 低域では隣接する FFT bin の補間になるので、分解能自体は HarmoF0 に劣る（表示用なので割り切る）
+    half_width = np.maximum(freqs_center * (2.0**(1.0 / bins_per_octave) - 1), sr / n_fft)
+    fb = 1.0 - np.abs(freqs_fft[np.newaxis, :] - freqs_center[:, np.newaxis]) / half_width[:, np.newaxis]
+    fb = np.clip(fb, 0.0, None)
+    fb /= fb.sum(axis = 1, keepdims = True) # 各 bin の重みの和を 1 にして、帯域幅による音量差をなくす
+    fb = fb.astype(np.float32)
+    fb.setflags(write = False) # キャッシュを共有するので書き換え禁止
+    return fb # (n_bins, n_fft//2 + 1)
+
+
+class LogSpecAnalyzer:
+    def __init__(
+        self,
+        sr: int = 16000,
+        hop_size: int = None, # None なら HarmoF0 と同じ 10 ms hop になるように sr から決める
+        n_fft: int = None, # None なら約 128 ms 以上の 2 のべき乗
+        fmin: float = 27.5,
+        n_bins: int = 352,
+        bins_per_octave: int = 48,
+        n_channel: int = 1,
+        db_offset: float = 40.0, # HarmoF0 の表示レンジ (-50, 40) に概ね揃えるための経験的なオフセット
+        db_floor: float = -50.0, # buf_spec_* の初期値や PlotSpecPanel の v_range[0] と同じ
+    ):
+        self.sr = sr
+        self.hop_size = hop_size if hop_size is not None else sr // 100
+        self.n_fft = n_fft if n_fft is not None else 2**math.ceil(math.log2(sr * 0.128))
+        self.fmin = fmin
+        self.n_bins = n_bins
+        self.bins_per_octave = bins_per_octave
+        self.n_channel = n_channel
+        self.db_offset = db_offset
+        self.db_floor = db_floor
+
+        self.filterbank = make_log_filterbank(sr, self.n_fft, fmin, n_bins, bins_per_octave)
+        self.window = np.hanning(self.n_fft).astype(np.float32)
+        # フルスケールの正弦波が 0 dB になるように、窓関数の振幅を正規化する係数（パワーなので 2 乗）
+        self.power_norm = np.float32((2.0 / self.window.sum())**2)
+
+        self.reset()
+
+
+    # ストリームの状態（前回呼び出し時に使い残したサンプル）を消す
+    def reset(self):
+        # 最初のフレームが揃うまでは無音として扱う
+        self.tail = np.zeros((self.n_channel, self.n_fft - self.hop_size), dtype = np.float32)
+        self.next_head = None # 次に到着するはずの信号の先頭位置（呼び出し側のサンプル番号）
+
+
+    # 新しく到着した (channel, time) の信号を受け取り、確定したフレームだけを (channel, n_bins, n_frames) で返す。
+    # 呼び出しごとのブロック境界には依存しない（端数サンプルは次回に持ち越す）
+    def process(
+        self,
+        x,
+        head: int = None, # x の先頭のサンプル番号。前回の続きでなければ状態を捨ててから処理する
+    ):
+        if head is not None:
+            if self.next_head is not None and head != self.next_head:
+                self.reset()
+            self.next_head = head + x.shape[1]
+
+        buf = np.concatenate((self.tail, np.asarray(x, dtype = np.float32)), axis = 1)
+        n_frames = (buf.shape[1] - self.n_fft) // self.hop_size + 1
+        if n_frames <= 0:
+            self.tail = buf
+            return np.zeros((buf.shape[0], self.n_bins, 0), dtype = np.float32)
+
+        frames = np.lib.stride_tricks.sliding_window_view(buf, self.n_fft, axis = 1)[:, ::self.hop_size][:, :n_frames]
+        stft = np.fft.rfft(frames * self.window, axis = -1) # (channel, n_frames, n_fft//2 + 1)
+        power = (stft.real**2 + stft.imag**2).astype(np.float32)
+        spec = np.matmul(power, self.filterbank.T) # (channel, n_frames, n_bins)
+        spec = 10 * np.log10(spec * self.power_norm + 1e-10) + self.db_offset
+        spec = np.maximum(spec, self.db_floor)
+
+        self.tail = buf[:, n_frames * self.hop_size:]
+        return spec.transpose(0, 2, 1) # HarmoF0 の spec と同じ time last
+
+    def __call__(
+        self,
+        x,
+    ):
+        return self.process(x)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+# リアルタイム経路（AudioEfx.inference をブロックごとに呼ぶ）とオフライン経路（convert_offline）の出力を比べ、
+# ストリーミング設定ごとの品質、ブロックあたりの計算時間、遅延を表にする。GUI もオーディオデバイスも使わない。
+#
+# 例:
+#   python stream_benchmark.py ./refs/*.wav --grid len_proc=20,30,40 --grid cross_fade_samples=0,352 --workers 2
+#   python stream_benchmark.py ./refs/a.wav --grid content_expand_rate=0,0.1,0.2 --grid substitute_all_for_content=true,false --csv result.csv
+#
+# 指標（いずれもオフライン変換の出力を基準とし、小さいほど良い）:
+#   lsd      対数スペクトル距離 (dB)。フレームごとの dB 差の二乗平均平方根を、全フレームで平均したもの
+#   f0_rmse  両方で有声と判定されたフレームの F0 の差の二乗平均平方根 (cent)。F0 は HarmoF0 で求める
+#   boundary ブロックの継ぎ目付近の 1 次差分のエネルギーが、それ以外の区間に比べて何 dB 大きいか
+# 計算時間は AudioEfx.vc_lap の平均と p95 (ms)、rtf は p95 をブロック長で割ったもの。
+# latency はアルゴリズム上の遅延（blocksize + cross_fade_samples + retro_samples）で、デバイスとキューの遅延は含まない。
+# 並列に走らせると計算時間は互いに干渉するので、計算時間を詰めて比べる場合は --workers 1 とすること。
+#
+# 変換先スタイルは両経路で同じものに固定する（--style を省略すると、各ファイル全体からオフラインで推定したスタイル）。
+# VC の ON/OFF を決める入力レベルの判定は通さず、すべてのブロックを VC に掛ける。
+
+import os
+import sys
+import copy
+import glob
+import csv
+import json
+import time
+import itertools
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import logging
+
+import numpy as np
+
+from config_manager import load_make_app_config, load_make_vc_config
+
+
+class HeadlessBackend:
+    """
+    AudioEfx が参照する SoundControl の属性だけを持つ、オーディオデバイスなしの backend
+    """
+    def __init__(
+        self,
+        vc_config,
+        sr_out: int = 48000,
+        style = None, # (1, 128)
+    ):
+        self.vc_config = vc_config
+        self.sr_out = sr_out
+        self.sr_proc = vc_config["backend"]["sr_proc"]
+        self.block_roll_size = vc_config["backend"]["block_roll_size"]
+        self.blocksize = int(self.block_roll_size * 0.02 * self.sr_out) # SoundControl と同じ計算
+        self.content_expand_rate = vc_config["content_expand_rate"]
+        self.n_ch_in_use = [1, 1, 1]
+        self.current_target_style = style
+        self.active_tab = -1 # 出力スペクトログラム（モニタータブ用）を計算させない
+        self.host = self
+
+
+    def GetTopLevelParent(self):
+        return self
+
+
+#### 指標
+
+
+def log_spectral_distance(a, b, n_fft: int = 1024, hop: int = 256):
+    import librosa
+    n = min(a.shape[0], b.shape[0])
+    A = np.abs(librosa.stft(a[:n], n_fft = n_fft, hop_length = hop)) ** 2
+    B = np.abs(librosa.stft(b[:n], n_fft = n_fft, hop_length = hop)) ** 2
+    diff = 10 * np.log10(A + 1e-10) - 10 * np.log10(B + 1e-10)
+    return float(np.mean(np.sqrt(np.mean(diff ** 2, axis = 0))))
+
+
+# HarmoF0 で F0 と activation を求め、両方で有声のフレームの差を cent で返す
+def f0_rmse_cents(efx, a16, b16):
+    n = min(a16.shape[0], b16.shape[0])
+    f0_a, act_a, _, _ = efx.sess_HarmoF0.run(['freq_t', 'act_t', 'energy_t', 'spec'], {"input": a16[np.newaxis, :n]})
+    f0_b, act_b, _, _ = efx.sess_HarmoF0.run(['freq_t', 'act_t', 'energy_t', 'spec'], {"input": b16[np.newaxis, :n]})
+    voiced = (act_a[0] > efx.activation_threshold) & (act_b[0] > efx.activation_threshold) & (f0_a[0] > 0) & (f0_b[0] > 0)
+    if not np.any(voiced):
+        return float("nan")
+    cents = 1200 * np.log2(f0_a[0][voiced] / f0_b[0][voiced])
+    return float(np.sqrt(np.mean(cents ** 2)))
+
+
+# joins（継ぎ目のサンプル位置）の前後 half_width の 1 次差分エネルギーと、それ以外の区間の比 (dB)
+def boundary_energy_db(y, joins, half_width: int):
+    d2 = np.diff(y) ** 2
+    mask = np.zeros(d2.shape[0], dtype = bool)
+    for j in joins:
+        mask[max(0, j - half_width):min(d2.shape[0], j + half_width)] = True
+    if not np.any(mask) or np.all(mask):
+        return float("nan")
+    return float(10 * np.log10((d2[mask].mean() + 1e-20) / (d2[~mask].mean() + 1e-20)))
+
+
+# a を b に対して何サンプル遅らせると最も相関が高いか（|lag| <= max_lag）
+def estimate_lag(a, b, max_lag: int):
+    n = min(a.shape[0], b.shape[0])
+    size = 1 << int(np.ceil(np.log2(2 * n)))
+    corr = np.fft.irfft(np.fft.rfft(a[:n], size) * np.conj(np.fft.rfft(b[:n], size)), size)
+    lags = np.concatenate((np.arange(0, max_lag + 1), np.arange(-max_lag, 0)))
+    return int(lags[np.argmax(corr[lags])])
+
+
+# ファイル全体のスペクトログラムから、オフライン変換の自動推定と同じ方法でスタイルを求める
+def estimate_file_style(efx, x16):
+    _, _, _, spec = efx.sess_HarmoF0.run(['freq_t', 'act_t', 'energy_t', 'spec'], {"input": x16[np.newaxis, :]})
+    n_spec = max(4, spec.shape[-1] // 4 * 4)
+    return efx.sess_SE.run(['output'], {'input': spec[:, np.newaxis, 48:, :n_spec]})[0]
+
+
+#### ワーカープロセス側
+
+
+def _init_worker(intra_op_threads):
+    import vc_engine # ONNX Runtime は子プロセスで初めて読み込む
+    if intra_op_threads > 0:
+        vc_engine.so.intra_op_num_threads = intra_op_threads
+        vc_engine.so.inter_op_num_threads = 1
+
+
+# 1 つの設定で全ファイルをストリーミング変換し、ファイル平均の指標を返す
+def _run_setting(vc_config, settings, paths, style, sr_out):
+    import librosa
+    from vc_engine import AudioEfx
+    from offline_converter import ChunkedOfflineConverter
+    from audio_io import open_audio_source
+
+    vc_config = copy.deepcopy(vc_config)
+    for key, value in settings.items():
+        if key in vc_config["backend"]:
+            vc_config["backend"][key] = value
+        else:
+            vc_config[key] = value
+    vc_config["auto_encode"] = False # スタイルは両経路で固定する
+
+    sc = HeadlessBackend(vc_config, sr_out = sr_out, style = style)
+    efx = AudioEfx(sc, vc_config)
+    converter = ChunkedOfflineConverter(
+        efx,
+        chunk_sec = vc_config.get("offline_chunk_sec", 10.0),
+        context_sec = vc_config.get("offline_context_sec", 1.0),
+        fade_sec = vc_config.get("offline_fade_sec", 0.1),
+    )
+    B = sc.blocksize
+    cf = efx.cross_fade_samples
+    # retro_samples は inference の中で決まるので、同じ式で先に求めておく
+    retro = int(0.05 * sc.sr_out)
+    # 各ファイルの前に流す低レベルのノイズ。前のファイルの音がバッファに残らないよう、モデルが見る最長の区間より長くする
+    preroll_sec = 0.5 + max(efx.len_embedder_input / efx.sr_proc, efx.len_f0n_predictor * 0.02, efx.len_proc * 0.02, efx.len_w2m / efx.sr_proc)
+    rng = np.random.default_rng(0)
+
+    rows = []
+    laps = []
+    for path in paths:
+        # オフライン（基準）。スタイルを指定しない場合はファイル全体から推定したものを両経路で使う
+        source = open_audio_source(path)
+        chunks = []
+        try:
+            x = source.read(0, source.n_samples)
+            sr_in = source.sr
+            if style is None:
+                sc.current_target_style = estimate_file_style(
+                    efx, converter.read_16k(source, 0, int(np.ceil(source.n_samples * efx.sr_proc / source.sr))),
+                )
+            converter.convert_source(source, chunks.append, style_vect = sc.current_target_style)
+        finally:
+            source.close()
+        y_off = np.concatenate(chunks)[:, 0]
+
+        # ストリーミング
+        x_out = librosa.resample(x, orig_sr = sr_in, target_sr = sc.sr_out, res_type = "polyphase").astype(np.float32)
+        n_pre = int(np.ceil(preroll_sec * sc.sr_out / B)) * B
+        n_post = int(np.ceil((cf + retro + B) / B)) * B # 末尾まで出し切るための無音
+        stream_in = np.concatenate((
+            ((rng.random(n_pre, dtype = np.float32) - 0.5) * 2e-5),
+            x_out,
+            np.zeros(n_post + (-x_out.shape[0]) % B, dtype = np.float32),
+        ))
+        outputs = []
+        file_laps = []
+        for k in range(0, stream_in.shape[0], B):
+            outputs.append(efx.inference(stream_in[k:k + B, np.newaxis])[:, 0])
+            if k >= n_pre:
+                file_laps.append(efx.vc_lap)
+        y_stream = np.concatenate(outputs)
+        laps += file_laps
+
+        # 継ぎ目：各ブロックの出力の retro サンプル目から cf サンプルがクロスフェード区間（cf = 0 なら retro サンプル目で切り替わる）
+        joins = [k + retro + cf // 2 - n_pre for k in range(n_pre, y_stream.shape[0] - B, B)]
+        boundary = boundary_energy_db(y_stream[n_pre:], joins, half_width = max(cf // 2, 32))
+
+        # 入力との対応：出力は cf + retro サンプル遅れて出てくる。残りのずれは相互相関で求めて揃える
+        y_s = y_stream[n_pre + cf + retro:]
+        y_s24 = librosa.resample(y_s, orig_sr = sc.sr_out, target_sr = efx.sr_dec, res_type = "polyphase")
+        lag = estimate_lag(y_s24, y_off, max_lag = int(0.05 * efx.sr_dec))
+        if lag > 0:
+            y_s24 = y_s24[lag:]
+        elif lag < 0:
+            y_s24 = np.concatenate((np.zeros(-lag, dtype = y_s24.dtype), y_s24))
+        n = min(y_s24.shape[0], y_off.shape[0])
+        y_s24, y_ref = y_s24[:n], y_off[:n]
+
+        rows.append({
+            "lsd": log_spectral_distance(y_s24, y_ref),
+            "f0_rmse": f0_rmse_cents(
+                efx,
+                librosa.resample(y_s24, orig_sr = efx.sr_dec, target_sr = efx.sr_proc, res_type = "polyphase"),
+                librosa.resample(y_ref, orig_sr = efx.sr_dec, target_sr = efx.sr_proc, res_type = "polyphase"),
+            ),
+            "boundary": boundary,
+            "lag_ms": 1000 * lag / efx.sr_dec,
+        })
+
+    laps = np.array(laps)
+    block_ms = 1000 * B / sc.sr_out
+    return {
+        **settings,
+        "lsd": float(np.nanmean([r["lsd"] for r in rows])),
+        "f0_rmse": float(np.nanmean([r["f0_rmse"] for r in rows])),
+        "boundary": float(np.nanmean([r["boundary"] for r in rows])),
+        "lap_mean": float(laps.mean()),
+        "lap_p95": float(np.percentile(laps, 95)),
+        "rtf": float(np.percentile(laps, 95) / block_ms),
+        "latency": 1000 * (B + cf + retro) / sc.sr_out,
+        "lag_ms": float(np.mean([r["lag_ms"] for r in rows])),
+    }
+
+
+####
+
+
+# 全ての設定の組を、品質（lsd）、計算時間（lap_p95）、遅延（latency）の 3 つで比べたときのパレート最適か
+def pareto_front(results, keys = ("lsd", "lap_p95", "latency")):
+    front = []
+    for r in results:
+        dominated = any(
+            all(o[k] <= r[k] for k in keys) and any(o[k] < r[k] for k in keys)
+            for o in results if o is not r
+        )
+        front.append(not dominated)
+    return front
+
+
+# "--grid key=v1,v2,..." を {key: [v1, v2, ...]} にする。値は JSON として読む（true, 0.1 など）。読めなければ文字列
+def parse_grid(specs):
+    grid = {}
+    for spec in specs:
+        key, values = spec.split("=", 1)
+        parsed = []
+        for value in values.split(","):
+            try:
+                parsed.append(json.loads(value))
+            except json.JSONDecodeError:
+                parsed.append(value)
+        grid[key.strip()] = parsed
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compare streaming VC against offline conversion over a grid of settings.")
+    parser.add_argument("inputs", nargs = "+", help = "reference audio files or wildcard patterns")
+    parser.add_argument("--grid", action = "append", default = [], help = "key=v1,v2,... of the vc config (repeatable)")
+    parser.add_argument("--style", default = None, help = "style csv path, 'style:<slot>' or 'sample:<slot>' (default: estimated from each file)")
+    parser.add_argument("--sr-out", type = int, default = 48000, help = "device sampling rate to simulate")
+    parser.add_argument("--workers", type = int, default = 1, help = "number of worker processes")
+    parser.add_argument("--threads", type = int, default = 0, help = "ONNX intra-op threads per worker (0: cpu_count / workers)")
+    parser.add_argument("--vc-config", default = "./configs/vc_config.json")
+    parser.add_argument("--app-config", default = "./configs/app_config.json")
+    parser.add_argument("--csv", default = None, help = "write all rows to this csv file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.WARNING, format = '%(asctime)s [%(levelname)s] %(name)s - %(message)s')
+
+    vc_config = load_make_vc_config(args.vc_config, save = False)
+    vc_config["feature_cache_mb"] = 0 # 基準の変換は毎回計算する
+    style = None
+    if args.style is not None:
+        from batch_convert import resolve_style
+        style = resolve_style(args.style, load_make_app_config(args.app_config, save = False))
+
+    paths = sorted({path for spec in args.inputs for path in glob.glob(spec)})
+    if len(paths) == 0:
+        parser.error("No input file was found.")
+    grid = parse_grid(args.grid) if args.grid else {"len_proc": [20, 30, 40], "cross_fade_samples": [0, vc_config["cross_fade_samples"]]}
+    for key in grid:
+        if key not in vc_config and key not in vc_config["backend"]:
+            parser.error(f"Unknown vc config key: '{key}'")
+    settings_list = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+
+    n_workers = max(1, min(args.workers, len(settings_list)))
+    threads = args.threads if args.threads > 0 else max(1, (os.cpu_count() or 1) // n_workers)
+    print(f"{len(settings_list)} settings x {len(paths)} files, {n_workers} workers x {threads} threads.")
+
+    time0 = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(
+        max_workers = n_workers,
+        mp_context = multiprocessing.get_context("spawn"),
+        initializer = _init_worker,
+        initargs = (threads,),
+    ) as pool:
+        futures = [pool.submit(_run_setting, vc_config, settings, paths, style, args.sr_out) for settings in settings_list]
+        for settings, future in zip(settings_list, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"FAILED {settings}: {e}", file = sys.stderr)
+                continue
+            print(f"[{len(results)}/{len(settings_list)}] {settings} done ({time.perf_counter() - time0:.0f} s)")
+    if len(results) == 0:
+        sys.exit(1)
+
+    front = pareto_front(results)
+    for r, on_front in zip(results, front):
+        r["pareto"] = on_front
+    results.sort(key = lambda r: (not r["pareto"], r["lsd"]))
+
+    keys = list(grid.keys())
+    metrics = ["lsd", "f0_rmse", "boundary", "lap_mean", "lap_p95", "rtf", "latency", "lag_ms"]
+    header = ["*"] + keys + metrics
+    table = [["*" if r["pareto"] else ""] + [str(r[k]) for k in keys] + [f"{r[m]:.2f}" for m in metrics] for r in results]
+    widths = [max(len(row[i]) for row in [header] + table) for i in range(len(header))]
+    print()
+    for row in [header] + table:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+    print("\n* = Pareto-optimal in (lsd, lap_p95, latency). lsd / boundary in dB, f0_rmse in cent, lap / latency / lag in ms.")
+
+    if args.csv is not None:
+        with open(args.csv, "w", newline = "") as f:
+            writer = csv.DictWriter(f, fieldnames = ["pareto"] + keys + metrics)
+            writer.writeheader()
+            for r in results:
+                writer.writerow({k: r[k] for k in ["pareto"] + keys + metrics})
+
+
+if __name__ == '__main__':
+    main()
@@ -18,13 +18,13 @@
 
 import wx
 import math
-import json
 import copy
 
 import numpy as np
 
 import logging
 import inspect
+from gui_scheduler import start_update_timer, PRIORITY_BACKGROUND, PRIORITY_MONITOR
 
 ####
 
@@ -107,9 +107,8 @@ class AxesEditPanel(wx.Panel):
         self.SetSizer(self.root_sizer)
         self.Layout()
 
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(137) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録する。VC に使うスタイルを決めるので、タブが非表示でも止めない。単位 ms
+        self.timer = start_update_timer(self, self.update, 137, priority = PRIORITY_BACKGROUND, always = True)
 
 
     def update(self, event):
@@ -176,9 +175,8 @@ class AxesEditPanel(wx.Panel):
                 self.manager.style_portfolio[slot_index]["emb_expand"] = None
             self.manager.style_portfolio[slot_index]["handmade_style_name"] = slot.handmade_style_name
             
-            with open(self.manager.style_portfolio_path, 'w') as f:
-                json.dump(self.manager.style_portfolio, f, indent = 4)
-            self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Style gallery was saved to '{self.manager.style_portfolio_path}'")
+            self.manager.save_portfolio()
+            self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Style gallery save was scheduled: '{self.manager.style_portfolio_path}'")
         except:
             self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Failed to save the style gallery.")
 
@@ -275,9 +273,8 @@ class AxesPane(wx.Panel):
         self.Bind(wx.EVT_LEFT_UP, self.on_mouse_up) # マウスの左ボタンのクリック「終了」タイミング
         self.Bind(wx.EVT_RIGHT_UP, self.on_mouse_right_up) # マウスの右ボタンのクリック「終了」タイミング
         
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(57) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, 57, priority = PRIORITY_MONITOR)
 
     # update はマウスの動きをキャプチャする機能。対応するスタイル空間上の座標を self.mouse_value で取れる。
 
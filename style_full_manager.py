@@ -32,6 +32,7 @@ import logging
 import inspect
 
 import numpy as np
+from gui_scheduler import start_update_timer, PRIORITY_CONTROL
 
 
 #### （高度）話者スタイルの 128 次元を全部手動で制御する。ジョーク機能の一種
@@ -161,9 +162,8 @@ class FullManagerPanel(scrolled.ScrolledPanel):
         self.SetSizer(self.root_sizer)
         self.Layout()
 
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(100) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録する。VC に使うスタイルを決めるので、タブが非表示でも止めない。単位 ms
+        self.timer = start_update_timer(self, self.update, 100, priority = PRIORITY_CONTROL, always = True)
 
         self.logger.debug("Initialized.")
 
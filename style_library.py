@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+# スタイルベクトルを数千件単位で貯めておくためのライブラリ。スロット（max_slots 個）や csv ファイルとは別に、
+# 1 つのフォルダに次の 3 つのファイルで保存する。
+#   - header.json   : 次元数などの情報
+#   - vectors.f32   : (件数, dim) の float32 を行ごとに並べただけのバイナリ。開くときは np.memmap で読むだけなので、
+#                     件数によらず即座に開ける
+#   - index.jsonl   : 1 行 1 件のメタデータ（名前、元ファイル、pumap の 2 次元座標、作成時刻）
+# 追加は両ファイルの末尾に追記するだけで、既存の内容は書き直さない。ベクトルを先に書き、メタデータの行を後に書くので、
+# 途中で落ちた場合は両方が揃っている件数までを有効とし、開き直すときに余った末尾を切り詰める。
+# 書き込むのは 1 つのプロセスだけの前提（読むだけなら複数から開いてよい）。
+# csv（StyleSlotPanel.load_csv_to_slot と同じ形式）と portfolio（style / sample）の読み込み・書き出しもここで行う。
+#
+# 例:
+#   python style_library.py import ./styles/*.csv ./styles/style_portfolio.json ./styles/sample_portfolio.json
+#   python style_library.py list
+#   python style_library.py export --csv ./exported
+#   python style_library.py export --portfolio ./styles/style_portfolio.json --rows 0,5,12
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+import logging
+
+import numpy as np
+
+from utils import sanitize_filename
+
+
+DIM_STYLE = 128
+LIBRARY_DIR = "./styles/library"
+
+
+# スタイル csv を読む。1 行でも複数行（(128, 1) 等）でも、合計 dim 個の数値があればよい
+def read_style_csv(
+    file_path: str,
+    dim: int = DIM_STYLE,
+):
+    data_list = []
+    with open(file_path, 'r') as f:
+        for row in csv.reader(f):
+            if len(row) > 0:
+                data_list.append(np.array(row, dtype = np.float32))
+    if len(data_list) > 0 and len(data_list[-1]) == dim:
+        valid_data = data_list[-1]
+    else:
+        valid_data = np.concatenate(data_list) if len(data_list) > 0 else np.zeros(0, dtype = np.float32)
+    if valid_data.shape[-1] != dim:
+        raise ValueError(f"The style csv must contains {dim} numerical values: {file_path}")
+    return valid_data.reshape(1, dim)
+
+
+# スタイルを 1 行の csv に書く。float32 を float にキャストしてから round しないと、書き出した桁数がおかしくなる
+def write_style_csv(
+    file_path: str,
+    style,
+):
+    with open(file_path, 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(np.round(np.asarray(style).astype(float), 4).flatten().tolist())
+
+
+class StyleLibrary:
+    def __init__(
+        self,
+        dir_path: str = LIBRARY_DIR,
+        dim: int = DIM_STYLE,
+        readonly: bool = False,
+    ):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.dir_path = dir_path
+        self.readonly = readonly
+        self.header_path = os.path.join(dir_path, "header.json")
+        self.vectors_path = os.path.join(dir_path, "vectors.f32")
+        self.index_path = os.path.join(dir_path, "index.jsonl")
+
+        if os.path.exists(self.header_path):
+            with open(self.header_path, "r") as f:
+                header = json.load(f)
+            if header["dim"] != dim:
+                raise ValueError(f"The style library '{dir_path}' has dim {header['dim']}, not {dim}.")
+        elif readonly:
+            raise FileNotFoundError(f"No style library at '{dir_path}'.")
+        else:
+            os.makedirs(dir_path, exist_ok = True)
+            with open(self.header_path, "w") as f:
+                json.dump({"format": "mmcxli-style-library", "version": 1, "dim": dim, "dtype": "float32"}, f, indent = 4)
+        self.dim = dim
+        self.row_bytes = dim * 4
+
+        self.entries = [] # index.jsonl の各行の dict
+        self.vectors = np.zeros((0, dim), dtype = np.float32) # (件数, dim) の memmap（0 件のときは空の array）
+        self.name_to_row = {} # 同じ名前が複数あれば、最後に追加したもの
+        self._load()
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    # index.jsonl を読み、ベクトルと揃っている件数までを有効にする。書き込み可能なら余った末尾を切り詰める
+    def _load(self):
+        entries = []
+        index_bytes = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break # 書きかけの行。以降は無効
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break
+                    index_bytes += len(line)
+        n_vectors = os.path.getsize(self.vectors_path) // self.row_bytes if os.path.exists(self.vectors_path) else 0
+        n = min(len(entries), n_vectors)
+        if n < len(entries):
+            # メタデータの位置を数え直す
+            index_bytes = 0
+            with open(self.index_path, "rb") as f:
+                for _ in range(n):
+                    index_bytes += len(f.readline())
+        if not self.readonly:
+            for path, size in ((self.index_path, index_bytes), (self.vectors_path, n * self.row_bytes)):
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    self.logger.warning(f"Truncating an incomplete tail of '{path}'")
+                    with open(path, "r+b") as f:
+                        f.truncate(size)
+        self.entries = entries[:n]
+        self.name_to_row = {entry["name"]: i for i, entry in enumerate(self.entries)}
+        self._map()
+
+
+    def _map(self):
+        n = len(self.entries)
+        if n > 0:
+            self.vectors = np.memmap(self.vectors_path, dtype = np.float32, mode = 'r', shape = (n, self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype = np.float32)
+
+
+    # 1 件を (1, dim) の array で返す。row は行番号か名前
+    def get(self, row):
+        if isinstance(row, str):
+            if row not in self.name_to_row:
+                raise KeyError(f"No style named '{row}' in '{self.dir_path}'.")
+            row = self.name_to_row[row]
+        return np.array(self.vectors[row], dtype = np.float32).reshape(1, self.dim)
+
+
+    # 全件の pumap 座標を (件数, 2) で返す。座標のない件は nan
+    def comps(self):
+        out = np.full((len(self.entries), 2), np.nan, dtype = np.float32)
+        for i, entry in enumerate(self.entries):
+            if entry.get("comp") is not None:
+                out[i] = entry["comp"]
+        return out
+
+
+    # スタイルをまとめて末尾に追記し、追加した行番号のリストを返す。
+    # vects は (件数, dim)。names, sources, comps は件数と同じ長さのリスト（comps は (件数, 2) の array でもよい）
+    def extend(
+        self,
+        vects,
+        names: list,
+        sources: list = None,
+        comps = None,
+    ) -> list:
+        if self.readonly:
+            raise PermissionError(f"The style library '{self.dir_path}' was opened read-only.")
+        vects = np.ascontiguousarray(np.asarray(vects, dtype = np.float32).reshape(-1, self.dim))
+        n_new = vects.shape[0]
+        if len(names) != n_new:
+            raise ValueError("The number of names does not match the number of styles.")
+        sources = sources if sources is not None else [None] * n_new
+        created = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+        # ベクトルを先に書く。メタデータの行が書かれるまでは、開き直しても有効な件数に含まれない
+        with open(self.vectors_path, "ab") as f:
+            f.write(vects.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        rows = []
+        with open(self.index_path, "a", encoding = "utf-8") as f:
+            for i in range(n_new):
+                comp = None
+                if comps is not None and comps[i] is not None and not np.any(np.isnan(comps[i])):
+                    comp = [round(float(v), 4) for v in np.asarray(comps[i]).flatten()[:2]]
+                entry = {"name": names[i], "source": sources[i], "comp": comp, "created": created}
+                f.write(json.dumps(entry, ensure_ascii = False) + "\n")
+                rows.append(len(self.entries))
+                self.entries.append(entry)
+                self.name_to_row[entry["name"]] = rows[-1]
+            f.flush()
+            os.fsync(f.fileno())
+        self._map()
+        return rows
+
+
+    def append(
+        self,
+        vect,
+        name: str,
+        source: str = None,
+        comp = None,
+    ) -> int:
+        return self.extend(vect, [name], [source], None if comp is None else [comp])[0]
+
+
+    #### 既存の形式との読み込み・書き出し
+
+    # csv を 1 件として追加する。名前は拡張子を抜いたファイル名
+    def import_csv(
+        self,
+        file_path: str,
+        compress = None, # (件数, dim) -> (件数, 2) の関数。与えると pumap 座標を計算して記録する
+    ) -> int:
+        vect = read_style_csv(file_path, self.dim)
+        comp = compress(vect)[0] if compress is not None else None
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        return self.append(vect, name, source = os.path.relpath(file_path, os.getcwd()), comp = comp)
+
+
+    # style_portfolio.json（ファイル由来と手入力のスタイル）か sample_portfolio.json（サンプルの埋め込み）の、
+    # スタイルを持つスロットをすべて追加する。どちらの形式かは中身で判断する
+    def import_portfolio(
+        self,
+        file_path: str,
+        compress = None,
+    ) -> list:
+        with open(file_path, "r") as f:
+            portfolio = json.load(f)
+        label = os.path.splitext(os.path.basename(file_path))[0]
+        vects, names, sources, comps = [], [], [], []
+        for entry in portfolio:
+            i = entry.get("slot_index")
+            if "embedding" in entry:
+                # sample portfolio
+                if entry.get("embedding") is not None:
+                    source = entry.get("last_selected_file")
+                    stem = os.path.splitext(os.path.basename(source))[0] if source else f"slot{i}"
+                    vects.append(entry["embedding"])
+                    names.append(stem)
+                    sources.append(source)
+                    comps.append(None)
+            else:
+                # style portfolio
+                if entry.get("emb_file") is not None:
+                    vects.append(entry["emb_file"])
+                    names.append(entry.get("file_style_name") or f"{label}_slot{i}")
+                    sources.append(entry.get("last_selected_file"))
+                    comps.append(entry.get("emb_comp"))
+                if entry.get("emb_expand") is not None:
+                    vects.append(entry["emb_expand"])
+                    names.append(entry.get("handmade_style_name") or f"{label}_slot{i}_handmade")
+                    sources.append(f"{file_path}#{i}")
+                    comps.append(entry.get("emb_handmade"))
+        if len(vects) == 0:
+            return []
+        vects = np.asarray(vects, dtype = np.float32).reshape(-1, self.dim)
+        comps = [None if c is None else np.asarray(c, dtype = np.float32).flatten() for c in comps]
+        if compress is not None:
+            computed = compress(vects)
+            comps = [computed[k] if c is None else c for k, c in enumerate(comps)]
+        return self.extend(vects, names, sources, comps)
+
+
+    # 指定した行を、1 件 1 ファイルの csv として書き出す。書き出したパスのリストを返す
+    def export_csv(
+        self,
+        out_dir: str,
+        rows: list = None,
+    ) -> list:
+        os.makedirs(out_dir, exist_ok = True)
+        rows = rows if rows is not None else range(len(self))
+        paths = []
+        for row in rows:
+            name = sanitize_filename(self.entries[row]["name"]) or f"style{row}"
+            path = os.path.join(out_dir, f"{name}.csv")
+            write_style_csv(path, self.vectors[row])
+            paths.append(path)
+        return paths
+
+
+    # 指定した行（max_slots 件まで）をスロットに並べた style portfolio を書き出す。
+    # スタイルマネージャはスロットの復元時に csv を読み直すので、csv も portfolio の隣（<名前>_csv フォルダ）に書き出す
+    def export_portfolio(
+        self,
+        file_path: str,
+        rows: list,
+        max_slots: int = 8,
+    ):
+        if len(rows) > max_slots:
+            raise ValueError(f"At most {max_slots} styles fit in a portfolio ({len(rows)} were given).")
+        csv_dir = os.path.splitext(file_path)[0] + "_csv"
+        csv_paths = self.export_csv(csv_dir, rows)
+        portfolio = []
+        for i in range(max_slots):
+            entry = {
+                "slot_index": i,
+                "last_selected_file": None,
+                "file_style_name": None,
+                "emb_file": None,
+                "emb_comp": None,
+                "emb_recon": None,
+                "handmade_style_name": None,
+                "emb_handmade": None,
+                "emb_expand": None,
+            }
+            if i < len(rows):
+                meta = self.entries[rows[i]]
+                entry["last_selected_file"] = os.path.relpath(csv_paths[i], os.getcwd())
+                entry["file_style_name"] = os.path.splitext(os.path.basename(csv_paths[i]))[0]
+                entry["emb_file"] = np.round(np.asarray(self.vectors[rows[i]]).astype(float), 4).reshape(1, self.dim).tolist()
+                entry["emb_comp"] = [meta["comp"]] if meta.get("comp") is not None else None
+            portfolio.append(entry)
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok = True)
+        with open(file_path, "w") as f:
+            json.dump(portfolio, f, indent = 4)
+
+
+# pumap エンコーダ（StyleManagerPanel の sess_SCE と同じもの）で 2 次元座標を計算する関数を作る
+def make_compressor(ckpt: str = "./weights/pumap_encoder_2dim.onnx"):
+    import onnxruntime as ort
+    sess = ort.InferenceSession(ckpt, providers = ['CPUExecutionProvider'])
+    return lambda vects: sess.run(['comp'], {'emb': np.asarray(vects, dtype = np.float32)})[0]
+
+
+####
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Manage the style library (a memory-mapped store of style vectors).")
+    parser.add_argument("--library", default = None, help = "library folder (default: style_library_dir of the app config)")
+    parser.add_argument("--app-config", default = "./configs/app_config.json")
+    sub = parser.add_subparsers(dest = "command", required = True)
+
+    p_import = sub.add_parser("import", help = "append style csv files, folders of csv files or portfolio json files")
+    p_import.add_argument("inputs", nargs = "+")
+    p_import.add_argument("--no-comp", action = "store_true", help = "do not compute the 2-D pumap coordinates")
+    p_import.add_argument("--compressor", default = "./weights/pumap_encoder_2dim.onnx")
+
+    sub.add_parser("list", help = "print the rows of the library")
+
+    p_export = sub.add_parser("export", help = "write rows as csv files or as a style portfolio")
+    p_export.add_argument("--rows", default = None, help = "comma-separated row numbers or names (default: all)")
+    p_export.add_argument("--csv", default = None, help = "output folder for csv files")
+    p_export.add_argument("--portfolio", default = None, help = "output style portfolio json")
+    p_export.add_argument("--max-slots", type = int, default = 8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.WARNING, format = '%(asctime)s [%(levelname)s] %(name)s - %(message)s')
+
+    library_dir = args.library
+    if library_dir is None:
+        from config_manager import load_make_app_config
+        library_dir = load_make_app_config(args.app_config, save = False).get("style_library_dir", LIBRARY_DIR)
+
+    if args.command == "import":
+        library = StyleLibrary(library_dir)
+        compress = None
+        if not args.no_comp and os.path.exists(args.compressor):
+            compress = make_compressor(args.compressor)
+        n0 = len(library)
+        for spec in args.inputs:
+            paths = sorted(glob.glob(os.path.join(spec, "*.csv"))) if os.path.isdir(spec) else sorted(glob.glob(spec))
+            for path in paths:
+                try:
+                    if path.lower().endswith(".json"):
+                        library.import_portfolio(path, compress = compress)
+                    else:
+                        library.import_csv(path, compress = compress)
+                except (ValueError, KeyError, OSError) as e:
+                    print(f"Skipped '{path}': {e}", file = sys.stderr)
+        print(f"Imported {len(library) - n0} styles into '{library_dir}' ({len(library)} in total).")
+
+    elif args.command == "list":
+        library = StyleLibrary(library_dir, readonly = True)
+        for i, entry in enumerate(library.entries):
+            comp = "" if entry.get("comp") is None else f"({entry['comp'][0]:.3f}, {entry['comp'][1]:.3f})"
+            print(f"{i}\t{entry['name']}\t{comp}\t{entry.get('source') or ''}\t{entry['created']}")
+
+    elif args.command == "export":
+        library = StyleLibrary(library_dir, readonly = True)
+        rows = None
+        if args.rows is not None:
+            rows = [int(r) if r.strip().isdigit() else library.name_to_row[r.strip()] for r in args.rows.split(",")]
+        if args.csv is None and args.portfolio is None:
+            parser.error("Specify --csv and/or --portfolio.")
+        if args.csv is not None:
+            print(f"Wrote {len(library.export_csv(args.csv, rows))} csv files to '{args.csv}'.")
+        if args.portfolio is not None:
+            library.export_portfolio(args.portfolio, rows if rows is not None else list(range(min(len(library), args.max_slots))), max_slots = args.max_slots)
+            print(f"Wrote '{args.portfolio}'.")
+
+
+if __name__ == "__main__":
+    main()
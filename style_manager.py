@@ -40,6 +40,8 @@ so.log_severity_level = 0
 from style_slot import StyleSlotPanel
 from style_editor import AxesEditPanel
 from utils import plot_embedding_cube
+from gui_scheduler import start_update_timer, PRIORITY_CONTROL, PRIORITY_PLOT
+from json_writer import write_json_atomic
 
 # 設定ファイルのパス
 STYLE_PORTFOLIO_PATH = "./styles/style_portfolio.json"
@@ -212,9 +214,8 @@ class StyleManagerPanel(scrolled.ScrolledPanel):
         self.SetSizer(self.root_sizer) # （既存の子要素があれば削除して）統括用 sizer を self 配下に加える
         self.Layout()
 
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(100) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録する。VC に使うスタイルを決めるので、タブが非表示でも止めない。単位 ms
+        self.timer = start_update_timer(self, self.update, 100, priority = PRIORITY_CONTROL, always = True)
 
         self.logger.debug("Initialized.")
 
@@ -244,6 +245,18 @@ class StyleManagerPanel(scrolled.ScrolledPanel):
         event.Skip()
 
 
+    # 複数スタイルでのオフライン変換用に、スタイルを持つ（ファイルからロードしたか、手入力した）スロットを [(名前, (1, 128))] で返す。
+    # VC に使う値と同じく、ファイルからロードしたスタイルを優先する
+    def slot_styles(self):
+        styles = []
+        for i, slot in enumerate(self.slot_list):
+            if slot.style_abs_path is not None:
+                styles.append((f"style{i}_{slot.file_style_name}" if slot.file_style_name else f"style{i}", copy.deepcopy(slot.style_from_file)))
+            elif slot.emb_handmade is not None:
+                styles.append((f"style{i}_{slot.handmade_style_name}" if slot.handmade_style_name else f"style{i}", copy.deepcopy(slot.emb_expand)))
+        return styles
+
+
     # パネルを左クリックしてアクティブにする処理。実際には StyleSlotPanel 側から呼び出す。
     def on_panel_click(
         self, 
@@ -340,6 +353,16 @@ class StyleManagerPanel(scrolled.ScrolledPanel):
             return conf_list
 
 
+    # self.style_portfolio の保存を予約する。スロットやスタイル編集で portfolio を書き換えたら、これを呼ぶ。
+    # 書き出しは backend の JsonWriter が別スレッドでまとめて行う（単体テスト用の backend では、その場で書く）
+    def save_portfolio(self):
+        json_writer = getattr(self.backend, "json_writer", None)
+        if json_writer is not None:
+            json_writer.schedule(self.style_portfolio_path, self.style_portfolio)
+        else:
+            write_json_atomic(self.style_portfolio_path, self.style_portfolio)
+
+
     # いい感じに色相が離散したカラーパレットを作る機能
     
     def make_slot_colors(
@@ -418,9 +441,8 @@ class ResultEmbeddingPanel(wx.Panel):
 
         self.SetToolTip('Style embedding used in VC')
 
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(99) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, 99, priority = PRIORITY_PLOT)
 
     # キャッシュと現在の選択スタイルを比較し、変化している場合のみ再描画を行う
     def update(self, event):
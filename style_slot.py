@@ -18,7 +18,6 @@
 
 import wx
 import os
-import json
 import copy
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg
 import numpy as np
@@ -32,6 +31,7 @@ from utils import plot_embedding_cube, truncate_string, sanitize_filename
 
 import numpy as np
 import csv
+from gui_scheduler import start_update_timer, PRIORITY_BACKGROUND
 
 
 class StyleSlotPanel(wx.Panel):
@@ -189,9 +189,8 @@ class StyleSlotPanel(wx.Panel):
             self.plot_embedding()
         
         # self.update は作成済みのプロットを再描画する。
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(37) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, 37, priority = PRIORITY_BACKGROUND)
 
         self.logger.debug(f"Slot {self.slot_index} was initialized.")
 
@@ -491,10 +490,9 @@ class StyleSlotPanel(wx.Panel):
             
             # 手動入力した特徴量を反映させる機能は、ここではなく AxesEditPanel のメソッドとして用意されている
             
-            with open(self.manager.style_portfolio_path, 'w') as f:
-                json.dump(self.manager.style_portfolio, f, indent = 4)
+            self.manager.save_portfolio()
             
-            self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Style gallery was saved to '{self.manager.style_portfolio_path}'")
+            self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Style gallery save was scheduled: '{self.manager.style_portfolio_path}'")
         except:
             self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Failed to save the style gallery.")
 
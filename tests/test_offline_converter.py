@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# The MIT License
+
+# Copyright (c) 2024 Lyodos
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# 以下に定める条件に従い、本ソフトウェアおよび関連文書のファイル（以下「ソフトウェア」）の複製を取得するすべての人に対し、ソフトウェアを無制限に扱うことを無償で許可します。これには、ソフトウェアの複製を使用、複写、変更、結合、掲載、頒布、サブライセンス、および/または販売する権利、およびソフトウェアを提供する相手に同じことを許可する権利も無制限に含まれます。
+
+# 上記の著作権表示および本許諾表示を、ソフトウェアのすべての複製または重要な部分に記載するものとします。
+
+# ソフトウェアは「現状のまま」で、明示であるか暗黙であるかを問わず、何らの保証もなく提供されます。ここでいう保証とは、商品性、特定の目的への適合性、および権利非侵害についての保証も含みますが、それに限定されるものではありません。作者または著作権者は、契約行為、不法行為、またはそれ以外であろうと、ソフトウェアに起因または関連し、あるいはソフトウェアの使用またはその他の扱いによって生じる一切の請求、損害、その他の義務について何らの責任も負わないものとします。 
+
+# ChunkedOfflineConverter / BatchedOfflineConverter を、ONNX のモデルを持たない OfflineEngine で実際に通すテスト。
+# モデルの代わりに、入力の長さに合わせて sr_dec の音声を返す関数を run_offline_models / run_multi_style に差し込む。
+# convert_offline などが OfflineEngine のメソッドとして使えること、各モデル呼び出しの前に before_run が呼ばれることを確かめる。
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+sf = pytest.importorskip("soundfile")
+pytest.importorskip("librosa")
+pytest.importorskip("pydub")
+pytest.importorskip("matplotlib")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import offline_converter
+from offline_converter import (
+    OfflineEngine, GatedSession, ChunkedOfflineConverter, BatchedOfflineConverter, CONTENT_HOP, CONTENT_WIN,
+)
+
+
+SR_PROC = 16000
+SR_DEC = 24000
+OUT_HOP = SR_DEC // 50 # 出力の 1 フレームあたりのサンプル数
+
+
+class FakeSession:
+    def __init__(self):
+        self.n_runs = 0
+
+    def run(self, output_names, inputs):
+        self.n_runs += 1
+        return [inputs["x"]]
+
+
+# フレーム数に合わせた長さの出力を作る。値は入力の行番号とスタイルの先頭の値で決まる定数
+def fake_run_offline_models(engine, tensor_i16, style_vect = None, n_valid = None):
+    n_frames = (tensor_i16.shape[-1] - CONTENT_WIN) // CONTENT_HOP + 1
+    if style_vect is None:
+        style_vect = np.full((tensor_i16.shape[0], 128), 0.5, dtype = np.float32) # 「自動推定」の結果
+    if style_vect.shape[0] != tensor_i16.shape[0]:
+        style_vect = np.tile(style_vect[:1], (tensor_i16.shape[0], 1))
+    y = np.repeat(style_vect[:, :1], n_frames * OUT_HOP, axis = 1).astype(np.float32)
+    return engine.sess_dec.run(['y'], {"x": y})[0], style_vect
+
+
+def fake_run_multi_style(engine, tensor_i16, style_vects, max_batch = 8):
+    n_frames = (tensor_i16.shape[-1] - CONTENT_WIN) // CONTENT_HOP + 1
+    y = np.repeat(style_vects[:, :1], n_frames * OUT_HOP, axis = 1).astype(np.float32)
+    return engine.sess_dec.run(['y'], {"x": y})[0]
+
+
+# セッションを作らずに OfflineEngine を組み立てる（__init__ は ONNX のチェックポイントを読むので通さない）
+def make_stub_engine(target_style = None, auto_encode = False):
+    engine = OfflineEngine.__new__(OfflineEngine)
+    engine.sr_proc = SR_PROC
+    engine.sr_dec = SR_DEC
+    engine.auto_encode = auto_encode
+    engine.target_style = target_style
+    engine.feature_cache = None
+    engine.n_before_run = 0
+    def before_run():
+        engine.n_before_run += 1
+    engine.before_run = before_run
+    engine.sess_dec = GatedSession(FakeSession(), engine)
+    return engine
+
+
+@pytest.fixture(autouse = True)
+def fake_models(monkeypatch):
+    monkeypatch.setattr(offline_converter, "run_offline_models", fake_run_offline_models)
+    monkeypatch.setattr(offline_converter, "run_multi_style", fake_run_multi_style)
+
+
+def write_wav(path, sec, sr = SR_PROC):
+    t = np.arange(int(sec * sr)) / sr
+    sf.write(path, (0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32), sr)
+    return path
+
+
+def test_engine_has_convert_methods():
+    assert callable(getattr(OfflineEngine, "convert_offline", None))
+    assert callable(getattr(OfflineEngine, "convert_offline_styles", None))
+
+
+def test_chunked_convert_file(tmp_path):
+    in_path = write_wav(str(tmp_path / "in.wav"), 3.3)
+    out_path = str(tmp_path / "out.wav")
+    style = np.full((1, 128), 0.25, dtype = np.float32)
+    engine = make_stub_engine(target_style = style)
+    converter = ChunkedOfflineConverter(engine, chunk_sec = 1.0, context_sec = 0.2, fade_sec = 0.1)
+    progress = []
+
+    stats = converter.convert_file(in_path, out_path, progress = lambda done, total: progress.append((done, total)))
+
+    y, sr = sf.read(out_path, dtype = 'float32')
+    n_frames = converter.count_frames(offline_converter.open_audio_source(in_path))
+    assert sr == SR_DEC
+    assert y.shape[0] == n_frames * OUT_HOP
+    np.testing.assert_allclose(y, 0.25, atol = 1e-6) # 一定値をクロスフェードで繋いでも一定値のまま
+    assert stats["n_chunks"] == 4 and not stats["cancelled"]
+    assert progress[-1] == (n_frames, n_frames)
+    assert engine.n_before_run == stats["n_chunks"] # モデル呼び出しごとに before_run が呼ばれる
+
+
+def test_chunked_convert_file_styles(tmp_path):
+    in_path = write_wav(str(tmp_path / "in.wav"), 2.5)
+    out_paths = [str(tmp_path / f"out{k}.wav") for k in range(3)]
+    style_vects = np.array([[0.1], [0.2], [0.3]], dtype = np.float32) * np.ones((3, 128), dtype = np.float32)
+    converter = ChunkedOfflineConverter(make_stub_engine(), chunk_sec = 1.0, context_sec = 0.2, fade_sec = 0.1)
+
+    stats = converter.convert_file_styles(in_path, out_paths, style_vects)
+
+    assert stats["n_styles"] == 3
+    for k, path in enumerate(out_paths):
+        y, _ = sf.read(path, dtype = 'float32')
+        np.testing.assert_allclose(y, style_vects[k, 0], atol = 1e-6)
+
+
+def test_batched_convert_files(tmp_path):
+    pairs = [
+        (write_wav(str(tmp_path / f"in{i}.wav"), sec), str(tmp_path / f"out{i}.wav"))
+        for i, sec in enumerate((0.7, 1.6, 2.4))
+    ]
+    converter = BatchedOfflineConverter(
+        make_stub_engine(auto_encode = True), chunk_sec = 1.0, context_sec = 0.2, fade_sec = 0.1, batch_size = 4,
+    )
+
+    file_stats, stats = converter.convert_files(pairs)
+
+    assert stats["n_files"] == 3 and len(file_stats) == 3
+    for in_path, out_path in pairs:
+        n_frames = converter.count_frames(offline_converter.open_audio_source(in_path))
+        y, sr = sf.read(out_path, dtype = 'float32')
+        assert sr == SR_DEC
+        assert y.shape[0] == n_frames * OUT_HOP
+        np.testing.assert_allclose(y, 0.5, atol = 1e-6) # 自動推定のスタイル
@@ -18,24 +18,15 @@
 
 import wx
 
-import soundfile as sf
 import os
 import math
 
-import copy
-
-import numpy as np
-
-import librosa
-from pydub import AudioSegment
-
-import threading
-
 import logging
 import inspect
 
 
 from audio_level_meter import InputLevelMeterPanel
+from gui_scheduler import start_update_timer, PRIORITY_CONTROL
 
 ####
 
@@ -357,14 +348,13 @@ class FloatPanel(wx.Panel):
         self.Layout()
 
         # フロートパネルにファイルをドラッグアンドドロップした時の挙動。オフライン VC 処理を掛ける
-        self.SetDropTarget(AudioDropTarget(self.sc, host = self, max_sec = self.sc.offline_max_sec))
+        self.SetDropTarget(AudioDropTarget(self.sc, host = self))
         
         # 背景色のセット
         self.SetBackgroundColour(self.b_color[int(self.sc.vc_now)]) 
 
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(50) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, 50, priority = PRIORITY_CONTROL)
 
 
     # 消音ボタンを押した時のイベント
@@ -380,22 +370,21 @@ class FloatPanel(wx.Panel):
 
     def update(self, event):
 
-        # フロー画面の背景色は、VC の ON/OFF および時間超過の警告に応じて切り替える
-        if self.sc.offline_conversion_now == True:
-            self.status_text.SetForegroundColour(wx.Colour(23, 23, 27)) 
-            self.SetBackgroundColour(self.b_color[3]) 
+        # フロー画面の背景色は、VC の ON/OFF および時間超過の警告に応じて切り替える。
+        # オフライン変換中もリアルタイム VC は動き続けるので、表示はリアルタイム側の状態に従い、変換の進捗を後ろに付け足す
+        self.sc.offline_conversion_now = self.sc.offline_worker.busy
+        self.status_text.SetForegroundColour(self.status_text_color[int(self.sc.vc_now)]) 
+        if self.sc.efx_control.vc_lap / (1000 * self.sc.blocksize / self.sc.sr_out) > 1:
+            self.SetBackgroundColour(self.b_color[2]) 
+            label = "VC Running (timeout)" if self.sc.vc_now else "(THROUGH)"
         else:
-            self.status_text.SetForegroundColour(self.status_text_color[int(self.sc.vc_now)]) 
-            if self.sc.efx_control.vc_lap / (1000 * self.sc.blocksize / self.sc.sr_out) > 1:
-                self.SetBackgroundColour(self.b_color[2]) 
-                if self.sc.vc_now:
-                    self.status_text.SetLabel("VC Running (timeout)")
-            else:
-                self.SetBackgroundColour(self.b_color[int(self.sc.vc_now)]) 
-                if self.sc.vc_now:
-                    self.status_text.SetLabel("VC Running")
-                else:
-                    self.status_text.SetLabel("(THROUGH)")
+            self.SetBackgroundColour(self.b_color[int(self.sc.vc_now)]) 
+            label = "VC Running" if self.sc.vc_now else "(THROUGH)"
+        if self.sc.offline_conversion_now:
+            n_done, n_total, progress = self.sc.offline_worker.summary()
+            label += f" | Converting [{n_done + 1}/{n_total}] {int(100 * progress)}%"
+        if self.status_text.GetLabel() != label:
+            self.status_text.SetLabel(label)
 
         # ミュート状態の更新
         if self.sc.mute is True:
@@ -421,122 +410,47 @@ class FloatPanel(wx.Panel):
 
 # ファイルをドラッグ＆ドロップしたときに、オフラインで VC を掛ける。現在のターゲットスタイルに従う
 
-# なお、ファイルが一定時間以上の場合に制限を掛ける機能は、現在冒頭だけ読む乱暴なものである。
-# 本当は無音部を検知して max_sec 以下の chunk に切り分けて処理すべきなのだが、
-# 面倒くさいので未実装である
+# 変換は backend の OfflineWorker が専用の ONNX セッションと低優先度のスレッドで行うので、リアルタイム VC は止めない。
+# 長いファイルは区間ごとに変換し、逐次ディスクに書き出すので、長さの制限はない
 
 class AudioDropTarget(wx.FileDropTarget):
     def __init__(
         self, 
         backend,
         host,
-        max_sec: float = 16.0, # これよりも長い音声は冒頭のみ読み込んで処理される
     ):
         super().__init__()
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
         self.sc = backend # audio backend
         self.host = host # Float Panel
-        self.max_sec = max_sec
         self.os_sep = os.path.sep # 現在の OS で有効なパス区切り文字
 
     def OnDropFiles(self, x, y, filenames):
-        self.success = False
-        self.skip_orig = copy.deepcopy(self.sc.skip_always)
-
-        # 背景を変えるギミックのために、変換の非同期実行が必要
-        self.sc.offline_conversion_now = True
-        # ファイルの処理を非同期で行う
-        threading.Thread(target = self.process, args = (filenames,)).start()
-        return True # TypeError: invalid result from AudioDropTarget.OnDropFiles(), a 'bool' is expected not 'NoneType'
-
-
-    def process(self, filenames):
-        for i, file_path in enumerate(filenames):
+        success = False
+        for file_path in filenames:
+            if not file_path.lower().endswith(('.wav', '.ogg', '.mp3', '.m4a', '.flac', '.opus')):
+                wx.MessageBox(
+                    "Unsupported file format. Please drop an audio file ('.wav', '.ogg', '.mp3', '.m4a', '.flac', '.opus').", 
+                    "Error", 
+                    wx.OK | wx.ICON_ERROR,
+                )
+                continue
             try:
-                if file_path.lower().endswith(('.wav', '.ogg', '.mp3', '.m4a', '.flac', '.opus')):
-                    self.sc.skip_always = True # 一時的にリアルタイム VC を迂回し InferenceSession のリソースを優先確保
-                    self.host.status_text.SetLabel(f"Converting [{i+1}/{len(filenames)}]")
-                    
-                    # OS 依存のパス区切り文字を修正。なおドライブレター等はうまく処理できない
-                    offline_load_path = file_path.replace('/', self.os_sep).replace('\\', self.os_sep) 
-                    self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Offline VC of '{offline_load_path}' is running...")
-
-                    # 入力ファイルのあるフォルダにサブディレクトリを作り、変換後のファイルを同名で保存
-                    load_dir_name = os.path.dirname(offline_load_path)
-                    load_file_name = os.path.basename(offline_load_path)
-                    save_dir_name = os.path.join(load_dir_name, "converted")
-                    os.makedirs(save_dir_name, exist_ok = True)
-
-                    # soundfile をロードしたら 2 種類のバッファに保存する。リサンプリングは time last が必要。
-                    # sf は返り値は channel last だが、librosa は timel last なので注意
-                    file_audio_raw, file_orig_fs = self.read_audio(
-                        file_path, 
-                        max_sec = self.max_sec,
-                    ) # (time, channel)
-
-                    # embedding 計算用のバッファに保存 self.host.sr_proc (16000 Hz) で作る
-                    file_audio_16 = librosa.resample(
-                        file_audio_raw,  # time last の状態で音声をリサンプルする
-                        orig_sr = file_orig_fs, 
-                        target_sr = self.sc.sr_proc,
-                        res_type = "polyphase",
-                        axis = -1,
-                    ) # こちらは time last で保持する
-
-                    # 出力は self.sc.sr_dec こと 24k になる。
-                    converted_audio_24 = self.sc.efx_control.convert_offline(file_audio_16)
-
-                    # 書き出す音声ファイルのパスを設定
-                    output_file_path = os.path.join(save_dir_name, os.path.splitext(load_file_name)[0] + ".wav")
-                    self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Writing '{output_file_path}'...")
-                    sf.write(output_file_path, converted_audio_24.T, self.sc.efx_control.sr_dec, subtype = 'FLOAT')
-
-                    # もし self.max_sec より長い音声が来たら、エラー処理が必要
-                    self.success = True
-                else:
-                    wx.MessageBox(
-                        "Unsupported file format. Please drop an audio file ('.wav', '.ogg', '.mp3', '.m4a', '.flac', '.opus').", 
-                        "Error", 
-                        wx.OK | wx.ICON_ERROR,
-                    )
-                    self.success = False
+                # OS 依存のパス区切り文字を修正。なおドライブレター等はうまく処理できない
+                offline_load_path = file_path.replace('/', self.os_sep).replace('\\', self.os_sep) 
+
+                # 入力ファイルのあるフォルダにサブディレクトリを作り、変換後のファイルを同名で保存
+                load_dir_name = os.path.dirname(offline_load_path)
+                load_file_name = os.path.basename(offline_load_path)
+                save_dir_name = os.path.join(load_dir_name, "converted")
+                os.makedirs(save_dir_name, exist_ok = True)
+
+                # 書き出す音声ファイルのパスを設定。出力は self.sc.sr_dec こと 24k になる。
+                output_file_path = os.path.join(save_dir_name, os.path.splitext(load_file_name)[0] + ".wav")
+                job = self.sc.offline_worker.submit(file_path, output_file_path)
+                self.logger.debug(f"({inspect.currentframe().f_code.co_name}) Queued offline VC job {job.job_id}: '{offline_load_path}' -> '{output_file_path}'")
+                success = True
             except Exception as e:
                 wx.MessageBox(f"An error occurred while dropping files: {str(e)}", "Error", wx.OK | wx.ICON_ERROR)
-                self.success = False
-
-        self.sc.offline_conversion_now = False
-        self.sc.skip_always = self.skip_orig
-        
-        return self.success
-
-
-    def read_audio(
-        self, 
-        file_path: str, 
-        max_sec: float = 16.0,
-    ):
-        _, file_extension = os.path.splitext(file_path) # 拡張子はドット . を含む
-
-        if file_extension.lower() in ['.wav', '.flac', '.ogg']:
-            audio, sr = librosa.load(file_path, sr = None, mono = True, duration = max_sec)
-            if audio.ndim == 1:
-                audio = audio[np.newaxis, :]
-            return audio.astype('float32'), int(sr)
-
-        elif file_extension.lower() in ['.mp3', '.m4a', '.opus']:
-            audio = AudioSegment.from_file(file_path)
-            sr = audio.frame_rate
-            audio = audio.set_channels(1) if audio.channels == 2 else audio  # Ensure mono audio
-            audio = audio.set_sample_width(2)    # Set sample width to 16-bit (adjust as needed)
-        
-            if max_sec < len(audio) / 1000:
-                audio = audio[:max_sec * 1000] # 操作はミリ秒単位で実施する必要がある
 
-            audio = audio.get_array_of_samples()
-            audio = np.array(audio, dtype = 'float32') / 32768.0  # Normalize to float32
-            if audio.ndim == 1:
-                audio = audio[np.newaxis, :]
-
-            return audio, int(sr)  # Assume 16kHz sample rate for pydub
-        else:
-            raise ValueError(f"Unsupported file extension: {file_extension}")
+        return success # TypeError: invalid result from AudioDropTarget.OnDropFiles(), a 'bool' is expected not 'NoneType'
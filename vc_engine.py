@@ -36,6 +36,166 @@ so.log_severity_level = 3
 
 
 from utils import pred_contentvec_len, make_cross_extra_kernel, make_beep
+from spectrum_analyzer import LogSpecAnalyzer
+from snapshot_buffer import FrameSnapshot
+
+
+# model_device の設定値から、ONNX Runtime の provider リストとデバイス名を決める
+def select_onnx_providers(model_device: str):
+    # 特定の GPU を決め打ちで使いたい場合は CUDA_VISIBLE_DEVICESを設定
+    if model_device == "cuda:0":
+        os.environ["CUDA_VISIBLE_DEVICES"] = "0"
+        return ['CUDAExecutionProvider', 'CPUExecutionProvider'], "cuda:0"
+    elif model_device == "cuda:1":
+        os.environ["CUDA_VISIBLE_DEVICES"] = "1"
+        return ['CUDAExecutionProvider', 'CPUExecutionProvider'], "cuda:1"
+    elif model_device == "cpu":
+        return ['CPUExecutionProvider'], "cpu"
+    else:
+        return ['CUDAExecutionProvider', 'CPUExecutionProvider'], "cuda" # つまり "cuda:2" 以降のデバイス指定は無視される
+
+
+# ソース音声だけで決まる特徴量（HarmoF0 の F0、エネルギー、スペクトログラムと、ContentVec の出力）を求める。
+# engine が feature_cache（FeatureCache）を持っていれば、そこにあるものは再計算しない。
+# キャッシュは float16 で持つので、キャッシュ有効時は計算直後の値も float16 に丸めて、初回と 2 回目以降の出力を揃える。
+# キャッシュは 1 つの音声（1 行、パディングなし）だけを対象にする。長さの違うファイルをゼロ埋めでまとめたバッチは、
+# キーがバッチの組み合わせで決まってしまい、ファイル単位では二度と当たらないエントリで LRU を埋めるだけなので使わない
+
+def extract_source_features(
+    engine,
+    tensor_i16,
+    n_valid = None,
+):
+    cache = getattr(engine, "feature_cache", None)
+    if tensor_i16.shape[0] > 1 or (n_valid is not None and int(n_valid[0]) < tensor_i16.shape[-1]):
+        cache = None
+    if cache is not None:
+        key = cache.make_key(tensor_i16, (engine.harmof0_ckpt, engine.CE_ckpt), engine.sr_proc)
+        features = cache.get(key)
+        if features is not None:
+            return {name: np.asarray(value, dtype = np.float32) for name, value in features.items()}
+
+    real_F0, activation, real_N, spec_chunk = engine.sess_HarmoF0.run(
+        ['freq_t', 'act_t', 'energy_t', 'spec'], 
+        {"input": tensor_i16},
+    )
+    content0 = engine.sess_CE.run(
+        ['last_hidden_state'], 
+        {'input': tensor_i16},
+    )[0] # ["last_hidden_state"]
+    content0 = content0.transpose(0, 2, 1)
+    # ここは現在ステレオ対応
+
+    # スペクトログラムは話者スタイルの推定に使う帯域だけを持つ
+    features = {"real_F0": real_F0, "real_N": real_N, "content": content0, "spec": spec_chunk[:, 48:, :]}
+    if cache is not None:
+        cache.put(key, features)
+        features = {name: value.astype(np.float16).astype(np.float32) for name, value in features.items()}
+    return features
+
+
+# (batch, time) の 16 kHz 音声を、全体を一度に各モデルへ通して変換する。
+# engine は sess_HarmoF0, sess_CE, sess_SE, sess_f0n, sess_dec と、auto_encode 以外の変換設定
+# （pitch_shift, absolute_pitch, estimate_energy）を持つオブジェクト。AudioEfx とオフライン専用の OfflineEngine が該当する。
+# style_vect が None なら入力自身からスタイルを推定する。戻り値は (音声 (batch, time) @ sr_dec, 使ったスタイル)
+# 長さの違う音声を末尾ゼロ埋めでバッチにした場合は、n_valid に各行の有効サンプル数を渡すと、
+# スタイルの推定を各行の有効区間のスペクトログラムだけで行う（パディングの無音がスタイルに混ざらない）
+
+def run_offline_models(
+    engine,
+    tensor_i16,
+    style_vect = None,
+    n_valid = None,
+):
+    features = extract_source_features(engine, tensor_i16, n_valid = n_valid)
+    spec_chunk = features["spec"]
+    # 末尾（時間）次元を 4 の倍数に切り詰める
+    spec_size_by_four = (spec_chunk.shape[-1] // 4) * 4
+
+    # 話者スタイルの算出。出力は時間のない (batch, 128)
+    if style_vect is None and n_valid is not None:
+        style_list = []
+        for i, n in enumerate(n_valid):
+            n_spec = int(math.ceil(spec_chunk.shape[-1] * n / tensor_i16.shape[-1]))
+            n_spec = max(4, min(n_spec, spec_chunk.shape[-1]) // 4 * 4)
+            style_list.append(engine.sess_SE.run(
+                ['output'], 
+                {'input': spec_chunk[i:i+1, np.newaxis, :, :n_spec]},
+            )[0])
+        style_vect = np.concatenate(style_list, axis = 0)
+    elif style_vect is None:
+        style_vect = engine.sess_SE.run(
+            ['output'], 
+            {'input': spec_chunk[:, np.newaxis, :, :spec_size_by_four]},
+        )[0]
+    
+    if style_vect.shape[0] == 1 and spec_chunk.shape[0] > 1:
+        style_vect = np.tile(style_vect, (spec_chunk.shape[0], 1))
+    elif style_vect.shape[0] != spec_chunk.shape[0]:
+        style_vect = np.tile(style_vect[0, :], (spec_chunk.shape[0], 1))
+
+    tensor_recon = decode_with_styles(engine, features, style_vect)
+    return tensor_recon, style_vect # 出力は sr_dec こと 24k になる。
+
+
+# ソース音声の特徴量とスタイル (batch, 128) から、f0n とデコーダを通して音声を作る。特徴量の batch はスタイルと揃えること
+
+def decode_with_styles(
+    engine,
+    features,
+    style_vect,
+):
+    real_F0, real_N, content0 = features["real_F0"], features["real_N"], features["content"]
+    pred_F0, pred_N = engine.sess_f0n.run(
+        ['pred_F0', 'pred_N'], 
+        {
+            'content': content0, 
+            'style': style_vect,
+        },
+    )
+
+    if engine.absolute_pitch:
+        pitch_chunk = pred_F0 * 2**((engine.pitch_shift) / 12)
+    else:
+        pitch_chunk = real_F0 * 2**((engine.pitch_shift) / 12)
+
+    if engine.estimate_energy:
+        energy_chunk = pred_N
+    else:
+        energy_chunk = real_N
+
+    tensor_recon = engine.sess_dec.run(
+        ['output'], 
+        {
+            'content': content0,
+            'pitch': pitch_chunk[:, -content0.shape[2]*2:],
+            'energy': energy_chunk[:, -content0.shape[2]*2:],
+            'style': style_vect,
+        },
+    )[0].squeeze(1)
+    
+    return np.clip(tensor_recon, -1, 1)
+
+
+# 1 本の 16 kHz 音声 (1, time) を、K 個のスタイル (K, 128) でそれぞれ変換する。
+# HarmoF0 と ContentVec は 1 回だけ走らせ、その出力を K 本に複製して f0n とデコーダをバッチで通す。
+# max_batch を指定すると、メモリを抑えるためにその本数ずつに分けて通す。戻り値は (K, time) @ sr_dec
+
+def run_multi_style(
+    engine,
+    tensor_i16,
+    style_vects,
+    max_batch: int = 8,
+):
+    features = extract_source_features(engine, tensor_i16)
+    outputs = []
+    for k0 in range(0, style_vects.shape[0], max_batch):
+        styles = np.ascontiguousarray(style_vects[k0:k0 + max_batch], dtype = np.float32)
+        tiled = {
+            name: np.repeat(features[name], styles.shape[0], axis = 0) for name in ("real_F0", "real_N", "content")
+        }
+        outputs.append(decode_with_styles(engine, tiled, styles))
+    return np.concatenate(outputs, axis = 0)
 
 
 class AudioEfx:
@@ -54,21 +214,7 @@ class AudioEfx:
         
         # バックエンド作成前に、利用可能な GPU の数を見ておく
 
-        # 特定の GPU を決め打ちで使いたい場合は CUDA_VISIBLE_DEVICESを設定
-        if self.vc_config["model"]["model_device"] == "cuda:0":
-            os.environ["CUDA_VISIBLE_DEVICES"] = "0"
-            self.onnx_provider_list = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-            self.device = "cuda:0"
-        elif self.vc_config["model"]["model_device"] == "cuda:1":
-            os.environ["CUDA_VISIBLE_DEVICES"] = "1"
-            self.onnx_provider_list = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-            self.device = "cuda:1"
-        elif self.vc_config["model"]["model_device"] == "cpu":
-            self.onnx_provider_list = ['CPUExecutionProvider']
-            self.device = "cpu"
-        else:
-            self.onnx_provider_list = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-            self.device = "cuda" # つまり "cuda:2" 以降のデバイス指定は無視される
+        self.onnx_provider_list, self.device = select_onnx_providers(self.vc_config["model"]["model_device"])
         self.logger.debug(f"ONNX Runtime provider: {str(self.onnx_provider_list)}")
 
         # 以下の変数は実際にロードされる重みそのものではなく、その相対パスを示す文字列
@@ -122,6 +268,9 @@ class AudioEfx:
         self.substitute_all_for_f0n_pred = self.vc_config["substitute_all_for_f0n_pred"]
         self.spec_rt_i = self.vc_config["spec_rt_i"]
         self.spec_rt_o = self.vc_config["spec_rt_o"]
+        # 表示用スペクトログラムの計算方法 ["HarmoF0", "NumPy"] = [0, 1]。古い config には存在しないので get で読む
+        self.spec_source_i = self.vc_config.get("spec_source_i", 0)
+        self.spec_source_o = self.vc_config.get("spec_source_o", 1) # config_manager の既定値と揃える
         self.activation_threshold = self.vc_config["activation_threshold"]
 
         #### buffer settings and definition
@@ -277,7 +426,12 @@ class AudioEfx:
         self.proc_head = 0 # バックエンドから何サンプル取り込んだか（入力デバイスのサンプリング周波数準拠）
         self.pre_lap: float = 0.0 # 1 回の推論呼び出しにおいて、取り込んだ音声を VC 用に前処理するときの所要時間
         self.vc_lap: float = 0.0
+        # 直近の vc_lap の履歴（リング）。オフライン変換のワーカーが p99 を見て、リアルタイム側が苦しいときは待つ
+        self.vc_lap_history = np.zeros(256, dtype = np.float64)
+        self.vc_lap_time = np.zeros(256, dtype = np.float64) # 各 vc_lap を記録した時刻（time.monotonic）。古い履歴を除くのに使う
+        self.n_vc_lap = 0
         self.post_lap: float = 0.0
+        self.spec_o_lap: float = 0.0 # 出力音声のスペクトログラム（表示専用）の計算時間
         self.total_end_time = time.perf_counter_ns() # 前のイテレーションの終了時刻を記録する
 
         #### ネットワークの初期化
@@ -443,6 +597,31 @@ class AudioEfx:
         wav_o_for_spec = librosa.resample(tensor_recon, orig_sr = self.sr_dec, target_sr = self.sr_proc, res_type = "polyphase")
         
         self.logger.debug(f"Decoded tensor: {tensor_recon.shape[1]} samples ({self.sr_dec} Hz) -> {wav_o.shape[1]} samples ({self.sc.sr_out} Hz) for output -> {wav_o_for_spec.shape} samples for spectrogram.")
+
+        #### 表示専用の軽量スペクトログラム
+
+        # 出力音声（および VC に不要な場合の入力音声）のスペクトログラムは表示にしか使わないので、
+        # HarmoF0 の代わりに NumPy の解析器で計算できる。resample も不要なように sr_out のまま処理する
+        self.spec_analyzer_i = self.make_spec_analyzer()
+        self.spec_analyzer_o = self.make_spec_analyzer()
+
+        # HarmoF0 (ONNX) とコストを比較しておく。状態を汚さないよう使い捨ての解析器で計測
+        test_analyzer = self.make_spec_analyzer()
+        _ = test_analyzer.process(wav_o[:, -self.sc.blocksize:])
+        time0 = time.perf_counter_ns() # time in nanosecond
+        spec_chunk = test_analyzer.process(wav_o[:, -self.sc.blocksize:])
+        self.spec_o_lap = (time.perf_counter_ns() - time0)/1e+6
+        self.logger.debug(f"Lightweight spectrum analyzer: {self.sc.blocksize} samples ({self.sc.sr_out} Hz) was converted {str(list(spec_chunk.shape))} in {self.spec_o_lap: >7.2f} ms (HarmoF0: {self.harmof0_lap: >7.2f} ms)")
+
+        #### GUI へのバッファ公開
+
+        # プロット用のバッファは、更新分だけを FrameSnapshot 経由で GUI に渡す（GUI 側での deepcopy が不要になる）
+        # バッファ本体（self.buf_spec_p 等）はこれまで通り VC の計算に使う
+        self.snapshots = {
+            "buf_spec_p": FrameSnapshot(self.buf_spec_p),
+            "buf_spec_o": FrameSnapshot(self.buf_spec_o),
+            "buf_emb": FrameSnapshot(self.buf_emb),
+        }
         
         #### クロスフェード関係の変数
 
@@ -491,9 +670,14 @@ class AudioEfx:
 
         #### ここから VC パート。skip は inference の引数で、VC パートの重い処理をすっ飛ばして入力を出力に垂れ流す。
 
+        # VC が入力音声の実測 F0 ないし energy を必要とするか（このとき HarmoF0 は省略できない）
+        need_real_f0n = skip == False and (self.absolute_pitch is False or self.estimate_energy is False)
+        # 上記が不要で、かつ buf_spec_p を Style Encoder に使わないなら、入力スペクトログラムは表示専用なので軽量版で済む
+        use_analyzer_i = self.spec_source_i == 1 and self.auto_encode is False and need_real_f0n is False
+
         # 入力信号スペクトログラムの計算は VC をスキップしない場合、もしくはリアルタイム更新が "always" の場合
 #        if skip == False or self.spec_rt_i == 0:
-        if ((skip == False and self.spec_rt_i == 1) and (self.absolute_pitch is False or self.estimate_energy is False)) or self.spec_rt_i == 0:
+        if (need_real_f0n and self.spec_rt_i == 1) or (self.spec_rt_i == 0 and use_analyzer_i is False):
             time0 = time.perf_counter_ns()
             # HarmoF0 で正解ピッチを計算し、同時に Wav2spec してバッファに入れる。VC を適用する場合は省略できない
             real_F0, activation, real_N, spec_chunk = self.sess_HarmoF0.run(
@@ -507,11 +691,13 @@ class AudioEfx:
             self.buf_activation = np.roll(self.buf_activation, -self.sc.block_roll_size*2, axis = 1)
             if self.substitute_all_for_spec is True:
                 self.buf_spec_p[:, :, -spec_chunk.shape[2]:] = spec_chunk
+                self.snapshots["buf_spec_p"].publish(spec_chunk, n_new = self.sc.block_roll_size*2)
                 self.buf_f0_real[:, -real_F0.shape[1]:] = real_F0
                 self.buf_energy_real[:, -real_N.shape[1]:] = real_N
                 self.buf_activation[:, -activation.shape[1]:] = activation
             else:
                 self.buf_spec_p[:, :, -self.sc.block_roll_size*2:] = spec_chunk[:, :, -self.sc.block_roll_size*2:]
+                self.snapshots["buf_spec_p"].publish(spec_chunk[:, :, -self.sc.block_roll_size*2:])
                 self.buf_f0_real[:, -self.sc.block_roll_size*2:] = real_F0[:, -self.sc.block_roll_size*2:]
                 self.buf_energy_real[:, -self.sc.block_roll_size*2:] = real_N[:, -self.sc.block_roll_size*2:]
                 self.buf_activation[:, -self.sc.block_roll_size*2:] = activation[:, -self.sc.block_roll_size*2:]
@@ -520,6 +706,18 @@ class AudioEfx:
             # 以下はプロット用に、f0 の実測と予測を合わせたもの
             self.buf_f0_all = np.concatenate((self.buf_f0_real, self.buf_f0_pred), axis = 0)
 
+        elif use_analyzer_i and (self.spec_rt_i == 0 or (self.spec_rt_i == 1 and skip == False)): # "none" (2) では計算しない
+            time0 = time.perf_counter_ns()
+            if self.spec_analyzer_i.sr != self.sc.sr_out: # デバイス変更でサンプリング周波数が変わった場合
+                self.spec_analyzer_i = self.make_spec_analyzer()
+            spec_chunk = self.spec_analyzer_i.process(self.buf_wav_i[:, -in_blocksize:], head = self.proc_head)
+            # F0 等は計算しないので spec だけ進める。1 block で進むフレーム数は通常 block_roll_size*2 に一致する
+            if spec_chunk.shape[2] > 0:
+                self.buf_spec_p = np.roll(self.buf_spec_p, -spec_chunk.shape[2], axis = 2)
+                self.buf_spec_p[:, :, -spec_chunk.shape[2]:] = spec_chunk
+                self.snapshots["buf_spec_p"].publish(spec_chunk)
+            self.harmof0_lap = (time.perf_counter_ns() - time0)/1e+6
+
         # ここからの工程は VC を適用する場合のみ必要
         if skip == False:
             # 16k buffer から ContentVec を計算する
@@ -551,8 +749,10 @@ class AudioEfx:
             # 経験上、ネットワークに通した全サンプルを使った方が音質が安定する
             if self.substitute_all_for_content is True:
                 self.buf_emb[:, :, -content0.shape[2]:] = content0
+                self.snapshots["buf_emb"].publish(content0, n_new = self.sc.block_roll_size)
             else:
                 self.buf_emb[:, :, -self.sc.block_roll_size:] = content0[:, :, -self.sc.block_roll_size:]
+                self.snapshots["buf_emb"].publish(content0[:, :, -self.sc.block_roll_size:])
             self.CE_lap = (time.perf_counter_ns() - time0)/1e+6
 
             # 話者スタイルの算出。出力は時間のない (batch, 128)
@@ -666,26 +866,47 @@ class AudioEfx:
         if (skip == False and self.spec_rt_o == 1) or self.spec_rt_o == 0:
             # ただし表示タブが 0 つまり monitor のときだけ必要。いったん backend に戻らないと Frame を参照できない
             if self.sc.host.GetTopLevelParent().active_tab == 0:
-                wav_o_for_spec = librosa.resample(
-                    self.buf_wav_o[:, -(self.sc.blocksize+self.cross_fade_samples):], 
-                    orig_sr = self.sc.sr_out, 
-                    target_sr = self.sr_proc, 
-                    res_type = "polyphase",
-                )
-                recon_F0, recon_act, recon_N, recon_spec = self.sess_HarmoF0.run(
-                    ['freq_t', 'act_t', 'energy_t', 'spec'], 
-                    {"input": wav_o_for_spec[:, -self.len_w2m:].astype(np.float32)},
-                ) # time last
-                self.buf_spec_o = np.roll(self.buf_spec_o, -self.sc.block_roll_size*2, axis = 2)
-                if self.substitute_all_for_spec is True or recon_spec.shape[-1] < self.sc.block_roll_size*2:
-                    self.buf_spec_o[:, :, -recon_spec.shape[2]:] = recon_spec
+                time0 = time.perf_counter_ns()
+                if self.spec_source_o == 1:
+                    if self.spec_analyzer_o.sr != self.sc.sr_out:
+                        self.spec_analyzer_o = self.make_spec_analyzer()
+                    # 次の周回でクロスフェードが足される末尾を除き、確定した 1 block 分だけを流し込む
+                    if self.cross_fade_samples > 0:
+                        block_o = self.buf_wav_o[:, -(in_blocksize+self.cross_fade_samples):-self.cross_fade_samples]
+                    else:
+                        block_o = self.buf_wav_o[:, -in_blocksize:]
+                    recon_spec = self.spec_analyzer_o.process(block_o, head = self.proc_head)
+                    if recon_spec.shape[2] > 0:
+                        self.buf_spec_o = np.roll(self.buf_spec_o, -recon_spec.shape[2], axis = 2)
+                        self.buf_spec_o[:, :, -recon_spec.shape[2]:] = recon_spec
+                        self.snapshots["buf_spec_o"].publish(recon_spec)
                 else:
-                    self.buf_spec_o[:, :, -self.sc.block_roll_size*2:] = recon_spec[:, :, -self.sc.block_roll_size*2:]
+                    wav_o_for_spec = librosa.resample(
+                        self.buf_wav_o[:, -(self.sc.blocksize+self.cross_fade_samples):], 
+                        orig_sr = self.sc.sr_out, 
+                        target_sr = self.sr_proc, 
+                        res_type = "polyphase",
+                    )
+                    recon_F0, recon_act, recon_N, recon_spec = self.sess_HarmoF0.run(
+                        ['freq_t', 'act_t', 'energy_t', 'spec'], 
+                        {"input": wav_o_for_spec[:, -self.len_w2m:].astype(np.float32)},
+                    ) # time last
+                    self.buf_spec_o = np.roll(self.buf_spec_o, -self.sc.block_roll_size*2, axis = 2)
+                    if self.substitute_all_for_spec is True or recon_spec.shape[-1] < self.sc.block_roll_size*2:
+                        self.buf_spec_o[:, :, -recon_spec.shape[2]:] = recon_spec
+                        self.snapshots["buf_spec_o"].publish(recon_spec, n_new = self.sc.block_roll_size*2)
+                    else:
+                        self.buf_spec_o[:, :, -self.sc.block_roll_size*2:] = recon_spec[:, :, -self.sc.block_roll_size*2:]
+                        self.snapshots["buf_spec_o"].publish(recon_spec[:, :, -self.sc.block_roll_size*2:])
+                self.spec_o_lap = (time.perf_counter_ns() - time0)/1e+6
     
         # ラップタイムの計測
         self.post_lap = (time.perf_counter_ns() - self.vc_end_time)/1e+6 # Ryzen 3700X で 8--19 ms 程度（非コンパイル時）
         # vc_lap が実際の所要時間を表す指標
         self.vc_lap = (time.perf_counter_ns() - self.send_time0)/1e+6 
+        self.vc_lap_history[self.n_vc_lap % self.vc_lap_history.shape[0]] = self.vc_lap
+        self.vc_lap_time[self.n_vc_lap % self.vc_lap_time.shape[0]] = time.monotonic()
+        self.n_vc_lap += 1
         # total_lap は「前のフレーム終了から現フレーム終了まで」なので、「VC 所要時間＋次のコールバックまでの待ち時間」
         self.total_lap = (time.perf_counter_ns() - self.total_end_time)/1e+6
         self.total_end_time = time.perf_counter_ns() 
@@ -706,67 +927,43 @@ class AudioEfx:
         return self.inference(in_block)
 
 
+    # 表示専用の軽量スペクトログラム解析器を、現在の backend の設定で作る
+    def make_spec_analyzer(self):
+        return LogSpecAnalyzer(
+            sr = self.sc.sr_out,
+            hop_size = self.sc.sr_out // 100, # HarmoF0 と同じ 10 ms hop
+            fmin = self.spec_fmin,
+            n_bins = self.dim_spec,
+            bins_per_octave = 48,
+            n_channel = len(self.ch_map),
+        )
+
+
     # (batch, time) の numpy array を読み込み、現在の変換設定に従って全体を変換する
+    # style_vect を与えた場合はそれを使う（長いファイルを区間ごとに変換するとき、区間の間でスタイルを揃えるため）
     
     def convert_offline(
         self,
         tensor_i16,
+        style_vect = None,
+        return_style: bool = False, # True なら (音声, 実際に使ったスタイル) を返す
+        n_valid = None, # 末尾をゼロ埋めしたバッチの場合、各行の有効サンプル数
     ):
-        real_F0, activation, real_N, spec_chunk = self.sess_HarmoF0.run(
-            ['freq_t', 'act_t', 'energy_t', 'spec'], 
-            {"input": tensor_i16},
-        )
-        # 末尾（時間）次元を 4 の倍数に切り詰める
-        spec_size_by_four = (spec_chunk.shape[-1] // 4) * 4
-
-        content0 = self.sess_CE.run(
-            ['last_hidden_state'], 
-            {'input': tensor_i16},
-        )[0] # ["last_hidden_state"]
-        content0 = content0.transpose(0, 2, 1)
-        # ここは現在ステレオ対応
-
-        # 話者スタイルの算出。出力は時間のない (batch, 128)
-        if self.auto_encode:
-            style_vect = self.sess_SE.run(
-                ['output'], 
-                {'input': spec_chunk[:, np.newaxis, 48:, :spec_size_by_four]},
-            )[0]
-        else:
+        # 自動推定しない場合は、現在の VC の変換先スタイルを使う
+        if style_vect is None and not self.auto_encode:
             style_vect = self.sc.current_target_style
-        
-        if style_vect.shape[0] == 1 and spec_chunk.shape[0] > 1:
-            style_vect = np.tile(style_vect, (spec_chunk.shape[0], 1))
-        elif style_vect.shape[0] != spec_chunk.shape[0]:
-            style_vect = np.tile(style_vect[0, :], (spec_chunk.shape[0], 1))
-
-        pred_F0, pred_N = self.sess_f0n.run(
-            ['pred_F0', 'pred_N'], 
-            {
-                'content': content0, 
-                'style': style_vect,
-            },
-        )
+        tensor_recon, style_vect = run_offline_models(self, tensor_i16, style_vect = style_vect, n_valid = n_valid)
+        if return_style:
+            return tensor_recon, style_vect
+        return tensor_recon # 出力は self.sr_dec こと 24k になる。
 
-        if self.absolute_pitch:
-            pitch_chunk = pred_F0 * 2**((self.pitch_shift) / 12)
-        else:
-            pitch_chunk = real_F0 * 2**((self.pitch_shift) / 12)
 
-        if self.estimate_energy:
-            energy_chunk = pred_N
-        else:
-            energy_chunk = real_N
-
-        tensor_recon = self.sess_dec.run(
-            ['output'], 
-            {
-                'content': content0,
-                'pitch': pitch_chunk[:, -content0.shape[2]*2:],
-                'energy': energy_chunk[:, -content0.shape[2]*2:],
-                'style': style_vect,
-            },
-        )[0].squeeze(1)
-        
-        return np.clip(tensor_recon, -1, 1) # 出力は self.sr_dec こと 24k になる。
+    # 同じ音声を複数のスタイル (K, 128) で変換する。出力は (K, time) @ self.sr_dec
+    def convert_offline_styles(
+        self,
+        tensor_i16,
+        style_vects,
+        max_batch: int = 8,
+    ):
+        return run_multi_style(self, tensor_i16, style_vects, max_batch = max_batch)
 
@@ -30,6 +30,7 @@ from plot_waveform import PlotWaveformPanel
 from plot_spectrogram import PlotSpecPanel
 
 from plot_content import PlotEmbeddingPanel
+from gui_scheduler import start_update_timer, PRIORITY_MONITOR
 
 #### 再生ボタン類とスライダー制御をまとめた部品クラス。
 
@@ -130,6 +131,17 @@ class MonitorWidgets(scrolled.ScrolledPanel):
         self.spec_rt_i_sizer.Add(self.spec_rt_i_rbx, flag = wx.GROW | wx.ALL, border = 0)
         self.spec_rt_i_rbx.SetSelection(int(self.sc.efx_control.spec_rt_i)) # 初期状態
         self.spec_rt_i_rbx.SetToolTip('VC needs the real-time calculation of the spectrogram when the pitch mode is "source" or the energy mode is "same as source"')
+        self.spec_source_i_rbx = wx.RadioBox(
+            self, 
+            wx.ID_ANY, 
+            "Analyzer", 
+            choices = ["HarmoF0", "NumPy"], 
+            majorDimension = 1,
+        )
+        self.spec_source_i_rbx.Bind(wx.EVT_RADIOBOX, self.on_spec_source_i)
+        self.spec_rt_i_sizer.Add(self.spec_source_i_rbx, flag = wx.GROW | wx.ALL, border = 0)
+        self.spec_source_i_rbx.SetSelection(int(self.sc.efx_control.spec_source_i)) # 初期状態
+        self.spec_source_i_rbx.SetToolTip('The NumPy analyzer is used only while VC needs neither the source pitch/energy nor the auto-encoded style')
         
         self.spec_rt_o_sizer = wx.BoxSizer(wx.VERTICAL)
         self.spec_rt_o_rbx = wx.RadioBox(
@@ -143,6 +155,17 @@ class MonitorWidgets(scrolled.ScrolledPanel):
         self.spec_rt_o_sizer.Add(self.spec_rt_o_rbx, flag = wx.GROW | wx.ALL, border = 0)
         self.spec_rt_o_rbx.SetSelection(int(self.sc.efx_control.spec_rt_o)) # 初期状態
         self.spec_rt_o_rbx.SetToolTip('Extra calculation time (~ 20 ms)')
+        self.spec_source_o_rbx = wx.RadioBox(
+            self, 
+            wx.ID_ANY, 
+            "Analyzer", 
+            choices = ["HarmoF0", "NumPy"], 
+            majorDimension = 1,
+        )
+        self.spec_source_o_rbx.Bind(wx.EVT_RADIOBOX, self.on_spec_source_o)
+        self.spec_rt_o_sizer.Add(self.spec_source_o_rbx, flag = wx.GROW | wx.ALL, border = 0)
+        self.spec_source_o_rbx.SetSelection(int(self.sc.efx_control.spec_source_o)) # 初期状態
+        self.spec_source_o_rbx.SetToolTip('The NumPy analyzer is much lighter than HarmoF0 (display only)')
         
         ####
         
@@ -177,9 +200,8 @@ class MonitorWidgets(scrolled.ScrolledPanel):
 
         self.SetupScrolling() # こいつだけはスクロールを有効化する必要がある
 
-        self.timer = wx.Timer(self) # wx.Timer クラスで、指定間隔での処理を実行する。
-        self.Bind(wx.EVT_TIMER, self.update, self.timer)
-        self.timer.Start(37) # タイマーは手動で起動する必要がある。単位 ms
+        # 主窓の GuiScheduler に登録し、画面に出ている間だけ呼ばれる。単位 ms
+        self.timer = start_update_timer(self, self.update, 37, priority = PRIORITY_MONITOR)
 
     def update(self, event):
         self.info_i_text.SetLabel(f"Input:\n{self.sc.sr_out} Hz\nn_ch: {self.sc.n_ch_in_use[0]}")
@@ -200,6 +222,14 @@ class MonitorWidgets(scrolled.ScrolledPanel):
 #        self.spec_rt_o_rbx.SetSelection(int(self.sc.efx_control.spec_rt_o))
         self.sc.update_vc_config("spec_rt_o", self.sc.efx_control.spec_rt_o, save = False)
 
+    def on_spec_source_i(self, event):
+        self.sc.efx_control.spec_source_i = self.spec_source_i_rbx.GetSelection() # ["HarmoF0", "NumPy"] = [0, 1]
+        self.sc.update_vc_config("spec_source_i", self.sc.efx_control.spec_source_i, save = False)
+
+    def on_spec_source_o(self, event):
+        self.sc.efx_control.spec_source_o = self.spec_source_o_rbx.GetSelection() # ["HarmoF0", "NumPy"] = [0, 1]
+        self.sc.update_vc_config("spec_source_o", self.sc.efx_control.spec_source_o, save = False)
+
 
 # お行儀を考えると、Frame のメソッドとして書くのではなく、ConfManager みたいなクラスを用意して機能をまとめるべきだろうが
 